@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+## @package proxen.audit
+# @brief Fleet-wide proxy audit: scans the profile files of all the user homes on a host
+# (or in a list of filesystem roots, e.g. container images) and reports the effective
+# proxy settings and the problems of each account (Unix only).
+#
+# For each account, the system files of its root (sysproxy::UNIX_PROFILE_FILES_SYS) and the
+# user files in its home (sysproxy::UNIX_PROFILE_FILES_USR) are read in that order, as a login
+# shell would, and the proxy exports are checked for:
+# - `duplicate`: a variable exported more than once
+# - `case_conflict`: the lower- and upper-case variables have different values
+# - `credentials`: a user name and password in plain text
+# - `invalid`: a proxy URL that cannot be parsed (see sysproxy::parse_proxy())
+# - `stale`: a value different from a reference config (if given)
+#
+# The files are parsed in-process (see sysproxy::parse_profile()) by a pool of worker
+# processes. Parsed files are cached by their mtime and size (see CACHE_FILE), so a re-scan
+# only parses the files changed since the previous scan. Only masked values (see mask())
+# are kept, in the parse results and in the cache (written with mode CACHE_MODE), so
+# passwords never leave the profile files; values are compared without their passwords.
+#
+# Command line (see proxen::parse_args()):
+# ```
+# python proxen.py audit [--root DIR...] [--home DIR...] [-c CONFIG] [--json FILE]
+# ```
+import os, re, json, time, dataclasses, concurrent.futures
+
+import utils
+import sysproxy
+
+# --------------------------------------------------------------- #
+
+## `tuple` lower-case names of the audited env variables
+AUDIT_ENVS = sysproxy.PROXY_TYPES + ('all_proxy', 'no_proxy')
+## `tuple` lower-case names of the env variables holding proxy URLs
+URL_ENVS = sysproxy.PROXY_TYPES + ('all_proxy',)
+## `str` default cache file (in the project dir) with the parsed files
+CACHE_FILE = 'audit_cache.json'
+## `int` cache format version: a cache of another version is dropped
+CACHE_VERSION = 3
+## `int` permissions of the cache file (it lists the proxy settings of all the accounts)
+CACHE_MODE = 0o600
+## `int` files are parsed in worker processes only if there are at least so many to parse
+PARALLEL_MIN_FILES = 200
+## `re.Pattern` regex matching a user name and password in a proxy URL
+REGEX_CREDENTIALS = re.compile(r'(://[^:/@\s]+:)([^@\s]+)(@)')
+## `tuple` passwd home dirs that are not real homes
+NO_HOMES = ('/', '/nonexistent', '/dev/null', '/bin', '/sbin', '/usr/sbin')
+
+# --------------------------------------------------------------- #
+
+## @brief An audited account: the system files of a root plus (optionally) a user home.
+@dataclasses.dataclass(frozen=True)
+class Account:
+    ## `str` filesystem root
+    root: str = '/'
+    ## `str` home directory (full path) or `None` for the system files only
+    home: str = None
+    ## `str` user name (empty for the system account)
+    user: str = ''
+
+    ## @returns `list` full paths to the account's profile files in the reading order
+    def files(self) -> list:
+        res = sysproxy.Sysenv(False, root=self.root).system_files()
+        if self.home:
+            res += sysproxy.Sysenv(False, home=self.home).user_files()
+        return list(dict.fromkeys(res))
+
+## @returns `list` `(user, home)` pairs read from the `/etc/passwd` of a root;
+# the homes are full paths (inside the root) of existing directories
+# @param root `str` filesystem root
+def list_homes(root='/') -> list:
+    res = {}
+    try:
+        with open(os.path.join(root, 'etc/passwd'), 'r', encoding=utils.CODING, errors='replace') as f_:
+            lines = f_.readlines()
+    except OSError:
+        return []
+    for line in lines:
+        fields = line.strip().split(':')
+        if len(fields) < 7 or fields[5] in NO_HOMES:
+            continue
+        home = os.path.join(root, fields[5].lstrip('/'))
+        if not home in res and os.path.isdir(home):
+            res[home] = fields[0]
+    return [(user, home) for home, user in res.items()]
+
+## @returns `list` audit::Account objects for the given roots and homes
+# @param roots `iterable` filesystem roots: each gives a system account plus an account
+# for each user in its `/etc/passwd`
+# @param homes `iterable` extra home directories (with the system files of `/`)
+def list_accounts(roots=(), homes=()) -> list:
+    res = []
+    for root in roots:
+        root = os.path.abspath(root)
+        res.append(Account(root))
+        res += [Account(root, home, user) for user, home in list_homes(root)]
+    for home in homes:
+        home = os.path.abspath(home)
+        res.append(Account('/', home, os.path.basename(home)))
+    return list(dict.fromkeys(res))
+
+# --------------------------------------------------------------- #
+
+## Reads and parses a profile file (run in a worker process).
+# @param path `str` full path to the file
+# @returns `tuple` `(path, [mtime_ns, size], exports)`, where exports are
+# `[line, name, masked value, has_credentials]` lists of the audited variables only
+# (see sysproxy::parse_profile() and mask()); the stats and exports are `None` if the file cannot be read
+def parse_file(path) -> tuple:
+    try:
+        with open(path, 'r', encoding=utils.CODING, errors='replace') as f_:
+            st = os.fstat(f_.fileno())
+            txt = f_.read()
+    except OSError:
+        return (path, None, None)
+    exports = [[line, name, mask(value), bool(REGEX_CREDENTIALS.search(value))]
+               for line, name, value in sysproxy.parse_profile(txt, path) if name.lower() in AUDIT_ENVS]
+    return (path, [st.st_mtime_ns, st.st_size], exports)
+
+## @returns `dict` the cache file contents: `{path: [mtime_ns, size, exports]}`
+# @param filename `str` the cache file (default = audit::CACHE_FILE in the project dir)
+def load_cache(filename=None) -> dict:
+    filename = filename or utils.make_abspath(CACHE_FILE)
+    try:
+        with open(filename, 'r', encoding=utils.CODING) as f_:
+            cache = json.load(f_)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict) or cache.pop('version', None) != CACHE_VERSION:
+        return {}
+    return cache
+
+## Writes the cache file (readable by the owner only, see audit::CACHE_MODE).
+# @param cache `dict` the cache (see load_cache())
+# @param filename `str` the cache file (default = audit::CACHE_FILE in the project dir)
+def save_cache(cache, filename=None):
+    filename = filename or utils.make_abspath(CACHE_FILE)
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, CACHE_MODE)
+    with open(fd, 'w', encoding=utils.CODING) as f_:
+        # an existing file keeps its mode on open()
+        os.fchmod(fd, CACHE_MODE)
+        json.dump(dict(cache, version=CACHE_VERSION), f_)
+
+## Reads the exports of many files, parsing only the files changed since they were cached.
+# @param paths `iterable` full paths to the files (missing files are skipped)
+# @param cache `dict` the cache (see load_cache()): updated in place
+# @param jobs `int` number of worker processes (default = number of CPUs; 1 = no pool)
+# @returns `tuple` `(exports, stats)`: `exports` is `{path: exports}` for the existing files;
+# `stats` is `{'files': ..., 'parsed': ..., 'cached': ...}`
+def scan_files(paths, cache, jobs=None) -> tuple:
+    exports = {}
+    to_parse = []
+    nfiles = 0
+    for path in dict.fromkeys(paths):
+        try:
+            st = os.stat(path)
+        except OSError:
+            cache.pop(path, None)
+            continue
+        nfiles += 1
+        entry = cache.get(path)
+        if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            exports[path] = entry[2]
+        else:
+            to_parse.append(path)
+
+    jobs = max(1, jobs or os.cpu_count() or 1)
+    if jobs == 1 or len(to_parse) < PARALLEL_MIN_FILES:
+        parsed = map(parse_file, to_parse)
+    else:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+        parsed = list(pool.map(parse_file, to_parse, chunksize=max(1, len(to_parse) // (jobs * 4))))
+        pool.shutdown()
+    for path, st, exp in parsed:
+        if st is None:
+            cache.pop(path, None)
+            continue
+        cache[path] = [st[0], st[1], exp]
+        exports[path] = exp
+    return exports, {'files': nfiles, 'parsed': len(to_parse), 'cached': nfiles - len(to_parse)}
+
+# --------------------------------------------------------------- #
+
+## @returns `str` a value with the password in proxy URLs replaced by '***'
+def mask(value) -> str:
+    return REGEX_CREDENTIALS.sub(r'\1***\3', value) if value else value
+
+## Checks the proxy exports of an account.
+# @param account `audit::Account` the account
+# @param exports `dict` `{path: exports}` with masked values (see scan_files())
+# @param expected `dict` reference variables (see sysproxy::proxy_envs()) or `None`
+# @param invalid `dict` invalid proxy URLs and their errors (see sysproxy::parse_proxies());
+# if `None`, the account's URLs are parsed here
+# @returns `dict` the account report: `root`, `home`, `user`, `effective` (`{lower-case name: value}`)
+# and `issues` (a list of dicts with the `type`, `name` and details of each issue)
+def analyze(account, exports, expected=None, invalid=None) -> dict:
+    occurrences = {}
+    for path in account.files():
+        for line, name, value, creds in exports.get(path, ()):
+            occurrences.setdefault(name, []).append((f'{path}:{line}', value, creds))
+    values = {name: occ[-1][1] for name, occ in occurrences.items()}
+    if invalid is None:
+        invalid = sysproxy.parse_proxies(value for name, occ in occurrences.items() if name.lower() in URL_ENVS
+                                         for _, value, _ in occ)[1]
+    effective = {}
+    issues = []
+    for env in AUDIT_ENVS:
+        lower, upper = values.get(env), values.get(env.upper())
+        value = lower if lower is not None else upper
+        if value is not None:
+            effective[env] = value
+        if lower is not None and upper is not None and lower != upper:
+            issues.append({'type': 'case_conflict', 'name': env, 'values': {env: lower, env.upper(): upper}})
+        if expected is not None and value != mask(expected.get(env)):
+            issues.append({'type': 'stale', 'name': env, 'expected': mask(expected.get(env)), 'found': value})
+    for name, occ in occurrences.items():
+        if len(occ) > 1:
+            issues.append({'type': 'duplicate', 'name': name, 'locations': [loc for loc, _, _ in occ]})
+        for loc, value, creds in occ:
+            if creds:
+                issues.append({'type': 'credentials', 'name': name, 'location': loc})
+            if value in invalid and name.lower() in URL_ENVS:
+                issues.append({'type': 'invalid', 'name': name, 'location': loc, 'error': invalid[value]})
+    return {'root': account.root, 'home': account.home, 'user': account.user, 'effective': effective, 'issues': issues}
+
+## Audits the proxy exports of many accounts.
+# @param accounts `iterable` audit::Account objects (see list_accounts())
+# @param dconfig `dict` reference proxy config (in the Proxy::asdict() format) to find
+# stale settings, or `None`
+# @param jobs `int` number of worker processes (default = number of CPUs)
+# @param cache_file `str` the cache file (default = audit::CACHE_FILE in the project dir)
+# @param use_cache `bool` if `False`, parse all the files (the cache is still rewritten)
+# @returns `dict` the report: `{'meta': {...}, 'accounts': [account reports (see analyze())]}`
+def audit(accounts, dconfig=None, jobs=None, cache_file=None, use_cache=True) -> dict:
+    if sysproxy.OS == 'Windows':
+        raise Exception('The audit is supported on Unix platforms only!')
+    t0 = time.perf_counter()
+    accounts = list(accounts)
+    cache = load_cache(cache_file) if use_cache else {}
+    exports, stats = scan_files([f for account in accounts for f in account.files()], cache, jobs)
+    expected = sysproxy.proxy_envs(dconfig, False) if dconfig is not None else None
+    # each distinct URL is parsed once for all the accounts
+    invalid = sysproxy.parse_proxies(value for rows in exports.values() for _, name, value, _ in rows
+                                     if name.lower() in URL_ENVS)[1]
+    reports = [analyze(account, exports, expected, invalid) for account in accounts]
+    try:
+        save_cache(cache, cache_file)
+    except OSError as err:
+        utils.log('Cannot write audit cache: %s', 'error', err)
+    meta = dict(stats, time=time.strftime('%Y-%m-%d %H:%M:%S'), accounts=len(accounts),
+                ms=round((time.perf_counter() - t0) * 1000, 1))
+    utils.log('Audited %d account(s) in %.1f ms (%d file(s) parsed, %d cached)', 'info',
+              len(accounts), meta['ms'], stats['parsed'], stats['cached'])
+    return {'meta': meta, 'accounts': reports}
+
+## @returns `str` the accounts with issues as a text report
+# @param report `dict` the audit report (see audit())
+def format_report(report) -> str:
+    lines = []
+    for acc in report['accounts']:
+        if not acc['issues']:
+            continue
+        lines.append(f"{acc['user'] or '<system>'} ({acc['home'] or acc['root']})")
+        for name, value in acc['effective'].items():
+            lines.append(f'    {name} = {value}')
+        for issue in acc['issues']:
+            details = {k: v for k, v in issue.items() if not k in ('type', 'name')}
+            lines.append(f"  ! {issue['type']}: {issue['name']} {json.dumps(details)}")
+    meta = report['meta']
+    nissues = sum(1 for acc in report['accounts'] if acc['issues'])
+    lines.append(f"{meta['accounts']} account(s), {nissues} with issues; {meta['files']} file(s): "
+                 f"{meta['parsed']} parsed, {meta['cached']} cached; {meta['ms']} ms")
+    return '\n'.join(lines)
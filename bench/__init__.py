@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+## @package proxen.bench
+# @brief Benchmark suite for the sysproxy engine (Unix).
+#
+# The benchmarks run against synthetic profile trees (see bench::synth): a temporary
+# HOME and `/etc` root with generated shell profile files of configurable size and
+# export density, either clean or messy (duplicate and mixed-case exports, a huge `no_proxy`).
+# Nothing outside the temporary root is read or written.
+#
+# Usage (from the project dir):
+# ```
+# python -m bench run --sizes 100,1000,10000 --out bench/baselines/mybox.json
+# python -m bench run --compare bench/baselines/mybox.json
+# python -m bench compare bench/baselines/mybox.json new.json
+# python -m bench gui --vars 10000 --compare bench/baselines/mybox-gui.json
+# ```
+# See bench::suite for the benchmark cases and the result format and bench::guilatency
+# for the GUI responsiveness benchmark (needs Qt, runs offscreen).
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+## @package proxen.bench.__main__
+# @brief Command-line entry point of the benchmark suite: `python -m bench {run,gui,compare} ...`
+import sys, argparse
+
+from bench import suite
+
+# --------------------------------------------------------------- #
+
+## Parses the command-line arguments.
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench', description='sysproxy engine benchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_run = subparsers.add_parser('run', help='run the benchmarks')
+    parser_run.add_argument('--sizes', default=','.join(str(s) for s in suite.DEFAULT_SIZES),
+                            help='comma-separated lines per profile file')
+    parser_run.add_argument('--density', type=float, default=0.2, help='share of export lines (0..1)')
+    parser_run.add_argument('--repeat', type=int, default=5, help='timed runs per case')
+    parser_run.add_argument('--cases', default='', help='comma-separated cases (default = all): ' + ', '.join(suite.CASES))
+    kind = parser_run.add_mutually_exclusive_group()
+    kind.add_argument('--clean-only', action='store_true', help='clean trees only')
+    kind.add_argument('--messy-only', action='store_true', help='messy trees only')
+    parser_run.add_argument('--out', help='save the results to this JSON file (e.g. a new baseline)')
+    parser_run.add_argument('--compare', metavar='BASELINE', help='compare the results with a baseline JSON file')
+    parser_run.add_argument('--threshold', type=float, default=suite.DEFAULT_THRESHOLD, help='relative slowdown reported as a regression')
+
+    parser_gui = subparsers.add_parser('gui', help='run the GUI responsiveness benchmark (needs Qt)')
+    parser_gui.add_argument('--vars', type=int, default=10000, help='extra env variables in the env editor scenarios')
+    parser_gui.add_argument('--lines', type=int, default=1000, help='lines per profile file')
+    parser_gui.add_argument('--repeat', type=int, default=3, help='runs of all the scenarios')
+    parser_gui.add_argument('--out', help='save the results to this JSON file (e.g. a new baseline)')
+    parser_gui.add_argument('--compare', metavar='BASELINE', help='compare the results with a baseline JSON file')
+    parser_gui.add_argument('--threshold', type=float, default=suite.DEFAULT_THRESHOLD, help='relative slowdown reported as a regression')
+
+    parser_cmp = subparsers.add_parser('compare', help='compare two result files')
+    parser_cmp.add_argument('baseline', help='baseline JSON file')
+    parser_cmp.add_argument('current', help='current JSON file')
+    parser_cmp.add_argument('--threshold', type=float, default=suite.DEFAULT_THRESHOLD, help='relative slowdown reported as a regression')
+    return parser.parse_args(argv)
+
+## Prints a comparison and returns the exit code (1 if there are regressions).
+def report(baseline, current, threshold):
+    rows = suite.compare(baseline, current, threshold)
+    print(suite.format_table(current, rows))
+    regressions = [row for row in rows if row[4] == 'regression']
+    if regressions:
+        print(f'\n{len(regressions)} regression(s) over {threshold:.0%}', file=sys.stderr)
+        return 1
+    return 0
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == 'compare':
+        return report(suite.load(args.baseline), suite.load(args.current), args.threshold)
+
+    if args.command == 'gui':
+        from bench import guilatency
+        results = guilatency.run_gui_suite(args.vars, args.repeat, args.lines,
+                                           progress=lambda i: print(f'  run {i}...', file=sys.stderr))
+        if args.out:
+            suite.save(results, args.out)
+        print(f'freezes (per run)\n{guilatency.format_freezes(results)}\n')
+        if args.compare:
+            return report(suite.load(args.compare), results, args.threshold)
+        print(suite.format_table(results))
+        return 0
+
+    messy = (False,) if args.clean_only else (True,) if args.messy_only else (False, True)
+    cases = [c.strip() for c in args.cases.split(',') if c.strip()] or None
+    unknown = [c for c in (cases or []) if not c in suite.CASES]
+    if unknown:
+        print(f'Unknown case(s): {", ".join(unknown)}', file=sys.stderr)
+        return 2
+    results = suite.run_suite([int(s) for s in args.sizes.split(',')], args.density, messy, args.repeat, cases,
+                              progress=lambda key: print(f'  {key}...', file=sys.stderr))
+    if args.out:
+        suite.save(results, args.out)
+    if args.compare:
+        return report(suite.load(args.compare), results, args.threshold)
+    print(suite.format_table(results))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+## @package proxen.bench.guilatency
+# @brief GUI responsiveness benchmark: event-loop stalls while MainWindow and TestEnv
+# work through scripted scenarios (offscreen Qt, synthetic profile tree).
+#
+# A heartbeat timer fires every bench::guilatency::HEARTBEAT_MS on the GUI thread; each
+# delay beyond the interval is a stall of the event loop (a frozen window).
+# For every scenario, the p50 / p99 / max stall times are reported, plus the
+# time-to-interactive of the main window (until the system settings are shown).
+#
+# Scenarios:
+# - `startup`: create and show MainWindow, wait until the settings are loaded
+# - `apply`: apply changed settings (MainWindow::apply_config())
+# - `toggle`: toggle the Enable switch repeatedly (debounced applies)
+# - `env_open`: open TestEnv with many extra env variables (until the list is filled)
+# - `env_refresh`: reread the env variables in the open TestEnv
+#
+# The results have the same format as bench::suite::run_suite() (one entry per scenario
+# metric in ms, e.g. 'gui_apply:p99_stall'), so they can be saved and compared the same way.
+# The freeze counts (stalls over FREEZE_MS) are not times: they are kept apart, in the
+# `freezes` entry (see run_gui_suite()).
+import os, time, logging, platform, statistics
+
+import utils
+import metrics
+import profiling
+from bench.synth import SyntheticRoot
+
+# --------------------------------------------------------------- #
+
+## `int` heartbeat timer interval (ms)
+HEARTBEAT_MS = 5
+## `float` stalls longer than this (ms) are counted as freezes
+FREEZE_MS = 50.0
+## `int` number of switches in the `toggle` scenario
+TOGGLES = 20
+## `int` default number of extra env variables in the env editor scenarios
+DEFAULT_VARS = 10000
+## `float` max time to wait for a scenario step (seconds)
+TIMEOUT_S = 60.0
+
+# --------------------------------------------------------------- #
+
+## @returns `float` the `q`-th quantile (0..1) of a list of values (nearest rank)
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))]
+
+## @brief Heartbeat timer measuring event-loop stalls on the GUI thread.
+class Heartbeat:
+
+    ## @param interval_ms `int` timer interval (ms)
+    def __init__(self, interval_ms=HEARTBEAT_MS):
+        from qtimports import QtCore
+        ## `int` timer interval (ms)
+        self.interval_ms = interval_ms
+        ## `list` stall durations (ms): the delay of each tick beyond the interval
+        self.stalls = []
+        self._last = None
+        ## `QtCore.QTimer` the heartbeat timer
+        self.timer = QtCore.QTimer()
+        self.timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self._on_tick)
+
+    def _on_tick(self):
+        now = time.perf_counter()
+        if self._last is not None:
+            self.stalls.append(max(0.0, (now - self._last) * 1000 - self.interval_ms))
+        self._last = now
+
+    ## Starts measuring (previous measurements are dropped).
+    def start(self):
+        self.stalls = []
+        self._last = None
+        self.timer.start()
+
+    ## Stops measuring.
+    # @returns `dict` stall stats (ms): `p50_stall`, `p99_stall`, `max_stall` and
+    # the number of freezes (stalls over bench::guilatency::FREEZE_MS)
+    def stop(self) -> dict:
+        self.timer.stop()
+        # the time since the last tick is a stall too
+        self._on_tick()
+        return {'p50_stall': percentile(self.stalls, 0.5), 'p99_stall': percentile(self.stalls, 0.99),
+                'max_stall': max(self.stalls, default=0.0), 'freezes': sum(1 for s in self.stalls if s > FREEZE_MS)}
+
+## Runs the event loop until a condition is met.
+# @param app `QtWidgets.QApplication` the application
+# @param predicate `callable` the condition (checked between event batches)
+# @param timeout_s `float` max time to wait (seconds)
+# @returns `float` the time waited (ms)
+# @exception `TimeoutError` the condition has not been met in time
+def wait_until(app, predicate, timeout_s=TIMEOUT_S):
+    from qtimports import QtCore
+    t0 = time.perf_counter()
+    while not predicate():
+        if time.perf_counter() - t0 > timeout_s:
+            raise TimeoutError('GUI scenario step timed out')
+        app.processEvents(QtCore.QEventLoop.AllEvents, 10)
+        time.sleep(0.001)
+    return (time.perf_counter() - t0) * 1000
+
+## Runs the event loop for a given time.
+# @param app `QtWidgets.QApplication` the application
+# @param ms `float` time to run the loop (ms)
+def spin(app, ms):
+    t_end = time.perf_counter() + ms / 1000
+    wait_until(app, lambda: time.perf_counter() >= t_end)
+
+# --------------------------------------------------------------- #
+
+## @returns `bool` whether MainWindow has no apply running, queued or waiting for the debounce timer
+def _main_idle(mw):
+    return mw.sysproxy is not None and not mw.tasks.is_busy() and not mw.apply_timer.isActive()
+
+## Runs the GUI scenarios once.
+# @param app `QtWidgets.QApplication` the application
+# @param nvars `int` number of extra env variables in the `env_open` and `env_refresh` scenarios
+# @returns `dict` metrics by name: times in ms, e.g. `{'gui_apply:p99_stall': 1.2, 'gui_startup:tti': 250.0, ...}`,
+# and freeze counts, e.g. `{'gui_apply:freezes': 0, ...}`
+def run_scenarios(app, nvars=DEFAULT_VARS) -> dict:
+    import gui
+    res = {}
+    hb = Heartbeat()
+
+    def record(scenario, stats, **extra):
+        for name, value in dict(stats, **extra).items():
+            res[f'gui_{scenario}:{name}'] = value
+
+    # startup
+    hb.start()
+    t0 = time.perf_counter()
+    mw = gui.MainWindow()
+    mw.show()
+    wait_until(app, lambda: _main_idle(mw))
+    record('startup', hb.stop(), tti=(time.perf_counter() - t0) * 1000)
+
+    try:
+        # apply changed settings
+        hb.start()
+        t0 = time.perf_counter()
+        mw.localproxy['http_proxy'] = {'protocol': 'http', 'host': 'bench.example.com', 'port': 8080,
+                                       'auth': False, 'uname': '', 'password': ''}
+        mw.localproxy['noproxy'] = 'localhost,127.0.0.1,.bench.example.com'
+        mw.apply_config()
+        wait_until(app, lambda: _main_idle(mw))
+        record('apply', hb.stop(), duration=(time.perf_counter() - t0) * 1000)
+
+        # toggle the Enable switch quickly
+        hb.start()
+        t0 = time.perf_counter()
+        for _ in range(TOGGLES):
+            mw.act_enable_proxy.toggle()
+            spin(app, 20)
+        wait_until(app, lambda: _main_idle(mw))
+        record('toggle', hb.stop(), duration=(time.perf_counter() - t0) * 1000)
+    finally:
+        mw._can_close = True
+        mw.close()
+        mw.deleteLater()
+
+    # env editor with many variables: first fill and a refresh
+    names = [f'PROXEN_BENCH_VAR_{i}' for i in range(nvars)]
+    for name in names:
+        os.environ[name] = f'value of {name}'
+    try:
+        hb.start()
+        t0 = time.perf_counter()
+        te = gui.TestEnv()
+        te.show()
+        wait_until(app, lambda: not te.tasks.is_busy() and te.model_envs.rowCount() >= nvars)
+        record('env_open', hb.stop(), duration=(time.perf_counter() - t0) * 1000)
+
+        hb.start()
+        t0 = time.perf_counter()
+        te.refresh_vars_gui()
+        wait_until(app, lambda: not te.tasks.is_busy())
+        record('env_refresh', hb.stop(), duration=(time.perf_counter() - t0) * 1000)
+        te._can_close = True
+        te.close()
+        te.deleteLater()
+    finally:
+        for name in names:
+            os.environ.pop(name, None)
+    app.processEvents()
+    return res
+
+## Runs the GUI benchmark (offscreen unless `QT_QPA_PLATFORM` is set).
+# @param nvars `int` number of extra env variables in the `env_open` and `env_refresh` scenarios
+# @param repeat `int` number of runs of all the scenarios
+# @param lines `int` lines per profile file in the synthetic tree
+# @param progress `callable` called with the run number before each run
+# @returns `dict` the results (see bench::suite::run_suite()) of the time metrics, plus
+# `freezes`: the freeze counts of each run by scenario, e.g. `{'gui_apply:freezes': [0, 1, 0], ...}`
+def run_gui_suite(nvars=DEFAULT_VARS, repeat=3, lines=1000, progress=None) -> dict:
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from qtimports import QtWidgets
+    # resources are loaded relative to the project dir
+    os.chdir(utils.make_abspath(''))
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(['proxen-bench'])
+    utils.setup_logging()
+    log_level = utils.logger.level
+    utils.logger.setLevel(logging.WARNING)
+    metrics_on, profiling_on = metrics.is_enabled(), profiling.is_enabled()
+    metrics.enable(False)
+    profiling.enable(False)
+    runs = []
+    try:
+        for i in range(repeat):
+            if progress: progress(i + 1)
+            with SyntheticRoot(lines, seed=i):
+                runs.append(run_scenarios(app, nvars))
+    finally:
+        utils.logger.setLevel(log_level)
+        metrics.enable(metrics_on)
+        profiling.enable(profiling_on)
+    results = {}
+    freezes = {}
+    for key in runs[0]:
+        values = [run[key] for run in runs]
+        if key.endswith(':freezes'):
+            freezes[key] = values
+            continue
+        results[key] = {'runs': repeat, 'min_ms': round(min(values), 4), 'median_ms': round(statistics.median(values), 4),
+                        'mean_ms': round(statistics.fmean(values), 4), 'max_ms': round(max(values), 4)}
+    meta = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+            'platform': platform.platform(), 'qt_platform': os.environ.get('QT_QPA_PLATFORM'),
+            'vars': nvars, 'lines': lines, 'repeat': repeat, 'heartbeat_ms': HEARTBEAT_MS}
+    return {'meta': meta, 'results': results, 'freezes': freezes}
+
+## @returns `str` the freeze counts of the results (see run_gui_suite()) as text lines
+def format_freezes(results) -> str:
+    return '\n'.join(f"{key:<36} {' '.join(str(n) for n in counts)}" for key, counts in results.get('freezes', {}).items())
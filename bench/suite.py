@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+## @package proxen.bench.suite
+# @brief Benchmark cases, runner and baseline comparison.
+#
+# Results (see run_suite()) are stored as JSON:
+# ```python
+# {'meta': {'time': ..., 'python': '3.11.7', 'platform': 'Linux-...', 'repeat': 5, ...},
+#  'results': {'set_sys_env[1000,clean]': {'runs': 5, 'min_ms': ..., 'median_ms': ..., 'mean_ms': ..., 'max_ms': ...}, ...}}
+# ```
+import os, json, time, logging, platform, statistics
+
+import utils
+import metrics
+import profiling
+import sysproxy
+from bench.synth import SyntheticRoot
+
+# --------------------------------------------------------------- #
+
+## `dict` new proxy settings applied by the `fromdict` and `restore` cases
+NEW_CONFIG = {'enabled': True, 'noproxy': 'localhost,127.0.0.1,.bench.example.com',
+              'http_proxy': {'protocol': 'http', 'host': 'bench.example.com', 'port': 8080,
+                             'auth': False, 'uname': '', 'password': ''},
+              'https_proxy': {'protocol': 'http', 'host': 'bench.example.com', 'port': 8080,
+                              'auth': False, 'uname': '', 'password': ''},
+              'ftp_proxy': None, 'rsync_proxy': None}
+## `tuple` default file sizes (lines per profile file)
+DEFAULT_SIZES = (100, 1000, 10000)
+## `float` default relative slowdown (of the median) reported as a regression
+DEFAULT_THRESHOLD = 0.25
+## `float` slowdowns below this absolute value (ms) are never reported as regressions
+MIN_DELTA_MS = 0.5
+
+# --------------------------------------------------------------- #
+# Benchmark cases: `setup(root)` returns the state passed to `run(state)`;
+# only `run` is timed.
+
+def _setup_sysenv(root):
+    return sysproxy.Sysenv(True)
+
+def _run_sysenv_read(root):
+    sysenv = sysproxy.Sysenv(True)
+    for proxy in sysproxy.PROXY_TYPES:
+        sysenv.get_sys_proxy_parsed(proxy)
+    sysenv.get_sys_noproxy()
+
+def _run_file_scan(sysenv):
+    sysenv._unix_read_exports([sysenv.unix_file_local])
+
+def _run_set_sys_env(sysenv):
+    sysenv.set_sys_env('http_proxy', 'http://bench.example.com:8080')
+
+def _run_unset_sys_env(sysenv):
+    sysenv.unset_sys_env('no_proxy')
+
+def _run_apply_changes(sysenv):
+    sysenv.apply_changes([sysproxy.Envchange('create', 'http_proxy', 'http://bench.example.com:8080'),
+                          sysproxy.Envchange('create', 'https_proxy', 'http://bench.example.com:8080'),
+                          sysproxy.Envchange('unset', 'ftp_proxy'),
+                          sysproxy.Envchange('create', 'no_proxy', 'localhost,127.0.0.1')])
+
+def _setup_proxy(root):
+    return sysproxy.Proxy()
+
+def _run_proxy_read_system(proxy):
+    proxy.read_system()
+
+def _run_proxy_fromdict(proxy):
+    proxy.fromdict(NEW_CONFIG)
+
+def _setup_proxy_changed(root):
+    proxy = sysproxy.Proxy()
+    proxy.fromdict(NEW_CONFIG)
+    return proxy
+
+def _run_proxy_restore(proxy):
+    proxy.restore()
+
+## `dict` benchmark cases: name -> `(setup, run)`
+CASES = {'sysenv_read': (lambda root: root, _run_sysenv_read),
+         'file_scan': (_setup_sysenv, _run_file_scan),
+         'set_sys_env': (_setup_sysenv, _run_set_sys_env),
+         'unset_sys_env': (_setup_sysenv, _run_unset_sys_env),
+         'apply_changes': (_setup_sysenv, _run_apply_changes),
+         'proxy_read_system': (_setup_proxy, _run_proxy_read_system),
+         'proxy_fromdict': (_setup_proxy, _run_proxy_fromdict),
+         'proxy_restore': (_setup_proxy_changed, _run_proxy_restore)}
+
+# --------------------------------------------------------------- #
+
+## @returns `str` result key for a case and tree, e.g. 'set_sys_env[1000,messy]'
+def result_key(case, lines, messy):
+    return f"{case}[{lines},{'messy' if messy else 'clean'}]"
+
+## Times one benchmark case: each run gets a fresh synthetic tree.
+# @param case `str` case name (see bench::suite::CASES)
+# @param lines `int` lines per profile file
+# @param density `float` export density
+# @param messy `bool` messy or clean files
+# @param repeat `int` number of timed runs
+# @returns `dict` timings in ms: `runs`, `min_ms`, `median_ms`, `mean_ms`, `max_ms`
+def time_case(case, lines, density=0.2, messy=False, repeat=5) -> dict:
+    setup, run = CASES[case]
+    times = []
+    for i in range(repeat):
+        with SyntheticRoot(lines, density, messy, seed=i) as root:
+            state = setup(root)
+            t0 = time.perf_counter()
+            run(state)
+            times.append((time.perf_counter() - t0) * 1000)
+    return {'runs': repeat, 'min_ms': round(min(times), 4), 'median_ms': round(statistics.median(times), 4),
+            'mean_ms': round(statistics.fmean(times), 4), 'max_ms': round(max(times), 4)}
+
+## Runs the benchmark suite.
+# @param sizes `iterable` lines per profile file
+# @param density `float` export density
+# @param messy `iterable` tree kinds to run: any of `False` (clean) and `True` (messy)
+# @param repeat `int` number of timed runs per case and tree
+# @param cases `iterable` case names (default = all, see bench::suite::CASES)
+# @param progress `callable` called with each result key before it is timed
+# @returns `dict` the results (see the module description)
+def run_suite(sizes=DEFAULT_SIZES, density=0.2, messy=(False, True), repeat=5, cases=None, progress=None) -> dict:
+    if sysproxy.OS == 'Windows':
+        raise Exception('The benchmark suite runs on Unix platforms only!')
+    # keep the measurements free of logging, metrics and profiling overhead
+    utils.setup_logging()
+    log_level = utils.logger.level
+    utils.logger.setLevel(logging.WARNING)
+    metrics_on, profiling_on = metrics.is_enabled(), profiling.is_enabled()
+    metrics.enable(False)
+    profiling.enable(False)
+    results = {}
+    try:
+        for case in (cases or CASES):
+            for lines in sizes:
+                for messy_ in messy:
+                    key = result_key(case, lines, messy_)
+                    if progress: progress(key)
+                    results[key] = time_case(case, lines, density, messy_, repeat)
+    finally:
+        utils.logger.setLevel(log_level)
+        metrics.enable(metrics_on)
+        profiling.enable(profiling_on)
+    meta = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+            'platform': platform.platform(), 'admin': sysproxy.current_user()[1],
+            'sizes': list(sizes), 'density': density, 'repeat': repeat}
+    return {'meta': meta, 'results': results}
+
+# --------------------------------------------------------------- #
+
+## Saves results to a JSON file.
+def save(results, filename):
+    dirname = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(dirname, exist_ok=True)
+    with open(filename, 'w', encoding=utils.CODING) as f_:
+        json.dump(results, f_, indent=2)
+
+## @returns `dict` results loaded from a JSON file
+def load(filename) -> dict:
+    with open(filename, 'r', encoding=utils.CODING) as f_:
+        return json.load(f_)
+
+## Compares results with a baseline (by the median times).
+# @param baseline `dict` baseline results
+# @param current `dict` current results
+# @param threshold `float` relative slowdown reported as a regression (and speedup reported as an improvement)
+# @returns `list` rows `(key, baseline ms, current ms, ratio, status)`, where status is any of
+# 'regression', 'improvement', 'ok', 'new' (no baseline) or 'missing' (not in the current results)
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD) -> list:
+    base, cur = baseline['results'], current['results']
+    rows = []
+    for key in list(base) + [k for k in cur if not k in base]:
+        if not key in cur:
+            rows.append((key, base[key]['median_ms'], None, None, 'missing'))
+            continue
+        if not key in base:
+            rows.append((key, None, cur[key]['median_ms'], None, 'new'))
+            continue
+        b, c = base[key]['median_ms'], cur[key]['median_ms']
+        ratio = c / b if b else float('inf')
+        if ratio > 1 + threshold and c - b > MIN_DELTA_MS:
+            status = 'regression'
+        elif ratio < 1 / (1 + threshold) and b - c > MIN_DELTA_MS:
+            status = 'improvement'
+        else:
+            status = 'ok'
+        rows.append((key, b, c, round(ratio, 3), status))
+    return rows
+
+## @returns `str` results (and optionally their comparison with a baseline) as a text table
+# @param results `dict` the results
+# @param rows `list` comparison rows (see compare()) or `None`
+def format_table(results, rows=None) -> str:
+    lines = []
+    if rows is None:
+        lines.append(f"{'case':<36} {'median ms':>12} {'min ms':>12} {'max ms':>12}")
+        for key, res in results['results'].items():
+            lines.append(f"{key:<36} {res['median_ms']:>12.3f} {res['min_ms']:>12.3f} {res['max_ms']:>12.3f}")
+    else:
+        lines.append(f"{'case':<36} {'baseline ms':>12} {'current ms':>12} {'ratio':>8}  status")
+        fmt = lambda v, spec: format(v, spec) if v is not None else '-'
+        for key, b, c, ratio, status in rows:
+            lines.append(f"{key:<36} {fmt(b, '>12.3f'):>12} {fmt(c, '>12.3f'):>12} {fmt(ratio, '>8.3f'):>8}  {status}")
+    return '\n'.join(lines)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+## @package proxen.bench.synth
+# @brief Synthetic HOME and `/etc` trees with generated shell profile files.
+import os, random, shutil, tempfile
+
+import utils
+import sysproxy
+
+# --------------------------------------------------------------- #
+
+## `list` user profile files generated in the synthetic HOME
+HOME_FILES = ['.profile', '.bashrc', '.bash_profile', '.zshrc']
+## `list` system profile files generated in the synthetic `/etc`
+ETC_FILES = ['environment', 'profile', 'bash.bashrc']
+## `dict` proxy variables exported by the generated files (and set in the environment)
+PROXY_ENVS = {'http_proxy': 'http://proxy.example.com:3128', 'https_proxy': 'http://proxy.example.com:3128',
+              'ftp_proxy': 'http://proxy.example.com:3128', 'no_proxy': 'localhost,127.0.0.1,.example.com'}
+## `int` number of hosts in the huge `no_proxy` of the messy trees
+MESSY_NOPROXY_HOSTS = 5000
+## `list` filler shell lines (not exports)
+FILLER = ['# generated by proxen bench', '', 'alias ll="ls -alF"', 'umask 022',
+          'if [ -d "$HOME/bin" ]; then', '    PATH="$HOME/bin:$PATH"', 'fi',
+          'case $- in *i*) ;; *) return;; esac', 'HISTSIZE=1000', 'shopt -s histappend']
+
+# --------------------------------------------------------------- #
+
+## @returns `str` a huge comma-separated `no_proxy` value
+# @param count `int` number of hosts
+def huge_noproxy(count=MESSY_NOPROXY_HOSTS):
+    return ','.join(['localhost', '127.0.0.1'] + [f'host{i}.internal.example.com' for i in range(count)])
+
+## Generates the text of a shell profile file.
+# @param lines `int` approximate number of lines
+# @param density `float` share of the lines that are (non-proxy) `export` lines
+# @param messy `bool` if `True`, add duplicate proxy exports in both cases, odd spacing
+# and quoting, a huge `no_proxy` and no trailing newline
+# @param seed `int` random seed (the same arguments give the same text)
+# @returns `str` the file text
+def profile_text(lines=1000, density=0.2, messy=False, seed=0) -> str:
+    rnd = random.Random(seed)
+    out = []
+    for i in range(lines):
+        if rnd.random() < density:
+            out.append(f'export BENCH_VAR_{i}="value {i}"')
+        else:
+            out.append(FILLER[i % len(FILLER)])
+        if messy and rnd.random() < 0.02:
+            name, value = rnd.choice(list(PROXY_ENVS.items()))
+            name = name.upper() if rnd.random() < 0.5 else name
+            out.append(rnd.choice([f'export {name}="{value}"', f"export  {name}='{value}'   ",
+                                   f'export {name}={value}', f'\texport {name}="{value}" # old']))
+    noproxy = huge_noproxy() if messy else PROXY_ENVS['no_proxy']
+    for name, value in PROXY_ENVS.items():
+        if name == 'no_proxy': value = noproxy
+        for e_ in (name, name.upper()):
+            out.append(f'export {e_}="{value}"')
+    return '\n'.join(out) + ('' if messy else '\n')
+
+# --------------------------------------------------------------- #
+
+## @brief A temporary HOME and `/etc` root with generated profile files.
+#
+# Used as a context manager: on enter, the tree is generated, `HOME` points to it,
+# the proxy variables are set in the environment (as after sourcing the files) and
+# sysproxy is redirected to the synthetic `/etc` files; on exit, everything is
+# restored and the tree is deleted. The privileged helper (see privhelper module) is
+# disabled meanwhile: it always writes the real `/etc` files.
+class SyntheticRoot:
+
+    ## @param lines `int` approximate number of lines in each profile file
+    # @param density `float` share of the `export` lines (see profile_text())
+    # @param messy `bool` generate messy files (see profile_text())
+    # @param seed `int` random seed
+    def __init__(self, lines=1000, density=0.2, messy=False, seed=0):
+        ## `int` approximate number of lines in each profile file
+        self.lines = lines
+        ## `float` share of the `export` lines
+        self.density = density
+        ## `bool` whether the files are messy
+        self.messy = messy
+        ## `int` random seed
+        self.seed = seed
+        ## `str` the temporary root dir
+        self.root = None
+        ## `str` the synthetic HOME
+        self.home = None
+        ## `str` the synthetic `/etc`
+        self.etc = None
+        ## `dict` the environment saved on enter (restored on exit)
+        self._saved_env = None
+        ## `list` the original sysproxy::UNIX_PROFILE_FILES_SYS (restored on exit)
+        self._saved_sys_files = None
+        ## `str` the original `privhelper` app option (restored on exit)
+        self._saved_privhelper = None
+
+    ## @returns `str` path in the synthetic tree for a `/etc/...` path
+    def etc_path(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def __enter__(self):
+        self.root = tempfile.mkdtemp(prefix='proxen-bench-')
+        self.home = os.path.join(self.root, 'home')
+        self.etc = os.path.join(self.root, 'etc')
+        os.makedirs(self.home)
+        os.makedirs(self.etc)
+        for i, fname in enumerate(HOME_FILES):
+            with open(os.path.join(self.home, fname), 'w', encoding='utf-8') as f_:
+                f_.write(profile_text(self.lines, self.density, self.messy, self.seed + i))
+        for i, fname in enumerate(ETC_FILES):
+            with open(os.path.join(self.etc, fname), 'w', encoding='utf-8') as f_:
+                f_.write(profile_text(self.lines, self.density, self.messy, self.seed + 100 + i))
+
+        self._saved_env = dict(os.environ)
+        for name in list(os.environ):
+            if name.lower() in sysproxy.PROXY_TYPES + ('all_proxy', 'no_proxy') or name == 'XDG_CACHE_HOME':
+                del os.environ[name]
+        os.environ['HOME'] = self.home
+        os.environ['SHELL'] = '/bin/bash'
+        noproxy = huge_noproxy() if self.messy else PROXY_ENVS['no_proxy']
+        for name, value in PROXY_ENVS.items():
+            if name == 'no_proxy': value = noproxy
+            os.environ[name] = os.environ[name.upper()] = value
+
+        self._saved_sys_files = sysproxy.UNIX_PROFILE_FILES_SYS
+        sysproxy.UNIX_PROFILE_FILES_SYS = [self.etc_path(f) for f in self._saved_sys_files]
+        sysproxy.unix_local_file.cache_clear()
+        sysproxy.unix_system_file.cache_clear()
+        config = utils.get_config()
+        if not 'app' in config:
+            config['app'] = {}
+        app = config['app']
+        self._saved_privhelper = app.get('privhelper')
+        app['privhelper'] = 'false'
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        app = utils.get_config()['app']
+        if self._saved_privhelper is None:
+            app.pop('privhelper', None)
+        else:
+            app['privhelper'] = self._saved_privhelper
+        sysproxy.UNIX_PROFILE_FILES_SYS = self._saved_sys_files
+        sysproxy.unix_local_file.cache_clear()
+        sysproxy.unix_system_file.cache_clear()
+        os.environ.clear()
+        os.environ.update(self._saved_env)
+        shutil.rmtree(self.root, ignore_errors=True)
+        return False
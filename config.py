@@ -23,12 +23,26 @@ def conv_literal(s):
 # ======================================================================================= #     
 
 CONFIG_FILE = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'config.ini')
-CONFIG = configparser.ConfigParser(allow_no_value=True, comment_prefixes=('#',), 
-                                   converters={'list': conv_list, 'tuple': conv_tuple, 'literal': conv_literal})
-if os.path.isfile(CONFIG_FILE): CONFIG.read(CONFIG_FILE)
+_CONFIG = None
+
+## Returns the app config, reading `config.ini` on first call only.
+# @returns `configparser.ConfigParser` the (cached) config object
+def get_config():
+    global _CONFIG
+    if _CONFIG is None:
+        _CONFIG = configparser.ConfigParser(allow_no_value=True, comment_prefixes=('#',), 
+                                            converters={'list': conv_list, 'tuple': conv_tuple, 'literal': conv_literal})
+        if os.path.isfile(CONFIG_FILE): _CONFIG.read(CONFIG_FILE)
+    return _CONFIG
+
+## Lazy module attributes: `CONFIG` is resolved through get_config() on first access.
+def __getattr__(name):
+    if name == 'CONFIG':
+        return get_config()
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
 
 # ======================================================================================= # 
 
 def config_save():
     with open(CONFIG_FILE, 'w', encoding='utf-8') as configfile:
-        CONFIG.write(configfile)
\ No newline at end of file
+        get_config().write(configfile)
\ No newline at end of file
@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+## @package proxen.daemon
+# @brief Optional long-running proxen service: keeps a warm sysproxy::Proxy object
+# (with its parsed state, caches and the profile watcher) and serves it to clients
+# over a Unix socket, so that a client gets the state in milliseconds instead of
+# reading the system again.
+#
+# Protocol: newline-delimited JSON messages. A request is
+# `{"id": 1, "method": "get", "params": {...}}` and gets either `{"id": 1, "result": ...}`
+# or `{"id": 1, "error": "message"}`. Methods:
+# - `ping`: `{"pid": ..., "version": ...}`
+# - `get`: `{"state": Proxy::asdict(), "version": Proxy::version}`
+# - `apply` (params: `config` in the Proxy::asdict() format): applies the config, returns as `get`
+# - `restore`: restores the settings saved on start (see Proxy::restore()), returns as `get`
+# - `fingerprint` (params: optional `depth`): see Proxy::fingerprint() and fingerprint::Node::asdict()
+# - `subscribe`: returns as `get`; afterwards, the connection also receives
+# `{"event": "changed", "source": "apply" | "restore" | "external", "state": ..., "version": ...}`
+# messages whenever the settings change
+# - `stats`: request counters, number of clients and uptime
+#
+# All requests are serialized by a single lock, so concurrent clients never interleave
+# writes. Messages to a client (responses and events) are queued and sent by the
+# connection's own writer thread, outside the lock: a client that stops reading cannot
+# block the service. A client falling more than MAX_QUEUED messages behind is disconnected.
+# Server::local_client() connects a client through a socket pair instead of
+# the socket file (e.g. for tests or in-process use).
+#
+# Command line (see proxen::parse_args()):
+# ```
+# python proxen.py daemon [--socket PATH] [--no-watch]
+# python proxen.py ctl [--socket PATH] {ping,get,apply,restore,fingerprint,subscribe} [-c CONFIG]
+# ```
+import os, json, stat, time, queue, socket, struct, tempfile, threading
+
+import utils
+import sysproxy
+
+# --------------------------------------------------------------- #
+
+## `float` default client timeout (seconds)
+CLIENT_TIMEOUT = 10.0
+## `int` max size of a message (bytes)
+MAX_MESSAGE = 1024 * 1024
+## `int` max number of messages queued for a client (see _Connection::send())
+MAX_QUEUED = 256
+
+## @brief Error reported by the daemon or raised when it cannot be reached.
+class DaemonError(Exception):
+    pass
+
+## @returns `str` default socket path: `proxen-<uid>.sock` in `$XDG_RUNTIME_DIR` or else
+# `proxen.sock` in a private `proxen-<uid>` dir in the temp dir (see check_private_dir())
+def default_socket_path() -> str:
+    uid = os.getuid() if hasattr(os, 'getuid') else sysproxy.current_user()[0]
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        return os.path.join(os.environ['XDG_RUNTIME_DIR'], f'proxen-{uid}.sock')
+    return os.path.join(tempfile.gettempdir(), f'proxen-{uid}', 'proxen.sock')
+
+## Creates a socket dir (mode 0700) if missing and checks that only the current user can
+# access it, so that no other user can pre-create the socket file.
+# @param path `str` the dir
+# @exception `DaemonError` the dir is not a dir, belongs to another user or is accessible by others
+def check_private_dir(path):
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    except OSError as err:
+        raise DaemonError(f'Cannot create the socket dir "{path}": {err}')
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise DaemonError(f'The socket dir "{path}" must be a dir accessible by the current user only')
+
+## @returns `int` the user id of the process at the other end of a Unix socket
+# (`SO_PEERCRED`; where unsupported, the owner of the socket file)
+# @param sock `socket.socket` a connected Unix socket
+# @param path `str` the socket file
+def peer_uid(sock, path) -> int:
+    if hasattr(socket, 'SO_PEERCRED'):
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        return struct.unpack('3i', creds)[1]
+    return os.stat(path).st_uid
+
+## @returns `bytes` a message encoded as a JSON line
+def encode(message: dict) -> bytes:
+    return (json.dumps(message, separators=(',', ':')) + '\n').encode(utils.CODING)
+
+# --------------------------------------------------------------- #
+
+## @brief A client connection on the server side.
+class _Connection:
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        ## `queue.Queue` encoded messages waiting to be sent by the writer thread
+        # (`None` stops the thread)
+        self.outbox = queue.Queue(MAX_QUEUED)
+        ## `bool` whether the connection has been closed or dropped
+        self.closed = False
+
+    ## Queues a message for the client (never blocks). If the client has fallen too far
+    # behind (see MAX_QUEUED), it is disconnected.
+    # @returns `bool` whether the message has been queued
+    def send(self, message: dict) -> bool:
+        if self.closed:
+            return False
+        try:
+            self.outbox.put_nowait(encode(message))
+            return True
+        except queue.Full:
+            utils.log('Proxen daemon client does not read its messages: disconnecting', 'error')
+            self.drop()
+            return False
+
+    ## Disconnects the client (the reader and writer threads then exit).
+    def drop(self):
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    ## Writer thread: sends the queued messages until stopped or the connection fails.
+    def write(self):
+        while True:
+            data = self.outbox.get()
+            if data is None:
+                break
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                self.drop()
+                break
+
+    ## Reads and answers the requests until the client disconnects.
+    def serve(self):
+        writer = threading.Thread(target=self.write, name='proxen-daemon-writer', daemon=True)
+        writer.start()
+        reader = self.sock.makefile('rb')
+        try:
+            while True:
+                # never buffer more than a message: a longer line is rejected unread
+                line = reader.readline(MAX_MESSAGE + 1)
+                if not line:
+                    break
+                if len(line) > MAX_MESSAGE:
+                    self.send({'id': None, 'error': 'Message too long'})
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                    rid = request.get('id')
+                except (ValueError, AttributeError):
+                    self.send({'id': None, 'error': 'Invalid JSON request'})
+                    continue
+                try:
+                    result = self.server.handle(self, request.get('method'), request.get('params') or {})
+                    self.send({'id': rid, 'result': result})
+                except Exception as err:
+                    self.send({'id': rid, 'error': str(err) or err.__class__.__name__})
+        except OSError:
+            pass
+        finally:
+            self.server.disconnect(self)
+            self.closed = True
+            try:
+                self.outbox.put_nowait(None)
+            except queue.Full:
+                self.drop()
+            writer.join(CLIENT_TIMEOUT)
+            reader.close()
+            self.sock.close()
+
+## @brief The proxen service (see the module description).
+class Server:
+
+    ## @param path `str` socket file (default = default_socket_path())
+    # @param proxy `sysproxy::Proxy` the proxy object to serve (default = a new object)
+    # @param watch `bool` whether to watch the profile files for external changes
+    # (see watcher module; Unix only)
+    def __init__(self, path=None, proxy=None, watch=True):
+        ## `str` socket file
+        self.path = path or default_socket_path()
+        ## `sysproxy::Proxy` the served proxy object
+        self.proxy = proxy or sysproxy.Proxy()
+        ## `threading.RLock` serializes all the operations on Server::proxy
+        self.lock = threading.RLock()
+        ## `threading.Lock` guards Server::connections and Server::subscribers
+        # (separate from Server::lock, so connecting never waits for a request)
+        self.clients_lock = threading.Lock()
+        ## `set` connections subscribed to changes
+        self.subscribers = set()
+        ## `set` open connections
+        self.connections = set()
+        ## `dict` request counters by method
+        self.stats = {}
+        ## `float` start time (`time.time()`)
+        self.started = time.time()
+        ## `watcher::Watcher` the profile watcher (`None` if not watching)
+        self.watcher = None
+        if watch and sysproxy.OS != 'Windows':
+            import watcher
+            self.watcher = watcher.Watcher(self._on_external_changes, self.proxy.sysenv)
+        self._sock = None
+        self._stop = threading.Event()
+
+    ## @returns `dict` the current state: `{'state': ..., 'version': ...}`
+    def state(self) -> dict:
+        with self.lock:
+            return {'state': self.proxy.asdict(), 'version': self.proxy.version}
+
+    ## Executes a request (called in the connection threads).
+    # @param conn `daemon::_Connection` the client connection
+    # @param method `str` request method (see the module description)
+    # @param params `dict` request parameters
+    # @returns `Any` the result
+    # @exception `DaemonError` unknown method or invalid parameters
+    def handle(self, conn, method, params):
+        with self.lock:
+            self.stats[method] = self.stats.get(method, 0) + 1
+            if method == 'ping':
+                return {'pid': os.getpid(), 'version': self.proxy.version}
+            if method == 'get':
+                return self.state()
+            if method == 'apply':
+                if not isinstance(params.get('config'), dict):
+                    raise DaemonError('"config" must be a proxy config dictionary')
+                try:
+                    sysproxy.check_config(params['config'])
+                except ValueError as err:
+                    raise DaemonError(str(err))
+                version = self.proxy.version
+                self.proxy.fromdict(params['config'])
+                if self.proxy.version != version:
+                    self.notify('apply')
+                return self.state()
+            if method == 'restore':
+                version = self.proxy.version
+                self.proxy.restore()
+                if self.proxy.version != version:
+                    self.notify('restore')
+                return self.state()
+            if method == 'fingerprint':
+                return self.proxy.fingerprint().asdict(params.get('depth'))
+            if method == 'subscribe':
+                with self.clients_lock:
+                    self.subscribers.add(conn)
+                return self.state()
+            if method == 'stats':
+                with self.clients_lock:
+                    clients, subscribers = len(self.connections), len(self.subscribers)
+                return {'requests': dict(self.stats), 'clients': clients,
+                        'subscribers': subscribers, 'uptime': round(time.time() - self.started, 1)}
+        raise DaemonError(f'Unknown method "{method}"')
+
+    ## Queues a 'changed' event for the subscribers (called with Server::lock held;
+    # never blocks, see _Connection::send()).
+    # @param source `str` the change source: 'apply', 'restore' or 'external'
+    def notify(self, source):
+        event = dict(self.state(), event='changed', source=source)
+        with self.clients_lock:
+            subscribers = list(self.subscribers)
+        for conn in subscribers:
+            conn.send(event)
+
+    ## Watcher callback: takes over external changes of the profile files.
+    def _on_external_changes(self, changes, paths):
+        with self.lock:
+            if self.proxy.apply_external(changes):
+                self.notify('external')
+
+    ## Starts serving a connected socket in a new thread.
+    # @param sock `socket.socket` the server end of the connection
+    def connect(self, sock):
+        conn = _Connection(self, sock)
+        with self.clients_lock:
+            self.connections.add(conn)
+        threading.Thread(target=conn.serve, name='proxen-daemon-client', daemon=True).start()
+
+    ## Forgets a closed connection.
+    def disconnect(self, conn):
+        with self.clients_lock:
+            self.connections.discard(conn)
+            self.subscribers.discard(conn)
+
+    ## @returns `daemon::Client` a client connected through a socket pair (no socket file)
+    def local_client(self, timeout=CLIENT_TIMEOUT):
+        server_end, client_end = socket.socketpair()
+        self.connect(server_end)
+        return Client(client_end, timeout)
+
+    ## Binds the socket file (removing a stale one) and starts the watcher.
+    # The dir of the default socket path is created and checked by check_private_dir().
+    # @exception `DaemonError` another daemon is running on the socket or the socket dir is not private
+    def bind(self):
+        if not hasattr(socket, 'AF_UNIX'):
+            raise DaemonError('Unix sockets are not supported on this platform!')
+        if self.path == default_socket_path():
+            check_private_dir(os.path.dirname(self.path))
+        if os.path.exists(self.path):
+            try:
+                Client.connect(self.path, 1.0).close()
+            except DaemonError:
+                # stale socket file
+                os.unlink(self.path)
+            else:
+                raise DaemonError(f'A proxen daemon is already running on "{self.path}"')
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)
+        try:
+            self._sock.bind(self.path)
+        finally:
+            os.umask(umask)
+        self._sock.listen()
+        self._sock.settimeout(0.5)
+        if self.watcher:
+            self.watcher.start()
+        utils.log('Proxen daemon listening on "%s"', 'info', self.path)
+
+    ## Accepts connections until Server::shutdown() is called.
+    def serve_forever(self):
+        if self._sock is None:
+            self.bind()
+        try:
+            while not self._stop.is_set():
+                try:
+                    sock, _ = self._sock.accept()
+                except socket.timeout:
+                    continue
+                sock.settimeout(None)
+                self.connect(sock)
+        finally:
+            self.close()
+
+    ## Stops Server::serve_forever() (from another thread).
+    def shutdown(self):
+        self._stop.set()
+
+    ## Closes the socket and the connections and stops the watcher.
+    def close(self):
+        if self.watcher:
+            self.watcher.stop()
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        with self.clients_lock:
+            connections = list(self.connections)
+        for conn in connections:
+            conn.drop()
+
+# --------------------------------------------------------------- #
+
+## @brief Client of the proxen service (see the module description).
+class Client:
+
+    ## @param sock `socket.socket` a connected socket
+    # @param timeout `float` response timeout (seconds; `None` = wait forever)
+    def __init__(self, sock, timeout=CLIENT_TIMEOUT):
+        self.sock = sock
+        self.sock.settimeout(timeout)
+        self._reader = sock.makefile('rb')
+        self._id = 0
+        ## `list` events received while waiting for a response (see Client::events())
+        self._events = []
+
+    ## @returns `daemon::Client` a client connected to a running daemon
+    # @param path `str` socket file (default = default_socket_path())
+    # @param timeout `float` response timeout (seconds)
+    # @exception `DaemonError` no daemon is running on the socket or it runs as another
+    # user (the configs sent may contain credentials, see peer_uid())
+    @classmethod
+    def connect(cls, path=None, timeout=CLIENT_TIMEOUT):
+        if not hasattr(socket, 'AF_UNIX'):
+            raise DaemonError('Unix sockets are not supported on this platform!')
+        path = path or default_socket_path()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(path)
+            uid = peer_uid(sock, path)
+        except OSError as err:
+            sock.close()
+            raise DaemonError(f'Cannot connect to the proxen daemon: {err}')
+        if uid != os.getuid():
+            sock.close()
+            raise DaemonError(f'The proxen daemon on "{path}" runs as another user (uid {uid})')
+        return cls(sock, timeout)
+
+    ## @returns `dict` the next message from the daemon
+    # @exception `DaemonError` the connection is closed or timed out, or the message is invalid
+    def _read(self) -> dict:
+        try:
+            line = self._reader.readline(MAX_MESSAGE + 1)
+        except OSError as err:
+            raise DaemonError(f'Connection to the proxen daemon failed: {err}')
+        if not line:
+            raise DaemonError('Connection to the proxen daemon closed')
+        if len(line) > MAX_MESSAGE:
+            raise DaemonError('Message from the proxen daemon too long')
+        try:
+            message = json.loads(line)
+        except ValueError as err:
+            raise DaemonError(f'Invalid message from the proxen daemon: {err}')
+        if not isinstance(message, dict):
+            raise DaemonError('Invalid message from the proxen daemon: not an object')
+        return message
+
+    ## Sends a request and waits for the response.
+    # @param method `str` request method (see the module description)
+    # @param params `dict` request parameters
+    # @returns `Any` the result
+    # @exception `DaemonError` the request failed
+    def call(self, method, **params):
+        self._id += 1
+        try:
+            self.sock.sendall(encode({'id': self._id, 'method': method, 'params': params}))
+        except OSError as err:
+            raise DaemonError(f'Connection to the proxen daemon failed: {err}')
+        while True:
+            message = self._read()
+            if 'event' in message:
+                self._events.append(message)
+                continue
+            if message.get('id') not in (self._id, None):
+                continue
+            if 'error' in message:
+                raise DaemonError(message['error'])
+            return message.get('result')
+
+    ## @returns `dict` the current state (see the `get` method)
+    def get(self) -> dict:
+        return self.call('get')
+
+    ## Applies a proxy config.
+    # @param dconfig `dict` the proxy config (in the Proxy::asdict() format)
+    # @returns `dict` the new state (see the `get` method)
+    def apply(self, dconfig: dict) -> dict:
+        return self.call('apply', config=dconfig)
+
+    ## Restores the settings saved when the daemon started.
+    # @returns `dict` the new state (see the `get` method)
+    def restore(self) -> dict:
+        return self.call('restore')
+
+    ## Subscribes to the changes (see Client::events()).
+    # @returns `dict` the current state (see the `get` method)
+    def subscribe(self) -> dict:
+        return self.call('subscribe')
+
+    ## Yields the change events after Client::subscribe() (blocks while waiting)
+    # until the connection is closed.
+    def events(self):
+        self.sock.settimeout(None)
+        while True:
+            while self._events:
+                yield self._events.pop(0)
+            try:
+                message = self._read()
+            except DaemonError:
+                return
+            if 'event' in message:
+                yield message
+
+    def close(self):
+        self._reader.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+## @package proxen.enforce
+# @brief Enforcement mode: keeps a desired proxy config in place, detecting and healing
+# drift caused by other writers (config management runs, users editing their profiles).
+#
+# The profile files are verified on a schedule in three increasingly expensive steps:
+# 1. `stat` of each file: if no file has changed since the last verification, the check ends here
+# 2. SHA-256 hash of the changed files: a file touched but not changed is not parsed
+# 3. parsing the exports of the changed files only (the others are cached)
+#
+# The effective proxy variables (system files, then user files) are compared with the
+# desired ones (see sysproxy::proxy_envs()). Drifted variables are repaired by a single
+# batch of targeted changes (see sysproxy::Sysenv::apply_changes()): other variables
+# and files are not touched.
+#
+# Repairs are rate-limited: if drift recurs soon after a repair (another writer is fighting
+# back), the next repair is delayed with exponential backoff (see BACKOFF_MIN, BACKOFF_MAX);
+# the drift is still detected and counted meanwhile. Unix only.
+#
+# Command line (see proxen::parse_args()):
+# ```
+# python proxen.py enforce [-c CONFIG] [--interval SECONDS] [--home DIR] [--root DIR] [--once]
+# ```
+import os, time, hashlib, threading
+
+import utils
+import sysproxy
+import watcher
+
+# --------------------------------------------------------------- #
+
+## `float` default interval between checks (seconds)
+CHECK_INTERVAL = 10.0
+## `float` minimum delay between repairs (seconds)
+BACKOFF_MIN = 1.0
+## `float` maximum delay between repairs (seconds)
+BACKOFF_MAX = 600.0
+## `tuple` lower-case names of the enforced variables (each in both cases)
+ENFORCED_ENVS = sysproxy.PROXY_TYPES + ('no_proxy',)
+
+# --------------------------------------------------------------- #
+
+## @returns `str` SHA-256 hash of a file's contents (`None` if it cannot be read)
+def file_hash(path):
+    try:
+        with open(path, 'rb') as f_:
+            return hashlib.sha256(f_.read()).hexdigest()
+    except OSError:
+        return None
+
+## @brief Verifies and repairs the proxy exports of a home and / or root
+# (see the module description).
+class Enforcer:
+
+    ## @param dconfig `dict` the desired proxy config (in the Proxy::asdict() format)
+    # @param sysenv `sysproxy::Sysenv` the env object operating the files (default = the current
+    # user's home, plus the system files if running as admin)
+    # @param interval `float` interval between checks (seconds)
+    def __init__(self, dconfig: dict, sysenv=None, interval=CHECK_INTERVAL):
+        if sysproxy.OS == 'Windows':
+            raise Exception('Enforcement is supported on Unix platforms only!')
+        ## `sysproxy::Sysenv` the env object operating the files (in target mode)
+        self.sysenv = sysenv or sysproxy.Sysenv(False, os.path.expanduser('~'),
+                                                '/' if sysproxy.current_user()[1] else None)
+        ## `float` interval between checks (seconds)
+        self.interval = interval
+        ## `dict` desired values of the enforced variables by lower-case name (`None` = not set)
+        self.desired = {}
+        self.set_config(dconfig)
+        ## `list` checked files in the reading order (system files first)
+        self.files = list(dict.fromkeys(self.sysenv.system_files() + self.sysenv.user_files()))
+        ## `dict` counters: checks, stat_only (no file changed), hashed (files hashed),
+        # parsed (files parsed), drifts (checks finding drift), repairs, failed_repairs,
+        # deferred (repairs delayed by the backoff)
+        self.stats = dict.fromkeys(('checks', 'stat_only', 'hashed', 'parsed', 'drifts',
+                                    'repairs', 'failed_repairs', 'deferred'), 0)
+        ## `list` repair latencies (ms): from the drift detection to the verified repair
+        self.latencies = []
+        ## `dict` last verified `stat` signatures by file
+        self._sigs = {}
+        ## `dict` last verified hashes by file
+        self._hashes = {}
+        ## `dict` cached exports of the enforced variables by file
+        self._exports = {}
+        ## `float` current repair backoff (seconds)
+        self._backoff = BACKOFF_MIN
+        ## `float` time of the last repair (`time.monotonic()`)
+        self._last_repair = None
+        ## `float` earliest time of the next repair (`time.monotonic()`)
+        self._next_repair = 0.0
+        ## `float` time the current drift was first detected (`None` = no drift)
+        self._drift_since = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    ## Sets the desired proxy config.
+    # @param dconfig `dict` the proxy config (in the Proxy::asdict() format)
+    def set_config(self, dconfig: dict):
+        envs = sysproxy.proxy_envs(dconfig, False)
+        self.desired = {name: envs.get(name) for name in ENFORCED_ENVS}
+        ## `bool` whether the next check must compare the variables even if no file has changed
+        self._recheck = True
+
+    ## @returns `dict` effective values of the enforced variables found in the files
+    # (`{name: value}` with the names in their original case)
+    def effective(self) -> dict:
+        res = {}
+        for path in self.files:
+            res.update(self._exports.get(path, {}))
+        return res
+
+    ## @returns `list` lower-case names of the drifted variables (see Enforcer::effective())
+    def drifted(self) -> list:
+        values = self.effective()
+        return [name for name, value in self.desired.items()
+                if values.get(name) != value or values.get(name.upper()) != value]
+
+    ## Refreshes the cached exports of the changed files (steps 1-3 of the module description).
+    # @returns `bool` whether any file content has changed since the last call
+    def scan(self) -> bool:
+        changed = False
+        for path in self.files:
+            sig = watcher.file_signature(path)
+            if path in self._sigs and sig == self._sigs[path]:
+                continue
+            self._sigs[path] = sig
+            digest = file_hash(path) if sig else None
+            self.stats['hashed'] += bool(sig)
+            if path in self._hashes and digest == self._hashes[path]:
+                continue
+            self._hashes[path] = digest
+            self._exports[path] = {name: value for name, value in watcher.read_exports(path).items()
+                                   if name.lower() in ENFORCED_ENVS} if digest else {}
+            self.stats['parsed'] += bool(digest)
+            changed = True
+        return changed
+
+    ## Runs a single check and repairs the drift if allowed by the backoff.
+    # @returns `str` the result: 'ok', 'repaired', 'deferred' (drift, waiting for the backoff)
+    # or 'failed' (drift not repaired)
+    def check(self) -> str:
+        self.stats['checks'] += 1
+        if not self.scan() and self._drift_since is None and not self._recheck:
+            self.stats['stat_only'] += 1
+            return 'ok'
+        self._recheck = False
+        drift = self.drifted()
+        if not drift:
+            self._drift_since = None
+            return 'ok'
+        now = time.monotonic()
+        if self._drift_since is None:
+            self._drift_since = now
+            self.stats['drifts'] += 1
+            utils.log('Proxy drift detected: %s', 'info', ', '.join(drift))
+        if now < self._next_repair:
+            self.stats['deferred'] += 1
+            return 'deferred'
+        return self.repair(drift, now)
+
+    ## Repairs drifted variables with a single batch of changes and verifies the result.
+    # @param drift `list` lower-case names of the drifted variables
+    # @param now `float` current time (`time.monotonic()`)
+    # @returns `str` 'repaired' or 'failed'
+    def repair(self, drift, now) -> str:
+        # fighting another writer: back off exponentially
+        if self._last_repair is not None and now - self._last_repair < self._backoff * 2:
+            self._backoff = min(self._backoff * 2, BACKOFF_MAX)
+        else:
+            self._backoff = BACKOFF_MIN
+        self._last_repair = now
+        self._next_repair = now + self._backoff
+        # unset first: the case variants of a variable may differ
+        changes = [sysproxy.Envchange('unset', name) for name in drift]
+        changes += [sysproxy.Envchange('create', name, self.desired[name]) for name in drift
+                    if self.desired[name] is not None]
+        try:
+            self.sysenv.update_vars()
+            self.sysenv.apply_changes(changes, False)
+        except Exception as err:
+            utils.log('Proxy drift repair failed: %s', 'error', err)
+        self.scan()
+        remaining = self.drifted()
+        if remaining:
+            self.stats['failed_repairs'] += 1
+            utils.log('Proxy drift not repaired: %s (next attempt in %.0f s)', 'error', ', '.join(remaining), self._backoff)
+            return 'failed'
+        self.stats['repairs'] += 1
+        self.latencies.append((time.monotonic() - self._drift_since) * 1000)
+        self._drift_since = None
+        utils.log('Proxy drift repaired: %s (%.1f ms)', 'info', ', '.join(drift), self.latencies[-1])
+        return 'repaired'
+
+    ## Runs the checks until stopped (see Enforcer::stop()).
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                self.check()
+            except Exception as err:
+                utils.log('Proxy enforcement check failed: %s', 'exception', err)
+            self._stop.wait(self.interval)
+
+    ## Starts the checks in a background thread.
+    def start(self):
+        if self._thread: return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='proxen-enforcer', daemon=True)
+        self._thread.start()
+
+    ## Stops the checks (see Enforcer::run() and Enforcer::start()).
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
+
+    ## @returns `dict` the counters (see Enforcer::stats) plus the repair latencies (ms):
+    # `latency_avg` and `latency_max`
+    def report(self) -> dict:
+        res = dict(self.stats)
+        if self.latencies:
+            res['latency_avg'] = round(sum(self.latencies) / len(self.latencies), 1)
+            res['latency_max'] = round(max(self.latencies), 1)
+        return res
+
+## @returns `str` the enforcement report as text (see Enforcer::report())
+def format_report(report) -> str:
+    return ', '.join(f'{k} = {v}' for k, v in report.items())
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+## @package proxen.envcache
+# @brief Precompiled shell env cache files.
+#
+# Instead of running Python from shell rc files (e.g. `eval "$(python ...)"`),
+# proxen renders the current proxy variables into one small file per shell syntax
+# which rc files can source directly, with no process spawns:
+# ```
+# [ -f ~/.cache/proxen/env.sh ] && . ~/.cache/proxen/env.sh        # sh / bash / zsh
+# if ( -f ~/.cache/proxen/env.csh ) source ~/.cache/proxen/env.csh  # csh / tcsh
+# test -f ~/.cache/proxen/env.fish; and source ~/.cache/proxen/env.fish  # fish
+# ```
+# See source_line() to get these lines and write_cache() to update the files.
+import os, tempfile
+
+import utils
+
+# --------------------------------------------------------------- #
+
+## `int` cache format version (written in the header of every cache file)
+ENVCACHE_VERSION = 1
+## `str` cache file header (first line)
+ENVCACHE_HEADER = f'# proxen env cache v{ENVCACHE_VERSION} (generated, do not edit)'
+## `tuple` supported shell syntaxes: 'sh' (sh/bash/zsh), 'csh' (csh/tcsh) and 'fish'
+SYNTAXES = ('sh', 'csh', 'fish')
+## `tuple` lower-case names of all the variables managed by the cache
+CACHE_ENVS = ('http_proxy', 'https_proxy', 'ftp_proxy', 'rsync_proxy', 'no_proxy')
+
+# --------------------------------------------------------------- #
+
+## @returns `str` the directory holding the cache files
+# (`$XDG_CACHE_HOME/proxen` or `~/.cache/proxen`)
+def cache_dir():
+    root = os.environ.get('XDG_CACHE_HOME', None) or os.path.expanduser(os.path.join('~', '.cache'))
+    return os.path.join(root, 'proxen')
+
+## @param syntax `str` shell syntax (any of envcache::SYNTAXES)
+# @returns `str` full path to the cache file for the given syntax
+def cache_file(syntax):
+    return os.path.join(cache_dir(), f'env.{syntax}')
+
+## @param syntax `str` shell syntax (any of envcache::SYNTAXES)
+# @returns `str` the line to add to a shell rc file to source the cache
+def source_line(syntax='sh'):
+    fname = cache_file(syntax)
+    if syntax == 'csh':
+        return f'if ( -f "{fname}" ) source "{fname}"'
+    if syntax == 'fish':
+        return f'test -f "{fname}"; and source "{fname}"'
+    return f'[ -f "{fname}" ] && . "{fname}"'
+
+## Quotes a value for the given shell syntax.
+def _quote(value, syntax):
+    if syntax == 'fish':
+        return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+    # sh and csh: single quotes, embedded quotes closed and escaped
+    return "'" + value.replace("'", "'\\''") + "'"
+
+## Renders the cache file contents for a shell syntax.
+# @param envs `dict` proxy variables with lower-case names, e.g. produced by
+# sysproxy::proxy_envs() with `case_variants = False`
+# @param syntax `str` shell syntax (any of envcache::SYNTAXES)
+# @returns `str` the file contents: variables in `envs` are exported in both cases,
+# the other managed variables (envcache::CACHE_ENVS) are unset
+def render(envs: dict, syntax='sh') -> str:
+    if not syntax in SYNTAXES:
+        raise ValueError(f'Unsupported shell syntax: "{syntax}"')
+    lines = [ENVCACHE_HEADER]
+    for name in CACHE_ENVS:
+        value = envs.get(name, None)
+        for e_ in (name, name.upper()):
+            if value is None:
+                if syntax == 'sh':
+                    lines.append(f'unset {e_}')
+                elif syntax == 'csh':
+                    lines.append(f'unsetenv {e_}')
+                else:
+                    lines.append(f'set -e {e_}')
+            else:
+                qval = _quote(str(value), syntax)
+                if syntax == 'sh':
+                    lines.append(f'export {e_}={qval}')
+                elif syntax == 'csh':
+                    lines.append(f'setenv {e_} {qval}')
+                else:
+                    lines.append(f'set -gx {e_} {qval}')
+    return utils.NL.join(lines) + utils.NL
+
+## Atomically writes text to a file (temp file in the same directory + rename),
+# but only if the file contents differ.
+# @returns `bool` `True` if the file was (re)written, `False` if it was already up to date
+def _write_if_changed(fname, text):
+    try:
+        with open(fname, 'r', encoding=utils.CODING) as f_:
+            if f_.read() == text:
+                return False
+    except OSError:
+        pass
+    dirname = os.path.dirname(fname)
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(prefix='.env.', dir=dirname)
+    try:
+        with os.fdopen(fd, 'w', encoding=utils.CODING) as f_:
+            f_.write(text)
+        os.replace(tmpname, fname)
+    except:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+    return True
+
+## Renders and writes the cache files for the given shell syntaxes.
+# Each file is replaced atomically and only when its rendered contents change.
+# @param envs `dict` proxy variables with lower-case names (see render())
+# @param syntaxes `iterable` shell syntaxes to write (default = all)
+# @returns `list` paths of the files actually rewritten
+def write_cache(envs: dict, syntaxes=SYNTAXES) -> list:
+    written = []
+    for syntax in syntaxes:
+        fname = cache_file(syntax)
+        if _write_if_changed(fname, render(envs, syntax)):
+            written.append(fname)
+            utils.log('Updated env cache file "%s"', 'debug', fname)
+    return written
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+## @package proxen.filetx
+# @brief Safe read-modify-write transactions on the profile files shared with other
+# writers (other proxen instances, config management agents, editors).
+#
+# Each transaction (see update()):
+# 1. takes an advisory exclusive `fcntl` lock on the file's directory (other proxen
+# processes wait; the wait time is recorded in the `lock_wait` metric, see metrics::observe())
+# 2. reads the file and remembers its version: inode, mtime, size and content hash
+# 3. computes the new contents
+# 4. checks the version again right before writing: a writer that ignores the lock may
+# have changed the file meanwhile; if so, the transaction starts over (up to MAX_RETRIES times)
+# 5. writes the new contents to a temp file in the same directory and moves it over the
+# file (`os.replace`), so a crash or a full disk never leaves a truncated file
+#
+# The directory is locked rather than the file because the file is replaced by each write.
+# Symlinked files are resolved, so the link itself is kept. The file's permissions (and,
+# if possible, its owner) are kept as well. Bytes that are not valid UTF-8 are preserved
+# (see FILE_ERRORS).
+#
+# On platforms without `fcntl` (Windows), only the version checks are made.
+import os, stat, time, hashlib, tempfile, contextlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import utils
+import metrics
+
+# --------------------------------------------------------------- #
+
+## `float` max time to wait for a lock (seconds)
+LOCK_TIMEOUT = 10.0
+## `int` max number of retries after a conflicting change
+MAX_RETRIES = 5
+## `str` codec error handler for the file contents: undecodable bytes are kept as they are
+FILE_ERRORS = 'surrogateescape'
+## `int` permissions of the files created by update()
+NEW_FILE_MODE = 0o644
+
+## @brief Raised when a file keeps changing during a transaction or cannot be locked.
+class ConflictError(OSError):
+    pass
+
+# --------------------------------------------------------------- #
+
+## Holds an advisory exclusive lock on an open file or directory.
+# @param fd `int` the file descriptor
+# @param path `str` the file path (for messages)
+# @param timeout `float` max time to wait (seconds)
+# @exception `filetx::ConflictError` the lock could not be taken in time
+@contextlib.contextmanager
+def locked(fd, path='', timeout=LOCK_TIMEOUT):
+    if fcntl is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    delay = 0.001
+    while True:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except BlockingIOError:
+            if time.perf_counter() - t0 >= timeout:
+                raise ConflictError(f'Timed out waiting for the lock on "{path}"')
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+    wait = time.perf_counter() - t0
+    metrics.observe('lock_wait', wait)
+    if wait > 0.001:
+        metrics.incr('lock_contended')
+        utils.log('Waited %.1f ms for the lock on "%s"', 'debug', wait * 1000, path)
+    try:
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+## @returns `tuple` the version of an open file: `(inode, mtime_ns, size, sha256)`, and its contents
+# @param fd `int` the file descriptor
+def _read(fd) -> tuple:
+    st = os.fstat(fd)
+    os.lseek(fd, 0, os.SEEK_SET)
+    chunks = []
+    while True:
+        chunk = os.read(fd, 65536)
+        if not chunk: break
+        chunks.append(chunk)
+    data = b''.join(chunks)
+    return (st.st_ino, st.st_mtime_ns, st.st_size, hashlib.sha256(data).digest()), data
+
+## Reads a file by its path.
+# @returns `tuple` the file version (see _read()) and contents, and its `os.stat_result`
+# (`None, b'', None` if the file does not exist)
+def _read_path(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None, b'', None
+    try:
+        version, data = _read(fd)
+        return version, data, os.fstat(fd)
+    finally:
+        os.close(fd)
+
+## Replaces a file with new contents through a temp file in the same directory.
+# @param path `str` full path to the file (not a symlink)
+# @param data `bytes` the new contents
+# @param st `os.stat_result` the replaced file's stats (`None` for a new file):
+# the permissions and owner are copied from it
+def _replace(path, data, st):
+    fd, tmp = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', suffix='.tmp', dir=os.path.dirname(path))
+    try:
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            os.fsync(fd)
+            os.fchmod(fd, stat.S_IMODE(st.st_mode) if st else NEW_FILE_MODE)
+            if st and hasattr(os, 'fchown') and (st.st_uid, st.st_gid) != (os.geteuid(), os.getegid()):
+                try:
+                    os.fchown(fd, st.st_uid, st.st_gid)
+                except PermissionError:
+                    pass
+        finally:
+            os.close(fd)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+## Updates a text file in a transaction (see the module description).
+# @param path `str` full path to the file
+# @param transform `callable` takes the current text and returns the new text
+# @param create `bool` whether to create a missing file (otherwise, nothing is done)
+# @param retries `int` max number of retries after a conflicting change
+# @returns `bool` whether the file has been written
+# @exception `filetx::ConflictError` the file kept changing or could not be locked
+# @exception `OSError` the file could not be read or written
+def update(path, transform, create=False, retries=MAX_RETRIES) -> bool:
+    path = os.path.realpath(path)
+    if not create and not os.path.exists(path):
+        return False
+    dfd = os.open(os.path.dirname(path), os.O_RDONLY) if fcntl else None
+    try:
+        with locked(dfd, path):
+            for attempt in range(retries + 1):
+                version, data, st = _read_path(path)
+                if st is None and not create:
+                    return False
+                metrics.file_read(len(data))
+                txt = data.decode(utils.CODING, FILE_ERRORS)
+                new_txt = transform(txt)
+                if new_txt == txt:
+                    return False
+                if _read_path(path)[0] != version:
+                    # changed (or replaced) by a writer ignoring the lock: start over
+                    metrics.incr('write_conflicts')
+                    utils.log('File "%s" changed during the update, retrying (%d)', 'debug', path, attempt + 1)
+                    continue
+                new_data = new_txt.encode(utils.CODING, FILE_ERRORS)
+                _replace(path, new_data, st)
+                if dfd is not None:
+                    os.fsync(dfd)
+                metrics.file_written(len(new_data))
+                return True
+    finally:
+        if dfd is not None:
+            os.close(dfd)
+    raise ConflictError(f'File "{path}" kept changing during the update')
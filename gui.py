@@ -1,223 +1,275 @@
 # -*- coding: utf-8 -*-
 ## @package proxen.gui
 # @brief The GUI app main window implementation -- see MainWindow class.
-import os, json, struct, webbrowser
+import os, json, copy, struct, time, logging, threading, collections, webbrowser
 import traceback
 
 from qtimports import *
 import utils
 import sysproxy
+import envcache
+import metrics
+import profiling
+import watcher
 
 # ******************************************************************************** #
 
 ## `list` proxy variable names
 PROXY_OBJS = ['http_proxy', 'https_proxy', 'ftp_proxy', 'rsync_proxy', 'noproxy']
+## `tuple` proxy setting fields tracked in MainWindow::dirty (`None` = the proxy is set / unset)
+PROXY_FIELDS = (None, 'protocol', 'host', 'port', 'auth', 'uname', 'password')
+## `str` background color highlighting controls with unsaved changes
+DIRTY_COLOR = '#fff3b0'
+## `int` debounce interval for applying settings (ms): edits within this window are merged
+APPLY_DEBOUNCE_MS = 300
+## `dict` placeholder proxy settings shown until the system settings are read
+PLACEHOLDER_PROXY = {'enabled': False, 'noproxy': None, 'http_proxy': None,
+                     'https_proxy': None, 'ftp_proxy': None, 'rsync_proxy': None}
 
 # ******************************************************************************** #
-# *****          QThreadStump
+# *****          TaskQueue
 # ******************************************************************************** #
 
-## Customized thread class (based on QThread) that adds
-# progress, error etc. signals and mutex locking to avoid thread racing.
-class QThreadStump(QtCore.QThread):
-
-    ## Error signal (args are: instance of this thread and the error message)
-    sig_error = Signal(QtCore.QThread, str)
-
-    ## @param priority `int` thread default priority (default = normal)
-    # @param on_start `callable` callback function called before the main
-    # operation is executed (callback has no args or returned result)
-    # @param on_finish `callable` callback function called after the main
-    # operation completes (callback has no args or returned result)
-    # @param on_run `callable` callback function for the main
-    # operation (callback has no args or returned result)
-    # @param on_error `callable` callback function to handle exceptions
-    # raised during the thread operation (see QThreadStump::sig_error)
-    # @param start_signal `Signal` signal that can be connected to
-    # the `start` slot (if not `None`)
-    # @param stop_signal `Signal` signal that can be connected to
-    # the `terminate` slot (if not `None`)
-    # @param free_on_finish `bool` whether the thread instance will be deleted
-    # from memory after it completes its operation (default = `False`)    
-    # @param can_terminate `bool` whether the thread can be terminated (default = `True`)
-    # @param start_now `bool` whether to start the thread upon creation (default = `False`)
-    def __init__(self, priority=QtCore.QThread.NormalPriority,
-                 on_start=None, on_finish=None, on_run=None, on_error=None,
-                 start_signal=None, stop_signal=None,
-                 free_on_finish=False, can_terminate=True, start_now=False):
+## Raised by Task::check_cancelled() to abort a cancelled task at a safe point.
+class TaskCancelled(Exception):
+    pass
+
+## @brief Cooperative cancellation token.
+# Task functions check it at safe points; nothing is ever terminated forcibly.
+class CancelToken:
+
+    def __init__(self):
+        ## `threading.Event` the cancellation flag
+        self._event = threading.Event()
+
+    ## Requests cancellation.
+    def cancel(self):
+        self._event.set()
+
+    ## `bool` whether cancellation has been requested
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    ## Raises gui::TaskCancelled if cancellation has been requested.
+    def check(self):
+        if self._event.is_set():
+            raise TaskCancelled()
+
+## @brief A unit of work run by gui::TaskQueue on its thread pool.
+# The task function is called with the task itself as the only argument, so it can
+# report progress (Task::progress()) and check for cancellation (Task::check_cancelled()).
+# All callbacks are invoked in the GUI thread.
+class Task(QtCore.QRunnable):
+
+    ## @param queue `gui::TaskQueue` the owner queue
+    # @param fn `callable` the task function: `fn(task) -> result`
+    # @param key `str` coalescing key: a new task with the same key supersedes
+    # pending and running tasks with this key in the same group (latest wins)
+    # @param group `str` serialization group: tasks in the same group run one at a time
+    # (`None` = run freely)
+    # @param priority `int` task priority (higher runs first)
+    # @param on_start `callable` called when the task starts (no args)
+    # @param on_progress `callable` called on progress: `on_progress(value, text)`
+    # @param on_finish `callable` called with the result on success: `on_finish(result)`
+    # @param on_error `callable` called with the error message on failure: `on_error(message)`
+    # @param on_cancel `callable` called if the task is cancelled or superseded (no args)
+    def __init__(self, queue, fn, key=None, group=None, priority=0,
+                 on_start=None, on_progress=None, on_finish=None, on_error=None, on_cancel=None):
         super().__init__()
-        ## `int` thread default priority (default = normal)
+        self.setAutoDelete(False)
+        self.queue = queue
+        self.fn = fn
+        self.key = key
+        self.group = group
         self.priority = priority
-        ## `callable` callback function executed before the thread runs
         self.on_start = on_start
-        ## `callable` callback function executed after the thread finishes
+        self.on_progress = on_progress
         self.on_finish = on_finish
-        ## `callable` callback function for the main operation
-        self.on_run = on_run
-        ## `callable` callback function executed when an exception occurs
         self.on_error = on_error
-        ## `bool` whether the thread instance will be deleted from memory after it completes
-        self.free_on_finish = free_on_finish
-        ## `bool` whether the thread can be terminated
-        self.can_terminate = can_terminate
-        ## `Signal` signal that can be connected to the `start` slot (if not `None`)
-        self.start_signal = start_signal
-        ## `Signal` signal that can be connected to the `terminate` slot (if not `None`)
-        self.stop_signal = stop_signal
-        ## `QtCore.QMutex` mutex lock used by QThreadStump::lock() and QThreadStump::unlock()
-        self.mutex = QtCore.QMutex()
-        if start_now: self.start()
-
-    ## Destructor: waits for the thread to complete.
-    def __del__(self):
-        try:
-            self.wait()
-        except:
-            pass
+        self.on_cancel = on_cancel
+        ## `gui::CancelToken` the task's cancellation token
+        self.token = CancelToken()
 
-    ## `int` getter for `QtCore.QThread.default_priority` (thread priority)
-    @property
-    def priority(self):
-        return self.default_priority
+    ## Requests cooperative cancellation of the task.
+    def cancel(self):
+        self.token.cancel()
 
-    ## sets `QtCore.QThread.default_priority` (thread priority)
-    @priority.setter
-    def priority(self, _priority):
-        try:
-            self.default_priority = _priority if _priority != QtCore.QThread.InheritPriority else QtCore.QThread.NormalPriority
-        except:
-            pass
-
-    ## `callable` getter for QThreadStump::_on_start
+    ## `bool` whether cancellation has been requested
     @property
-    def on_start(self):
-        return self._on_start
+    def cancelled(self):
+        return self.token.cancelled
 
-    ## setter for QThreadStump::_on_start
-    @on_start.setter
-    def on_start(self, _on_start):
-        try:
-            self.started.disconnect()
-        except:
-            pass
-        ## `callable` callback function executed before the thread runs
-        self._on_start = _on_start
-        if self._on_start:
-            self.started.connect(self._on_start)
+    ## Raises gui::TaskCancelled if the task has been cancelled (call at safe points).
+    def check_cancelled(self):
+        self.token.check()
 
-    ## `callable` getter for QThreadStump::_on_finish
-    @property
-    def on_finish(self):
-        return self._on_finish
-
-    ## setter for QThreadStump::_on_finish
-    @on_finish.setter
-    def on_finish(self, _on_finish):
-        try:
-            self.finished.disconnect()
-        except:
-            pass
-        ## `callable` callback function executed after the thread finishes
-        self._on_finish = _on_finish
-        if self._on_finish:
-            self.finished.connect(self._on_finish)
-        if getattr(self, '_free_on_finish', False):
-            self.finished.connect(self.deleteLater)
-
-    ## `bool` getter for QThreadStump::_free_on_finish
-    @property
-    def free_on_finish(self):
-        return self._free_on_finish
+    ## Reports progress (thread-safe).
+    # @param value `int` progress value (e.g. percent)
+    # @param text `str` progress message
+    def progress(self, value, text=''):
+        self.queue._sig_event.emit(self, 'progress', (value, text))
 
-    ## setter for QThreadStump::_free_on_finish
-    @free_on_finish.setter
-    def free_on_finish(self, _free_on_finish):
-        try:
-            self.finished.disconnect()
-        except:
-            pass
-        ## `bool` whether the thread instance will be deleted from memory after it completes
-        self._free_on_finish = _free_on_finish
-        if getattr(self, '_on_finish', None):
-            self.finished.connect(self._on_finish)
-        if self._free_on_finish:
-            self.finished.connect(self.deleteLater)
-
-    ## `callable` getter for QThreadStump::_on_error
-    @property
-    def on_error(self):
-        return self._on_error
-
-    ## setter for QThreadStump::_on_error
-    @on_error.setter
-    def on_error(self, _on_error):
-        try:
-            self.sig_error.disconnect()
-        except:
-            pass
-        ## `callable` callback function executed when an exception occurs
-        self._on_error = _on_error
-        if self._on_error:
-            self.sig_error.connect(self._on_error)
-
-    ## `bool` getter for QThreadStump::_can_terminate
-    @property
-    def can_terminate(self):
-        return self._can_terminate
-
-    ## setter for QThreadStump::_can_terminate
-    @can_terminate.setter
-    def can_terminate(self, _can_terminate):
-        self.setTerminationEnabled(_can_terminate)
-        ## `bool` whether the thread can be terminated
-        self._can_terminate = _can_terminate
-
-    ## `Signal` getter for QThreadStump::_start_signal
-    @property
-    def start_signal(self):
-        return self._start_signal
-
-    ## setter for QThreadStump::_start_signal
-    @start_signal.setter
-    def start_signal(self, _start_signal):
-        ## `Signal` signal that can be connected to the `start` slot
-        self._start_signal = _start_signal
-        if self._start_signal:
-            self._start_signal.connect(self.start)
-
-    ## `Signal` getter for QThreadStump::_stop_signal
-    @property
-    def stop_signal(self):
-        return self._stop_signal
-
-    ## setter for QThreadStump::_stop_signal
-    @stop_signal.setter
-    def stop_signal(self, _stop_signal):
-        ## `Signal` signal that can be connected to the `terminate` slot
-        self._stop_signal = _stop_signal
-        if self._stop_signal:
-            self._stop_signal.connect(self.terminate)
-
-    ## Locks the internal mutex to preclude data racing.
-    def lock(self):
-        self.mutex.lock()
-
-    ## Releases the mutex lock.
-    def unlock(self):
-        self.mutex.unlock()
-
-    ## Executes the worker function pointed to by QThreadStump::on_run.
+    ## Executes the task function in a pool thread.
     def run(self):
         try:
-            self.setPriority(self.priority)
-        except:
-            pass
-        if self.on_run and not self.isInterruptionRequested():
+            if self.token.cancelled:
+                self.queue._sig_event.emit(self, 'cancelled', None)
+                return
+            self.queue._sig_event.emit(self, 'started', None)
             try:
-                self.on_run()
+                result = self.fn(self)
+            except TaskCancelled:
+                self.queue._sig_event.emit(self, 'cancelled', None)
             except Exception as err:
                 traceback.print_exc(limit=None)
-                self.sig_error.emit(self, str(err))
+                self.queue._sig_event.emit(self, 'error', str(err))
+            else:
+                self.queue._sig_event.emit(self, 'finished', result)
+        finally:
+            self.queue._sig_event.emit(self, 'done', None)
+
+## @brief Task scheduler on top of `QtCore.QThreadPool`.
+# Features:
+# - cooperative cancellation (see gui::CancelToken): threads are never terminated
+# - progress reporting and per-task callbacks invoked in the GUI thread
+# - priorities (within a group, the pending task with the highest priority runs next)
+# - serialization groups: tasks in the same group never run concurrently
+# - latest-wins coalescing: submitting a task with the same key as pending tasks in
+# its group drops them (counted in TaskQueue::stats as 'coalesced') and cancels a
+# running task with that key
+#
+# Nothing in this class blocks the GUI thread: use TaskQueue::sig_idle or
+# TaskQueue::call_when_idle() instead of waiting.
+class TaskQueue(QtCore.QObject):
+
+    ## Internal task event signal (args: task, event name, payload)
+    _sig_event = Signal(object, str, object)
+    ## Emitted when the queue state or statistics change
+    sig_changed = Signal()
+    ## Emitted when the last task completes
+    sig_idle = Signal()
+
+    ## @param max_threads `int` maximum number of pool threads (`None` = Qt default)
+    # @param parent `QtCore.QObject` parent object
+    def __init__(self, max_threads=None, parent=None):
+        super().__init__(parent)
+        ## `QtCore.QThreadPool` the thread pool
+        self.pool = QtCore.QThreadPool()
+        if max_threads:
+            self.pool.setMaxThreadCount(max_threads)
+        ## `set` tasks started on the pool and not yet done
+        self._active = set()
+        ## `dict` serialization groups: group -> `{'running': task or None, 'pending': [tasks]}`
+        self._groups = {}
+        ## `list` callables to call once the queue is idle
+        self._idle_callbacks = []
+        ## `dict` counters: submitted, coalesced, cancelled, completed, failed
+        self.stats = {'submitted': 0, 'coalesced': 0, 'cancelled': 0, 'completed': 0, 'failed': 0}
+        self._sig_event.connect(self._on_task_event)
+
+    ## Submits a task (see gui::Task for the arguments).
+    # @returns `gui::Task` the new task
+    def submit(self, fn, key=None, group=None, priority=0, on_start=None, on_progress=None,
+               on_finish=None, on_error=None, on_cancel=None):
+        task = Task(self, fn, key, group, priority, on_start, on_progress, on_finish, on_error, on_cancel)
+        self.stats['submitted'] += 1
+        if group is None:
+            self._start(task)
+        else:
+            lane = self._groups.setdefault(group, {'running': None, 'pending': []})
+            if not key is None:
+                for old in [t for t in lane['pending'] if t.key == key]:
+                    lane['pending'].remove(old)
+                    self.stats['coalesced'] += 1
+                    if old.on_cancel: old.on_cancel()
+                if lane['running'] and lane['running'].key == key:
+                    lane['running'].cancel()
+            lane['pending'].append(task)
+            self._pump(group)
+        self.sig_changed.emit()
+        return task
+
+    ## Cancels tasks: drops pending ones and requests cancellation of running ones.
+    # @param group `str` group to cancel (`None` = all tasks)
+    # @param key `str` only cancel tasks with this key (`None` = any key)
+    def cancel(self, group=None, key=None):
+        for g, lane in self._groups.items():
+            if not group is None and g != group: continue
+            for old in [t for t in lane['pending'] if key is None or t.key == key]:
+                lane['pending'].remove(old)
+                self.stats['cancelled'] += 1
+                if old.on_cancel: old.on_cancel()
+        for task in self._active:
+            if (group is None or task.group == group) and (key is None or task.key == key):
+                task.cancel()
+        self.sig_changed.emit()
+
+    ## @param group `str` group to check (`None` = any task)
+    # @returns `bool` whether there are running or pending tasks
+    def is_busy(self, group=None):
+        if group is None:
+            return bool(self._active) or any(lane['pending'] for lane in self._groups.values())
+        lane = self._groups.get(group, None)
+        return bool(lane and (lane['running'] or lane['pending']))
+
+    ## @param group `str` group to check (`None` = all groups)
+    # @returns `int` number of pending (queued, not started) tasks
+    def pending_count(self, group=None):
+        return sum(len(lane['pending']) for g, lane in self._groups.items() if group is None or g == group)
+
+    ## Calls a function as soon as the queue is idle (immediately if it is idle now).
+    # @param fn `callable` function without args
+    def call_when_idle(self, fn):
+        if not self.is_busy():
+            fn()
+        else:
+            self._idle_callbacks.append(fn)
+
+    ## Starts the next pending task in a group if none is running.
+    def _pump(self, group):
+        lane = self._groups[group]
+        if lane['running'] is None and lane['pending']:
+            # max() returns the first of equal-priority tasks, so order is FIFO otherwise
+            task = max(lane['pending'], key=lambda t: t.priority)
+            lane['pending'].remove(task)
+            lane['running'] = task
+            self._start(task)
+
+    ## Starts a task on the thread pool.
+    def _start(self, task):
+        self._active.add(task)
+        self.pool.start(task, task.priority)
+
+    ## Dispatches task events to the task callbacks (in the GUI thread).
+    @Slot(object, str, object)
+    def _on_task_event(self, task, event, payload):
+        if event == 'started':
+            if task.on_start: task.on_start()
+        elif event == 'progress':
+            if task.on_progress: task.on_progress(*payload)
+        elif event == 'finished':
+            self.stats['completed'] += 1
+            if task.on_finish: task.on_finish(payload)
+        elif event == 'error':
+            self.stats['failed'] += 1
+            if task.on_error: task.on_error(payload)
+        elif event == 'cancelled':
+            self.stats['cancelled'] += 1
+            if task.on_cancel: task.on_cancel()
+        elif event == 'done':
+            self._active.discard(task)
+            if not task.group is None:
+                lane = self._groups[task.group]
+                if lane['running'] is task:
+                    lane['running'] = None
+                self._pump(task.group)
+            self.sig_changed.emit()
+            if not self.is_busy():
+                callbacks, self._idle_callbacks = self._idle_callbacks, []
+                for fn in callbacks:
+                    fn()
+                self.sig_idle.emit()
 
 # ******************************************************************************** #
 # *****          BrowseEdit
@@ -524,7 +576,7 @@ class TestEnvEditor(BasicDialog):
         self.chb_user.setChecked(True)
         self.chb_system = QtWidgets.QCheckBox('System')
         self.chb_system.setChecked(False)
-        self.chb_system.setEnabled(sysproxy.CURRENT_USER[1])
+        self.chb_system.setEnabled(sysproxy.current_user()[1])
         self.lo_chb = QtWidgets.QHBoxLayout()
         self.lo_chb.addWidget(self.chb_user)
         self.lo_chb.addWidget(self.chb_system)
@@ -558,23 +610,228 @@ class TestEnvEditor(BasicDialog):
                 finally:
                     self.cb_type.currentIndexChanged.connect(self.on_cb_type)
 
+## @brief Table model exposing a snapshot of the environment variables of a sysproxy::Sysenv object.
+# Rows are `(name, domain, value)` where domain is 'user' or 'system'. Values are formatted
+# for display only when a view asks for them (bytes are shown as hex), so the cost of a
+# refresh does not depend on how many cells are visible. EnvTableModel::update_from()
+# applies row-level deltas (inserted / removed / changed rows) instead of a full reset.
+class EnvTableModel(QtCore.QAbstractTableModel):
+
+    ## Emitted when the user edits a value in a view (args: variable name, domain, new value)
+    sig_value_edited = Signal(str, str, str)
+
+    ## `tuple` column headers
+    HEADERS = ('Variable', 'Domain', 'Value')
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        ## `list` rows as `[name, domain, value]` lists
+        self._rows = []
+        ## `dict` row lookup: `(name, domain)` -> row number
+        self._index = {}
+
+    ## Formats a raw variable value for display.
+    # @param val `Any` the variable value (`str`, `bytes`, number etc.)
+    # @returns `str` display string
+    @staticmethod
+    def format_value(val):
+        if isinstance(val, str):
+            return val
+        if isinstance(val, (bytes, bytearray)):
+            return bytes(val).hex(' ')
+        return str(val)
+
+    ## @returns `bool` whether variables in the given domain can be selected / edited
+    @staticmethod
+    def is_editable(domain):
+        return domain == 'user' or sysproxy.current_user()[1]
+
+    ## @returns `tuple` the `(name, domain, value)` triple for the given source row
+    def row_data(self, row):
+        return tuple(self._rows[row])
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self._rows[index.row()]
+        if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            col = index.column()
+            return self.format_value(row[2]) if col == 2 else row[col]
+        if role == QtCore.Qt.ForegroundRole and index.column() == 2 and not self.is_editable(row[1]):
+            return QtGui.QBrush(QtCore.Qt.gray)
+        return None
+
+    def flags(self, index):
+        flags = QtCore.Qt.ItemIsEnabled
+        if not index.isValid():
+            return flags
+        if self.is_editable(self._rows[index.row()][1]):
+            flags |= QtCore.Qt.ItemIsSelectable
+            if index.column() == 2:
+                flags |= QtCore.Qt.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if role != QtCore.Qt.EditRole or not index.isValid() or index.column() != 2:
+            return False
+        row = self._rows[index.row()]
+        if self.format_value(row[2]) == value:
+            return False
+        row[2] = value
+        self.dataChanged.emit(index, index)
+        self.sig_value_edited.emit(row[0], row[1], value)
+        return True
+
+    ## Synchronizes the model with the variables in a sysproxy::Sysenv object.
+    # The first call (or a call on an empty model) resets the model; subsequent calls
+    # remove, change and append only the rows that differ.
+    # @param sysenv `sysproxy::Sysenv` the env object (its `locals` and `globals` are read)
+    def update_from(self, sysenv):
+        snapshot = {}
+        for domain, envs in (('user', sysenv.locals), ('system', sysenv.globals)):
+            for name, value in envs.items():
+                snapshot[(name, domain)] = value
+
+        if not self._rows:
+            self.beginResetModel()
+            self._rows = [[k[0], k[1], v] for k, v in snapshot.items()]
+            self._index = {k: i for i, k in enumerate(snapshot)}
+            self.endResetModel()
+            return
+
+        # 1 - removed rows (in descending contiguous ranges)
+        removed = sorted((i for k, i in self._index.items() if not k in snapshot), reverse=True)
+        j = 0
+        while j < len(removed):
+            last = removed[j]
+            first = last
+            while j + 1 < len(removed) and removed[j + 1] == first - 1:
+                j += 1
+                first = removed[j]
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+            del self._rows[first:last + 1]
+            self.endRemoveRows()
+            j += 1
+        if removed:
+            self._index = {(r[0], r[1]): i for i, r in enumerate(self._rows)}
+
+        # 2 - changed values
+        for i, row in enumerate(self._rows):
+            value = snapshot[(row[0], row[1])]
+            if value != row[2]:
+                row[2] = value
+                index = self.index(i, 2)
+                self.dataChanged.emit(index, index)
+
+        # 3 - new rows (appended in one go)
+        added = [k for k in snapshot if not k in self._index]
+        if added:
+            first = len(self._rows)
+            self.beginInsertRows(QtCore.QModelIndex(), first, first + len(added) - 1)
+            for i, k in enumerate(added):
+                self._rows.append([k[0], k[1], snapshot[k]])
+                self._index[k] = first + i
+            self.endInsertRows()
+
+    ## Sets a single variable without a full refresh (e.g. on an external change).
+    # @param name `str` variable name
+    # @param domain `str` 'user' or 'system'
+    # @param value `Any` new value or `None` to remove the row
+    def set_var(self, name, domain, value):
+        key = (name, domain)
+        i = self._index.get(key)
+        if i is None:
+            if value is None: return
+            first = len(self._rows)
+            self.beginInsertRows(QtCore.QModelIndex(), first, first)
+            self._rows.append([name, domain, value])
+            self._index[key] = first
+            self.endInsertRows()
+        elif value is None:
+            self.beginRemoveRows(QtCore.QModelIndex(), i, i)
+            del self._rows[i]
+            self.endRemoveRows()
+            self._index = {(r[0], r[1]): j for j, r in enumerate(self._rows)}
+        elif self._rows[i][2] != value:
+            self._rows[i][2] = value
+            index = self.index(i, 2)
+            self.dataChanged.emit(index, index)
+
+## @brief App-wide watcher of the profile files (see watcher module): a single
+# watcher::Watcher thread whose change lists are delivered to the GUI thread
+# via ProfileWatch::sig_changes. Use ProfileWatch::instance() to get it.
+class ProfileWatch(QtCore.QObject):
+
+    ## Emitted (in the GUI thread) on external changes (arg: list of sysproxy::Envchange objects)
+    sig_changes = Signal(object)
+
+    _instance = None
+
+    ## @returns `gui::ProfileWatch` the app-wide instance
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        ## `watcher::Watcher` the watcher thread (`None` if not running)
+        self.watcher = None
+
+    ## Starts watching unless disabled in the app config (`watch` option) or on Windows.
+    def start(self):
+        if self.watcher or sysproxy.OS == 'Windows' or not utils.get_watch():
+            return
+        try:
+            # the signal is emitted in the watcher thread and queued to the receivers
+            self.watcher = watcher.Watcher(lambda changes, paths: self.sig_changes.emit(changes))
+            self.watcher.start()
+        except Exception as err:
+            self.watcher = None
+            utils.log('Cannot watch the profile files: %s', 'error', err)
+
+    ## Stops watching.
+    def stop(self):
+        if self.watcher:
+            self.watcher.stop()
+            self.watcher = None
+
 ## System environment variable viewer and editor interface.
 class TestEnv(BasicDialog):
 
     def __init__(self):
         ## `sysproxy::Sysenv` env variable manipulator object
         self.sysenv = sysproxy.Sysenv(False)
-        ## `gui::QThreadStump` variable update thread
-        self.thread_update = QThreadStump(on_run=self.sysenv.update_vars, on_start=self.update_actions,
-                                          on_finish=self.update_envlist, on_error=self.update_envlist)
-        ## `gui::QThreadStump` variable edit thread
-        self.thread_action = QThreadStump(on_run=None, on_start=self.update_actions,
-                                          on_finish=self.refresh_vars_gui, on_error=self.refresh_vars_gui)
+        ## `gui::TaskQueue` background tasks: refreshes and commits run in the 'env' group
+        # (one at a time); repeated refresh requests are coalesced
+        self.tasks = TaskQueue()
+        ## `bool` whether the dialog may close (set once all tasks are done)
+        self._can_close = False
+        ## `bool` whether the dialog is waiting for the tasks to complete to close
+        self._closing = False
         ## `bool` marker showing that there have been changes to the variables
         self.has_changed = False
-        super().__init__(title='System Environment Variable Editor', icon='settings.png', 
-                         btn_ok={'text': 'Close', 'icon': 'resources/cancel.png', 
+        ## `list` pending (not yet committed) changes as sysproxy::Envchange objects
+        self.pending = []
+        ## `bool` whether to close the dialog once the current commit completes
+        self._close_after_commit = False
+        super().__init__(title='System Environment Variable Editor', icon='settings.png',
+                         btn_ok={'text': 'Close', 'icon': 'resources/cancel.png',
                          'tooltip': 'Close dialog'}, btn_cancel=None)
+        self.tasks.sig_changed.connect(self.update_actions)
+        ProfileWatch.instance().sig_changes.connect(self.on_external_changes)
 
     def addMainLayout(self):
         self.layout_controls = QtWidgets.QVBoxLayout()
@@ -582,17 +839,35 @@ class TestEnv(BasicDialog):
 
         self.lo_controls = QtWidgets.QHBoxLayout()
 
-        ## `QtWidgets.QTableWidget` table showing the env variables
-        self.tw_envs = QtWidgets.QTableWidget(0, 3)
-        self.tw_envs.setMinimumSize(200, 400)
-        self.tw_envs.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
-        self.tw_envs.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
-        self.tw_envs.setSortingEnabled(True)
-        self.tw_envs.itemSelectionChanged.connect(self.update_actions)
-        self.tw_envs.itemChanged.connect(self.tw_itemChanged)
-        self.tw_envs.setHorizontalHeaderLabels(['Variable', 'Domain', 'Value'])
-        self.tw_envs.horizontalHeader().setStretchLastSection(True)
-        self.lo_controls.addWidget(self.tw_envs)
+        self.lo_table = QtWidgets.QVBoxLayout()
+        ## `QtWidgets.QLineEdit` incremental search field (filters TestEnv::tv_envs)
+        self.le_search = QtWidgets.QLineEdit()
+        self.le_search.setPlaceholderText('Search variables')
+        self.le_search.setClearButtonEnabled(True)
+        self.le_search.textChanged.connect(self.on_le_search_changed)
+        self.lo_table.addWidget(self.le_search)
+        ## `gui::EnvTableModel` env variable model
+        self.model_envs = EnvTableModel()
+        self.model_envs.sig_value_edited.connect(self.on_value_edited)
+        ## `QtCore.QSortFilterProxyModel` sorting and filtering proxy for TestEnv::model_envs
+        self.proxy_envs = QtCore.QSortFilterProxyModel()
+        self.proxy_envs.setSourceModel(self.model_envs)
+        self.proxy_envs.setFilterKeyColumn(-1)
+        self.proxy_envs.setFilterCaseSensitivity(QtCore.Qt.CaseInsensitive)
+        self.proxy_envs.setDynamicSortFilter(True)
+        ## `QtWidgets.QTableView` table showing the env variables
+        self.tv_envs = QtWidgets.QTableView()
+        self.tv_envs.setModel(self.proxy_envs)
+        self.tv_envs.setMinimumSize(300, 400)
+        self.tv_envs.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.tv_envs.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        self.tv_envs.setSortingEnabled(True)
+        self.tv_envs.sortByColumn(0, QtCore.Qt.SortOrder.AscendingOrder)
+        self.tv_envs.verticalHeader().setVisible(False)
+        self.tv_envs.horizontalHeader().setStretchLastSection(True)
+        self.tv_envs.selectionModel().selectionChanged.connect(self.update_actions)
+        self.lo_table.addWidget(self.tv_envs)
+        self.lo_controls.addLayout(self.lo_table)
         ## `QtWidgets.QToolBar` toolbar with action buttons
         self.tbar = QtWidgets.QToolBar()
         self.tbar.setOrientation(QtCore.Qt.Vertical)
@@ -616,9 +891,26 @@ class TestEnv(BasicDialog):
         self.act_delete.setToolTip('Delete variables')
         self.act_delete.triggered.connect(self.on_act_delete)
         self.tbar.addAction(self.act_delete)
+        self.tbar.addSeparator()
+        ## `QAction` commit pending changes action
+        self.act_commit = QAction(QtGui.QIcon("resources/success.png"), 'Commit')
+        self.act_commit.setShortcut(QtGui.QKeySequence.Save)
+        self.act_commit.setToolTip('Apply all pending changes to the system')
+        self.act_commit.triggered.connect(self.on_act_commit)
+        self.tbar.addAction(self.act_commit)
+        ## `QAction` discard pending changes action
+        self.act_discard = QAction(QtGui.QIcon("resources/undo.png"), 'Discard')
+        self.act_discard.setToolTip('Discard all pending changes')
+        self.act_discard.triggered.connect(self.on_act_discard)
+        self.tbar.addAction(self.act_discard)
 
         self.lo_controls.addWidget(self.tbar)
         self.layout_controls.addLayout(self.lo_controls)
+        ## `QtWidgets.QListWidget` list of pending changes (see TestEnv::pending)
+        self.lw_pending = QtWidgets.QListWidget()
+        self.lw_pending.setMaximumHeight(100)
+        self.lw_pending.hide()
+        self.layout_controls.addWidget(self.lw_pending)
         ## `QtWidgets.QLabel` warning notification at bottom
         self.l_warning = QtWidgets.QLabel()
         # self.l_warning.setWordWrap(True)
@@ -635,119 +927,119 @@ class TestEnv(BasicDialog):
         # fill vars
         self.on_act_refresh(False)
 
-    def closeEvent(self, event):
-        if self.thread_action.isRunning():
-            self.thread_action.terminate()
-            self.thread_action.wait()
-        if self.thread_update.isRunning():
-            self.thread_update.terminate()
-            self.thread_update.wait()
-        event.accept()
-
-    ## Worker method TestEnv::thread_update to populate the main table from TestEnv::sysenv.
-    def update_envlist(self):
-        try:
-            self.tw_envs.itemSelectionChanged.disconnect()
-            self.tw_envs.itemChanged.disconnect()
-        except:
-            pass
-
-        self.tw_envs.setSortingEnabled(False)
-        self.tw_envs.clearContents()
-        self.tw_envs.setRowCount(len(self.sysenv.locals) + len(self.sysenv.globals))
-        self.tw_envs.setMinimumSize(300, 300)
-
-        i = 0
-        for k, lst_envs in enumerate((self.sysenv.locals, self.sysenv.globals)):
-            for env_name in lst_envs:
-                item0 = QtWidgets.QTableWidgetItem(env_name)
-                item1 = QtWidgets.QTableWidgetItem('user' if k == 0 else 'system')
-                val = lst_envs[env_name]
-                if isinstance(val, str):
-                    sval = val
-                elif isinstance(val, bytes):
-                    sval = " ".join(["{:02x}".format(x) for x in bytearray(val)])
-                else:
-                    sval = str(val)
-                item2 = QtWidgets.QTableWidgetItem(sval)
-
-                flags = QtCore.Qt.ItemIsEnabled
-                if k == 0 or sysproxy.CURRENT_USER[1]:
-                    flags1 = flags | QtCore.Qt.ItemIsSelectable
-                    flags2 = flags1 | QtCore.Qt.ItemIsEditable
-                else:
-                    flags1 = flags
-                    flags2 = flags
-                    item2.setForeground(QtGui.QBrush(QtCore.Qt.gray))
-
-                item0.setFlags(flags1)
-                item1.setFlags(flags1)
-                item2.setFlags(flags2)
-
-                self.tw_envs.setItem(i, 0, item0)
-                self.tw_envs.setItem(i, 1, item1)
-                self.tw_envs.setItem(i, 2, item2)
-                i += 1
-
-        self.tw_envs.setSortingEnabled(True)
-        self.tw_envs.sortByColumn(0, QtCore.Qt.SortOrder.AscendingOrder)
-
-        self.tw_envs.itemSelectionChanged.connect(self.update_actions)
-        self.tw_envs.itemChanged.connect(self.tw_itemChanged)
+    ## Closes the dialog on every path (Close button, Esc, window close button):
+    # asks to commit pending changes (see TestEnv::validate()) and closes once
+    # the background tasks have completed (see `QDialog.done()`).
+    def done(self, result):
+        if self._can_close:
+            ProfileWatch.instance().sig_changes.disconnect(self.on_external_changes)
+            super().done(result)
+            return
+        if self._closing or not self.validate():
+            return
+        # never kill a worker (it may be writing a profile file) and never drop
+        # a queued commit: close once all tasks complete
+        self._closing = True
+        self.tasks.call_when_idle(lambda: self._close_when_idle(result))
+
+    ## Closes the dialog after the background tasks have completed.
+    # @param result `int` the dialog result passed to TestEnv::done()
+    def _close_when_idle(self, result):
+        self._can_close = True
+        self.done(result)
+
+    ## Fires when the Close button is clicked (TestEnv::done() validates).
+    @Slot()
+    def on_btn_OK_clicked(self):
+        self.accept()
 
+    ## Callback for the refresh task: applies the fresh TestEnv::sysenv snapshot
+    # to the table model (see gui::EnvTableModel::update_from()).
+    def update_envlist(self, result=None):
+        self.model_envs.update_from(self.sysenv)
         self.update_actions()
-
-    ## Repopulates the main table in a separate thread (TestEnv::thread_update).
-    def refresh_vars_gui(self):
-        if self.thread_update.isRunning():
-            return
-        while self.thread_action.isRunning():
-            self.thread_action.wait()
+        if self._close_after_commit:
+            self._close_after_commit = False
+            self.accept()
+
+    ## @returns `list` `(name, domain)` pairs of the variables selected in TestEnv::tv_envs
+    def selected_vars(self):
+        res = []
+        for index in self.tv_envs.selectionModel().selectedRows(0):
+            name, domain, _ = self.model_envs.row_data(self.proxy_envs.mapToSource(index).row())
+            res.append((name, domain))
+        return res
+
+    ## Repopulates the main table in a background task (a pending refresh is
+    # replaced by this one, and a running commit completes first).
+    def refresh_vars_gui(self, *args):
         self.update_warning()
-        self.thread_update.start()
-
-    ## Worker method TestEnv::thread_action to unset (delete) the selected variables.
-    # @param varnames `iterable` an iterable of 2-tuples indicating the variable name
-    # and domain:
-    # ```
-    # [ (env_name, 'user' or 'system'), ... ]
-    # ```
-    # @see sysproxy::Sysenv::unset_sys_env()
-    def unset_vars(self, varnames):
-        # varnames: list of 2-tuples: [('env', 'user'), ('env', 'system'), ...]
-        def do_unser_vars():
-            for var in varnames:
-                modes = ['user']
-                if var[1] == 'system':
-                    modes.append('system')
-                self.sysenv.unset_sys_env(var[0], modes, False)
-        self.has_changed = True
-        return do_unser_vars
-
-    ## Worker method TestEnv::thread_action to change a variable.
-    # @param varname `str` the env variable name
-    # @param value `Any` the variable value
-    # @param modes `iterable` an iterable of either or both of 'user' and 'system',
-    # to indicate the domain(s) where the variable must be persisted
-    # @see sysproxy::Sysenv::set_sys_env()
-    def set_var(self, varname, value, modes=('user',)):
-        def do_set_var():
-            self.sysenv.set_sys_env(varname, value, modes, False)
-        self.has_changed = True
-        return do_set_var
-
-    ## Worker method TestEnv::thread_action to create a new variable.
-    # @param varname `str` the env variable name
-    # @param value `Any` the variable value
-    # @param valtype `str`|`int` the type of the value to create (see sysproxy::Sysenv::win_create_reg())
-    # @param modes `iterable` an iterable of either or both of 'user' and 'system',
-    # to indicate the domain(s) where the variable must be persisted
-    # @see sysproxy::Sysenv::set_sys_env()
-    def create_var(self, varname, value, valtype, modes=('user',)):
-        def do_create_var():
-            self.sysenv.set_sys_env(varname, value, True, valtype, modes, False)
+        self.tasks.submit(self._do_refresh, key='refresh', group='env', on_start=self.update_actions,
+                          on_finish=self.update_envlist, on_error=self.update_envlist, on_cancel=self.update_actions)
+
+    ## Task function for TestEnv::refresh_vars_gui(): rereads the variables.
+    @profiling.profiled('TestEnv.refresh')
+    def _do_refresh(self, task):
+        self.sysenv.update_vars()
+
+    ## Task function factory to commit a changeset in one transaction.
+    # @param changes `list` sysproxy::Envchange objects
+    # @returns `callable` the task function
+    # @see sysproxy::Sysenv::apply_changes()
+    def commit_changes(self, changes):
+        def do_commit_changes(task):
+            task.check_cancelled()
+            return self.sysenv.apply_changes(changes, False)
         self.has_changed = True
-        return do_create_var
+        return do_commit_changes
+
+    ## Adds a change to the pending changeset (TestEnv::pending).
+    # A pending 'set' of the same variable and domains is replaced by the new one.
+    # @param change `sysproxy::Envchange` the change to queue
+    def queue_change(self, change):
+        if change.action == 'set':
+            self.pending = [c for c in self.pending if not (c.action == 'set' and c.envname == change.envname and c.modes == change.modes)]
+        self.pending.append(change)
+        self.update_pending()
+
+    ## Updates TestEnv::lw_pending from TestEnv::pending.
+    def update_pending(self):
+        self.lw_pending.clear()
+        self.lw_pending.addItems([str(c) for c in self.pending])
+        self.lw_pending.setVisible(bool(self.pending))
+        self.update_actions()
+
+    ## Starts committing the pending changes in a background task
+    # (followed by a single refresh).
+    def commit_pending(self):
+        if not self.pending:
+            return
+        changes = self.pending
+        self.pending = []
+        self.update_pending()
+        self.tasks.submit(self.commit_changes(changes), group='env', priority=1, on_start=self.update_actions,
+                          on_finish=self.refresh_vars_gui, on_error=self._on_commit_error)
+
+    ## Callback for a failed commit: reports the error and refreshes the table.
+    def _on_commit_error(self, message):
+        self._close_after_commit = False
+        QtWidgets.QMessageBox.critical(self, 'Error', f'Failed to commit changes:\n{message}')
+        self.refresh_vars_gui()
+
+    ## Asks to commit pending changes before closing.
+    # @returns `bool` `True` if the dialog can close right away
+    def validate(self):
+        if not self.pending:
+            return True
+        btn = QtWidgets.QMessageBox.question(self, 'Pending changes',
+                                             f'Commit {len(self.pending)} pending change(s) before closing?',
+                                             QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No | QtWidgets.QMessageBox.Cancel,
+                                             QtWidgets.QMessageBox.Yes)
+        if btn == QtWidgets.QMessageBox.Yes:
+            self._close_after_commit = True
+            self.commit_pending()
+            return False
+        return btn == QtWidgets.QMessageBox.No
 
     # ============================================= SLOTS ================================================================ #
 
@@ -755,39 +1047,48 @@ class TestEnv(BasicDialog):
     # selected variables.
     @Slot()
     def update_actions(self):
-        cnt_sel = len(self.tw_envs.selectedItems())
-        running = self.thread_update.isRunning() or self.thread_action.isRunning()
-        self.act_delete.setEnabled(not running and cnt_sel > 2)
+        cnt_sel = len(self.tv_envs.selectionModel().selectedRows(0))
+        running = self.tasks.is_busy('env')
+        self.act_delete.setEnabled(not running and cnt_sel > 0)
         self.act_refresh.setEnabled(not running)
         self.act_add.setEnabled(not running)
+        self.act_commit.setEnabled(not running and bool(self.pending))
+        self.act_discard.setEnabled(not running and bool(self.pending))
 
     ## Updates the visibility and text of TestEnv::l_warning
     # if Super User privileges are detected or a variable change on Unix.
     @Slot()
     def update_warning(self):
-        if (not self.has_changed and not sysproxy.CURRENT_USER[1]):
+        if (not self.has_changed and not sysproxy.current_user()[1]):
             return
         txt = ''
-        if sysproxy.CURRENT_USER[1]:
+        if sysproxy.current_user()[1]:
             txt = 'SuperUser privileges active!<br>'
         if self.has_changed and sysproxy.OS != 'Windows':
             txt += 'Relogin to apply changes to OS!'
         self.l_warning.setText(f'<span style="font-size:11pt; font-weight:600; color:red;">{txt}</span>')
         self.l_warning.show()
 
+    ## Applies external changes of the profile files (see gui::ProfileWatch) to
+    # TestEnv::sysenv and updates only the affected rows. While a task is running,
+    # a full refresh is queued instead.
+    @Slot(object)
+    def on_external_changes(self, changes):
+        if self.tasks.is_busy('env'):
+            self.refresh_vars_gui()
+            return
+        for name in self.sysenv.apply_external(changes):
+            self.model_envs.set_var(name, 'user', self.sysenv.locals.get(name))
+
     ## TestEnv::act_refresh handler: calls TestEnv::refresh_vars_gui().
     @Slot(bool)
     def on_act_refresh(self, checked):
         self.refresh_vars_gui()
 
     ## TestEnv::act_add handler: shows gui::TestEnvEditor dialog to
-    # create a new env variable.
+    # queue a new env variable (see TestEnv::pending).
     @Slot(bool)
     def on_act_add(self, checked):
-        while self.thread_update.isRunning() or self.thread_action.isRunning():
-            self.thread_update.wait()
-            self.thread_action.wait()
-
         new_var_dlg = TestEnvEditor()
         if not new_var_dlg.exec():
             return
@@ -820,52 +1121,231 @@ class TestEnv(BasicDialog):
 
         if not modes: return
 
-        self.thread_action.on_run = self.create_var(env, val, valtype, modes)
-        self.thread_action.start()
+        self.queue_change(sysproxy.Envchange('create', env, val, valtype, tuple(modes)))
 
-    ## TestEnv::act_delete handler: runs TestEnv::thread_action thread with the
-    # TestEnv::unset_vars() method to delete the variables currently selected in 
-    # TestEnv::tw_envs.
+    ## TestEnv::act_delete handler: queues the variables currently selected in 
+    # TestEnv::tv_envs for deletion (see TestEnv::pending).
     @Slot(bool)
     def on_act_delete(self, checked):
-        selitems = self.tw_envs.selectedItems()
-        if len(selitems) < 2 or self.thread_update.isRunning():
+        selvars = self.selected_vars()
+        if not selvars:
             return
 
-        while self.thread_action.isRunning():
-            self.thread_action.wait()
-
         warned = False
         envs_to_unset = []
-        for item in selitems:
-            if item.column() != 0: continue
-            envmode = self.tw_envs.item(item.row(), 1).text()
-            if envmode == 'system' and not sysproxy.CURRENT_USER[1]:
+        for env, envmode in selvars:
+            if envmode == 'system' and not sysproxy.current_user()[1]:
                 if not warned:
                     QtWidgets.QMessageBox.warning(self, 'Warning', 'Cannot unset variable without SU privilege!')
+                    warned = True
                 continue
-            envs_to_unset.append((item.text(), envmode))
+            envs_to_unset.append((env, envmode))
 
-        if not envs_to_unset: return
+        for env, envmode in envs_to_unset:
+            self.queue_change(sysproxy.Envchange('unset', env, None, None, ('user', 'system') if envmode == 'system' else ('user',)))
 
-        self.thread_action.on_run = self.unset_vars(envs_to_unset)
-        self.thread_action.start()
+    ## Triggers when a variable value has been edited in TestEnv::tv_envs:
+    # queues the new value (see TestEnv::pending).
+    @Slot(str, str, str)
+    def on_value_edited(self, env, envmode, val):
+        self.queue_change(sysproxy.Envchange('set', env, val, None, (envmode,)))
 
-    ## Triggers when a variable has been changed / added in TestEnv::tw_envs.
-    @Slot(QtWidgets.QTableWidgetItem)
-    def tw_itemChanged(self, item: QtWidgets.QTableWidgetItem):
-        if item.column() != 2 or self.thread_update.isRunning():
-            return
+    ## TestEnv::act_commit handler: commits the pending changes.
+    @Slot(bool)
+    def on_act_commit(self, checked):
+        self.commit_pending()
 
-        while self.thread_action.isRunning():
-            self.thread_action.wait()
+    ## TestEnv::act_discard handler: drops the pending changes and reloads
+    # the variables (reverting edited values in the table).
+    @Slot(bool)
+    def on_act_discard(self, checked):
+        self.pending = []
+        self.update_pending()
+        self.refresh_vars_gui()
+
+    ## Filters TestEnv::tv_envs as the search text is typed.
+    @Slot(str)
+    def on_le_search_changed(self, text):
+        self.proxy_envs.setFilterFixedString(text)
+
+# ******************************************************************************** #
+# *****          LogViewer
+# ******************************************************************************** #
+
+## @brief Live view of the recent log records (see utils::RingBufferHandler)
+# filtered by level and text.
+class LogViewer(BasicDialog):
+
+    ## `tuple` (caption, level) items of the level filter
+    LEVELS = (('Debug', logging.DEBUG), ('Info', logging.INFO), ('Warning', logging.WARNING), ('Error', logging.ERROR))
+    ## `int` interval for showing new records (ms)
+    FLUSH_MS = 200
+
+    def __init__(self, parent=None):
+        ## `utils::RingBufferHandler` the log record buffer
+        self.buffer = utils.get_log_buffer()
+        ## `collections.deque` new records waiting to be shown (appended by the logging thread)
+        self._incoming = collections.deque()
+        super().__init__(title='Log', icon='info1.png', parent=parent,
+                         btn_ok={'text': 'Close', 'icon': 'resources/cancel.png', 'tooltip': 'Close log'}, btn_cancel=None,
+                         sizepolicy=QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Expanding))
+        self.reload()
+        self.buffer.listeners.append(self._incoming.append)
+        ## `QtCore.QTimer` timer moving new records to the view
+        self.flush_timer = QtCore.QTimer(self)
+        self.flush_timer.timeout.connect(self.flush)
+        self.flush_timer.start(self.FLUSH_MS)
 
-        env = self.tw_envs.item(item.row(), 0).text()
-        val = item.text()
-        envmode = self.tw_envs.item(item.row(), 1).text()
+    def addMainLayout(self):
+        self.layout_controls = QtWidgets.QVBoxLayout()
 
-        self.thread_action.on_run = self.set_var(env, val, (envmode,))
-        self.thread_action.start()
+        self.lo_filter = QtWidgets.QHBoxLayout()
+        ## `QtWidgets.QComboBox` minimum level of the shown records
+        self.cb_level = QtWidgets.QComboBox()
+        for caption, level in self.LEVELS:
+            self.cb_level.addItem(caption, level)
+        self.cb_level.setCurrentIndex(0 if utils.get_debug() else 1)
+        self.cb_level.currentIndexChanged.connect(self.reload)
+        self.lo_filter.addWidget(self.cb_level)
+        ## `QtWidgets.QLineEdit` text filter (case-insensitive)
+        self.le_filter = QtWidgets.QLineEdit()
+        self.le_filter.setPlaceholderText('Filter messages')
+        self.le_filter.setClearButtonEnabled(True)
+        self.le_filter.textChanged.connect(self.reload)
+        self.lo_filter.addWidget(self.le_filter)
+        self.layout_controls.addLayout(self.lo_filter)
+
+        ## `QtWidgets.QPlainTextEdit` the log view
+        self.te_log = QtWidgets.QPlainTextEdit()
+        self.te_log.setReadOnly(True)
+        self.te_log.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
+        self.te_log.setMaximumBlockCount(utils.LOGBUFFER)
+        self.te_log.setMinimumSize(600, 400)
+        self.layout_controls.addWidget(self.te_log)
+
+    ## @returns `bool` whether a record passes the current filters
+    def accepts(self, record):
+        if record.levelno < self.cb_level.currentData():
+            return False
+        text = self.le_filter.text().lower()
+        return not text or text in record.getMessage().lower()
+
+    ## Fills the view with all the buffered records that pass the filters.
+    @Slot()
+    def reload(self, *args):
+        self._incoming.clear()
+        self.te_log.setPlainText('\n'.join(self.buffer.format(rec) for rec in self.buffer.snapshot() if self.accepts(rec)))
+        self.te_log.moveCursor(QtGui.QTextCursor.End)
+
+    ## Appends the new records that pass the filters to the view.
+    @Slot()
+    def flush(self):
+        lines = []
+        while self._incoming:
+            rec = self._incoming.popleft()
+            if self.accepts(rec):
+                lines.append(self.buffer.format(rec))
+        if lines:
+            self.te_log.appendPlainText('\n'.join(lines))
+
+    def done(self, result):
+        self.flush_timer.stop()
+        if self._incoming.append in self.buffer.listeners:
+            self.buffer.listeners.remove(self._incoming.append)
+        super().done(result)
+
+# ******************************************************************************** #
+# *****          Diagnostics
+# ******************************************************************************** #
+
+## @brief Diagnostics panel showing the operation metrics (see metrics module):
+# counters, timing stats per operation and the recent traces (e.g. of each apply).
+class Diagnostics(BasicDialog):
+
+    def __init__(self, parent=None):
+        super().__init__(title='Diagnostics', icon='settings.png', parent=parent,
+                         btn_ok={'text': 'Close', 'icon': 'resources/cancel.png', 'tooltip': 'Close diagnostics'}, btn_cancel=None,
+                         sizepolicy=QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Expanding))
+        self.refresh()
+
+    def addMainLayout(self):
+        self.layout_controls = QtWidgets.QVBoxLayout()
+
+        self.lo_top = QtWidgets.QHBoxLayout()
+        ## `QtWidgets.QCheckBox` switches metrics collection on / off
+        self.chb_enabled = QtWidgets.QCheckBox('Collect metrics')
+        self.chb_enabled.setChecked(metrics.is_enabled())
+        self.chb_enabled.toggled.connect(self.on_chb_enabled)
+        self.lo_top.addWidget(self.chb_enabled)
+        self.lo_top.addStretch()
+        for caption, tooltip, slot in (('Refresh', 'Show the latest metrics', self.refresh),
+                                       ('Reset', 'Clear the collected metrics', self.on_btn_reset),
+                                       ('Export...', 'Save the metrics as JSON or Prometheus text', self.on_btn_export)):
+            btn = QtWidgets.QPushButton(caption)
+            btn.setToolTip(tooltip)
+            btn.clicked.connect(slot)
+            self.lo_top.addWidget(btn)
+        self.layout_controls.addLayout(self.lo_top)
+
+        ## `QtWidgets.QTreeWidget` counters, span stats and traces
+        self.tw_metrics = QtWidgets.QTreeWidget()
+        self.tw_metrics.setHeaderLabels(['Name', 'Calls / value', 'Total / offset, ms', 'Avg / duration, ms', 'Max, ms'])
+        self.tw_metrics.setMinimumSize(700, 450)
+        self.layout_controls.addWidget(self.tw_metrics)
+
+    ## Adds a trace span and its nested spans to the tree.
+    def _add_span(self, parent, span):
+        counters = ', '.join(f'{k}={v}' for k, v in span['counters'].items())
+        item = QtWidgets.QTreeWidgetItem(parent, [span['name'], counters, str(span['offset_ms']), str(span['duration_ms'])])
+        for child in span['children']:
+            self._add_span(item, child)
+        return item
+
+    ## Fills the tree with the current metrics.
+    @Slot()
+    def refresh(self):
+        data = metrics.snapshot()
+        self.tw_metrics.clear()
+        it_counters = QtWidgets.QTreeWidgetItem(self.tw_metrics, ['Counters'])
+        for name, value in data['counters'].items():
+            QtWidgets.QTreeWidgetItem(it_counters, [name, str(value)])
+        it_spans = QtWidgets.QTreeWidgetItem(self.tw_metrics, ['Operations'])
+        for name, stats in sorted(data['spans'].items(), key=lambda item: -item[1]['total_ms']):
+            QtWidgets.QTreeWidgetItem(it_spans, [name, str(stats['calls']), str(stats['total_ms']),
+                                                 str(stats['avg_ms']), str(stats['max_ms'])])
+        it_traces = QtWidgets.QTreeWidgetItem(self.tw_metrics, ['Traces'])
+        for trace in reversed(metrics.traces()):
+            item = self._add_span(it_traces, trace)
+            item.setText(0, f"{time.strftime('%H:%M:%S', time.localtime(trace['time']))} {trace['name']}" +
+                         (f" ({trace['error']})" if trace['error'] else ''))
+        it_counters.setExpanded(True)
+        it_spans.setExpanded(True)
+        it_traces.setExpanded(True)
+        if it_traces.childCount():
+            it_traces.child(0).setExpanded(True)
+        for i in range(self.tw_metrics.columnCount()):
+            self.tw_metrics.resizeColumnToContents(i)
+
+    ## Switches metrics collection on / off.
+    @Slot(bool)
+    def on_chb_enabled(self, checked):
+        metrics.enable(checked)
+
+    ## Clears the collected metrics.
+    @Slot()
+    def on_btn_reset(self):
+        metrics.reset()
+        self.refresh()
+
+    ## Saves the metrics to a JSON (metrics::to_json()) or Prometheus text file (metrics::to_prometheus()).
+    @Slot()
+    def on_btn_export(self):
+        selected_path, selected_filter = QtWidgets.QFileDialog.getSaveFileName(self, 'Export metrics', 'metrics.json', 
+                                                                               'JSON files (*.json);;Prometheus text (*.prom *.txt)')
+        if not selected_path: return
+        text = metrics.to_json() if selected_path.lower().endswith('.json') else metrics.to_prometheus()
+        with open(selected_path, 'w', encoding=utils.CODING) as f_:
+            f_.write(text)
 
 # ******************************************************************************** #
 # *****          MainWindow
@@ -887,18 +1367,48 @@ class MainWindow(BasicDialog):
             return QtWidgets.QApplication(args)
 
     def __init__(self):
-        ## `sysproxy::Proxy` the proxy manipulation object
-        self.sysproxy = sysproxy.Proxy()
+        ## `float` window creation time (used to log the startup timings)
+        self._t_created = time.perf_counter()
+        ## `bool` whether the window has been painted at least once
+        self._first_painted = False
+        ## `sysproxy::Proxy` the proxy manipulation object (`None` until the system settings are read)
+        self.sysproxy = None
         ## `dict` local proxy settings bound to the GUI controls
-        self.localproxy = self.sysproxy.asdict()
+        self.localproxy = {k: v for k, v in PLACEHOLDER_PROXY.items()}
+        ## `set` keys of the settings in MainWindow::localproxy that differ from the system:
+        # 'enabled', 'noproxy' or `(proxy, field)` tuples, e.g. `('http_proxy', 'host')`
+        # (see MainWindow::mark_dirty())
+        self.dirty = set()
+        ## `int` MainWindow::sysproxy version MainWindow::dirty was last fully computed for
+        self._dirty_version = None
+        ## `dict` highlighted state of the controls (to restyle only the controls whose state changes)
+        self._highlighted = {}
+        ## `bool` whether the window may close (set once all tasks are done)
+        self._can_close = False
+        ## `dict` latest desired state snapshot waiting for the debounce timer (or `None`)
+        self._desired = None
+        ## `int` number of apply requests merged with later ones (debounced, coalesced or superseded)
+        self.apply_coalesced = 0
+        ## `str` result of the last login shell check (see MainWindow::check_login_env())
+        self.login_check = ''
+        ## `gui::TaskQueue` background tasks; all operations on MainWindow::sysproxy
+        # run in the 'proxy' group (one at a time)
+        self.tasks = TaskQueue()
+        ## `QtCore.QTimer` debounce timer for MainWindow::request_apply()
+        self.apply_timer = QtCore.QTimer()
+        self.apply_timer.setSingleShot(True)
+        self.apply_timer.setInterval(APPLY_DEBOUNCE_MS)
+        self.apply_timer.timeout.connect(self.flush_apply)
+        # read the system settings before the UI is built so that both run concurrently
+        self.tasks.submit(self._do_load_system, group='proxy', priority=1,
+                          on_finish=self._on_load_finish, on_error=self._on_load_error)
         rec = QtGui.QGuiApplication.primaryScreen().geometry()
-        ## `gui::QThreadStump` thread to apply proxy changes to system
-        self.thread_apply = QThreadStump(on_run=None, on_start=self._on_apply_start,
-                                         on_finish=self._on_apply_finish, on_error=self._on_apply_finish)
         super().__init__(title='Proxen!', icon='proxen.png', geometry=(rec.width() // 2 - 225, rec.height() // 2 - 100, 500, 600),
                          flags=QtCore.Qt.Dialog | QtCore.Qt.MSWindowsFixedSizeDialogHint)
         self.btn_OK.setToolTip('Apply changes and quit')
         self.btn_cancel.setToolTip('Cancel changes and quit')
+        self.tasks.sig_changed.connect(self.update_apply_status)
+        self.set_loading(True)
         self.settings_to_gui()
 
     def addMainLayout(self):
@@ -1083,12 +1593,32 @@ class MainWindow(BasicDialog):
 
         self.chb_debug = QtWidgets.QCheckBox('Debug messages to console')
         self.chb_debug.setToolTip('Setting will apply after app restart')
-        self.chb_debug.setChecked(utils.DEBUG)
+        self.chb_debug.setChecked(utils.get_debug())
         self.lo_wappconfig.addWidget(self.chb_debug)
         self.chb_log = QtWidgets.QCheckBox('Write log to log.txt')
         self.chb_log.setToolTip(self.chb_debug.toolTip())
-        self.chb_log.setChecked(not utils.LOGFILE is None)
+        self.chb_log.setChecked(not utils.get_logfile() is None)
         self.lo_wappconfig.addWidget(self.chb_log)
+        self.chb_envcache = QtWidgets.QCheckBox('Write shell env cache')
+        self.chb_envcache.setToolTip('Keep proxy variables in files that shell rc files can source:\n' +
+                                     '\n'.join(envcache.source_line(sx) for sx in envcache.SYNTAXES))
+        self.chb_envcache.setChecked(utils.get_envcache())
+        self.lo_wappconfig.addWidget(self.chb_envcache)
+        self.chb_metrics = QtWidgets.QCheckBox('Collect operation metrics')
+        self.chb_metrics.setToolTip('Record timings and counters of the proxy operations (see Diagnostics)')
+        self.chb_metrics.setChecked(metrics.is_enabled())
+        self.chb_metrics.toggled.connect(metrics.enable)
+        self.lo_wappconfig.addWidget(self.chb_metrics)
+        self.chb_watch = QtWidgets.QCheckBox('Watch profile files')
+        self.chb_watch.setToolTip('Pick up proxy variables changed in the profile files by other programs')
+        self.chb_watch.setChecked(utils.get_watch())
+        self.lo_wappconfig.addWidget(self.chb_watch)
+        self.chb_privhelper = QtWidgets.QCheckBox('Write system files via privileged helper')
+        self.chb_privhelper.setToolTip('Ask for the root password once per session to update the system profile files\n' +
+                                       'without running the app as root (Unix)')
+        self.chb_privhelper.setChecked(utils.get_privhelper())
+        self.chb_privhelper.setVisible(sysproxy.OS != 'Windows')
+        self.lo_wappconfig.addWidget(self.chb_privhelper)
 
         self.act_envedit = QAction(QtGui.QIcon("resources/edit.png"), 'Env variables...')
         self.act_envedit.setToolTip('View and edit all environment variables')
@@ -1099,6 +1629,33 @@ class MainWindow(BasicDialog):
         self.btn_envedit.setDefaultAction(self.act_envedit)
         self.lo_wappconfig.addWidget(self.btn_envedit)
 
+        self.act_log = QAction(QtGui.QIcon("resources/info.png"), 'Log...')
+        self.act_log.setToolTip('View the recent log messages')
+        self.act_log.triggered.connect(self.on_act_log)
+        self.btn_log = QtWidgets.QToolButton()
+        self.btn_log.setToolButtonStyle(QtCore.Qt.ToolButtonTextBesideIcon)
+        self.btn_log.setFixedWidth(150)
+        self.btn_log.setDefaultAction(self.act_log)
+        self.lo_wappconfig.addWidget(self.btn_log)
+
+        self.act_diagnostics = QAction(QtGui.QIcon("resources/settings.png"), 'Diagnostics...')
+        self.act_diagnostics.setToolTip('View operation metrics and traces')
+        self.act_diagnostics.triggered.connect(self.on_act_diagnostics)
+        self.btn_diagnostics = QtWidgets.QToolButton()
+        self.btn_diagnostics.setToolButtonStyle(QtCore.Qt.ToolButtonTextBesideIcon)
+        self.btn_diagnostics.setFixedWidth(150)
+        self.btn_diagnostics.setDefaultAction(self.act_diagnostics)
+        self.lo_wappconfig.addWidget(self.btn_diagnostics)
+
+        self.act_report = QAction(QtGui.QIcon("resources/save.png"), 'Bug report...')
+        self.act_report.setToolTip('Pack the profiles and the log into a zip file for a bug report')
+        self.act_report.triggered.connect(self.on_act_report)
+        self.btn_report = QtWidgets.QToolButton()
+        self.btn_report.setToolButtonStyle(QtCore.Qt.ToolButtonTextBesideIcon)
+        self.btn_report.setFixedWidth(150)
+        self.btn_report.setDefaultAction(self.act_report)
+        self.lo_wappconfig.addWidget(self.btn_report)
+
         self.lo_wappconfig.addStretch()
         self.wappconfig.setLayout(self.lo_wappconfig)
         self.tb.addItem(self.wappconfig, 'Settings')
@@ -1124,50 +1681,248 @@ class MainWindow(BasicDialog):
         self.layout_controls.addWidget(self.tb)
         # self.layout_controls.addStretch()
 
-    ## Applies the local settings to the system.
+        ## `QtWidgets.QLabel` apply pipeline status (see MainWindow::update_apply_status())
+        self.l_status = QtWidgets.QLabel()
+        self.l_status.setStyleSheet('QLabel { color: gray; }')
+        self.layout_controls.addWidget(self.l_status)
+
+    ## Task function reading the system settings on startup.
+    # @returns `sysproxy::Proxy` the new proxy object
+    def _do_load_system(self, task):
+        return sysproxy.Proxy()
+
+    ## Callback triggered after the startup task (MainWindow::_do_load_system()) completes:
+    # fills the GUI controls with the system settings.
+    def _on_load_finish(self, proxy):
+        self.sysproxy = proxy
+        self.localproxy = copy.deepcopy(self.sysproxy.asdict())
+        self.set_loading(False)
+        self.settings_to_gui()
+        watch = ProfileWatch.instance()
+        watch.sig_changes.connect(self.on_external_changes)
+        watch.start()
+        utils.log('Startup: time to interactive = %.1f ms', 'info', (time.perf_counter() - self._t_created) * 1000)
+
+    ## Callback triggered if reading the system settings fails.
+    def _on_load_error(self, message):
+        self.setWindowTitle('Proxen! (failed to read system settings)')
+        QtWidgets.QMessageBox.critical(self, 'Error', f'Failed to read system proxy settings:\n{message}')
+
+    ## Shows or hides the 'loading' state: while the system settings are being read,
+    # the controls are disabled and show placeholder values.
+    # @param loading `bool` `True` to enter the loading state, `False` to leave it
+    def set_loading(self, loading):
+        self.tb.setEnabled(not loading)
+        self.btn_OK.setEnabled(not loading)
+        self.setWindowTitle('Proxen! (reading system settings...)' if loading else 'Proxen!')
+
+    ## Logs the time to first paint (called once, after the first show).
+    def _on_first_paint(self):
+        utils.log('Startup: time to first paint = %.1f ms', 'info', (time.perf_counter() - self._t_created) * 1000)
+
+    ## Task function factory applying a snapshot of the local settings to the system.
+    # The task stops at the next safe point if it is superseded by a newer apply.
+    # @param dconfig `dict` the settings snapshot
+    # @returns `callable` the task function
     # @see sysproxy::Proxy::fromdict()
-    def _do_apply_config(self):
-        self.sysproxy.fromdict(self.localproxy)
-        # time.sleep(5)        
+    def _do_apply_config(self, dconfig):
+        def do_apply_config(task):
+            self.sysproxy.fromdict(dconfig, task.check_cancelled)
+            return dconfig
+        return do_apply_config
 
-    ## Restores the previous proxy settings.
+    ## Task function restoring the previous proxy settings.
     # @see sysproxy::Proxy::restore()
-    def _do_restore_config(self):
+    def _do_restore_config(self, task):
         self.sysproxy.restore()
 
-    ## Callback triggered after the apply thread (MainWindow::thread_apply) completes its job.
-    def _on_apply_finish(self):
-        self.localproxy = self.sysproxy.asdict()
+    ## Callback triggered after an apply / restore task completes its job (successfully or not).
+    # The local settings are synchronized with the system only if no newer apply is queued
+    # and they have not been edited since the snapshot was taken.
+    # @param dconfig `dict` the applied snapshot (`None` for restore or on error)
+    def _on_apply_finish(self, dconfig=None):
         self.loading_widget.hide()
         self.setVisible(True)
-        self.settings_to_gui()
+        if self._desired is None and self.tasks.pending_count('proxy') == 0 and \
+           (not isinstance(dconfig, dict) or dconfig == self.localproxy):
+            self.localproxy = copy.deepcopy(self.sysproxy.asdict())
+            self.settings_to_gui()
+            self.check_login_env()
+        else:
+            self.update_actions_enabled()
+
+    ## Starts a background check of the proxy variables a new login shell of the user
+    # will get from the startup files (Unix only, see sysproxy::Sysenv::login_envs()).
+    def check_login_env(self):
+        if sysproxy.OS == 'Windows' or self.sysproxy is None:
+            return
+        self.tasks.submit(lambda task: self.sysproxy.sysenv.login_envs(), group='login',
+                          on_finish=self._on_login_envs, on_error=lambda message: None)
+
+    ## Callback triggered when the login shell check completes: compares the simulated
+    # variables with the applied settings and shows the result in MainWindow::l_status.
+    # @param result `dict` `{shell: {name: value}}`
+    def _on_login_envs(self, result):
+        if self.sysproxy is None:
+            return
+        expected = sysproxy.proxy_envs(self.sysproxy.asdict(), False)
+        lines = []
+        for shell, envs in result.items():
+            for name in sysproxy.PROXY_TYPES + ('no_proxy',):
+                value = envs.get(name, envs.get(name.upper()))
+                if value != expected.get(name):
+                    lines.append(f'{shell}: {name} = {value!r} (expected {expected.get(name)!r})')
+        shells = ', '.join(result)
+        self.login_check = f'{shells} login: ' + (f'{len(lines)} mismatch(es)' if lines else 'OK')
+        self.l_status.setToolTip('\n'.join(lines) if lines else f'A new {shells} login shell gets the applied settings')
+        self.update_apply_status()
+
+    ## Takes over external changes of the profile files (see gui::ProfileWatch) in the
+    # 'proxy' group (after any running apply). Unedited settings follow the system;
+    # edited ones are kept and highlighted against the new system state.
+    @Slot(object)
+    def on_external_changes(self, changes):
+        if self.sysproxy is None:
+            return
+        self.tasks.submit(lambda task: self.sysproxy.apply_external(changes), group='proxy',
+                          on_finish=self._on_external_finish, on_error=lambda message: None)
+
+    ## Callback triggered after MainWindow::on_external_changes() has updated the system settings.
+    # @param changed `bool` whether the proxy settings have changed
+    def _on_external_finish(self, changed):
+        if not changed:
+            return
+        if self._desired is None and self.tasks.pending_count('proxy') == 0 and not self.has_changes():
+            self.localproxy = copy.deepcopy(self.sysproxy.asdict())
+            self.settings_to_gui()
+        else:
+            self.update_dirty()
+            self.update_actions_enabled()
+
+    ## Callback triggered when an apply task is superseded by a newer one
+    # (counts it in MainWindow::apply_coalesced).
+    def _on_apply_cancel(self):
+        self.apply_coalesced += 1
+        self.update_apply_status()
 
-    ## Callback triggered before the apply thread (MainWindow::thread_apply) starts its job.
-    def _on_apply_start(self):
+    ## Callback triggered before a restore task starts its job.
+    def _on_restore_start(self):
         self.setVisible(False)
         self.loading_widget.setGeometry(self.x(), self.y(), self.width(), self.height())
         self.loading_widget.show()
 
-    ## Starts the apply thread (MainWindow::thread_apply) to apply changes.
+    ## Requests applying the current local settings (debounced): a snapshot of
+    # MainWindow::localproxy is taken now and applied when no further request
+    # arrives within gui::APPLY_DEBOUNCE_MS; only the latest snapshot is applied.
+    def request_apply(self):
+        if self.sysproxy is None:
+            return
+        if not self._desired is None:
+            self.apply_coalesced += 1
+        self._desired = copy.deepcopy(self.localproxy)
+        self.apply_timer.start()
+        self.update_apply_status()
+
+    ## Submits the latest desired state snapshot (debounce timer handler).
+    # A queued apply is dropped and a running one is cancelled at its next safe point.
+    @Slot()
+    def flush_apply(self):
+        self.apply_timer.stop()
+        if self._desired is None or self.sysproxy is None:
+            return
+        dconfig, self._desired = self._desired, None
+        self.tasks.submit(self._do_apply_config(dconfig), key='apply', group='proxy', on_start=self.update_apply_status,
+                          on_finish=self._on_apply_finish, on_error=lambda message: self._on_apply_finish(),
+                          on_cancel=self._on_apply_cancel)
+
+    ## Applies the local settings right away (no debouncing).
     def apply_config(self):
-        if self.thread_apply.isRunning():
+        if self.sysproxy is None:
             return
-        self.thread_apply.on_run = self._do_apply_config
-        # self.thread_apply.on_finish = self._on_apply_finish
-        self.thread_apply.start()
+        self._desired = copy.deepcopy(self.localproxy)
+        self.flush_apply()
 
-    ## Starts the apply thread (MainWindow::thread_apply) to restore the previous state.
+    ## Starts a background task to restore the previous state
+    # (pending applies are dropped).
     def restore_config(self):
-        if self.thread_apply.isRunning():
+        if self.sysproxy is None:
+            return
+        self.apply_timer.stop()
+        self._desired = None
+        self.tasks.submit(self._do_restore_config, key='apply', group='proxy', on_start=self._on_restore_start,
+                          on_finish=lambda result: self._on_apply_finish(), on_error=lambda message: self._on_apply_finish(),
+                          on_cancel=self._on_apply_cancel)
+
+    ## Shows the apply pipeline state in MainWindow::l_status: idle / waiting (debouncing) /
+    # applying, the number of queued requests and the number of coalesced requests.
+    @Slot()
+    def update_apply_status(self):
+        if self.tasks.is_busy('proxy'):
+            state = 'applying...'
+        elif self.apply_timer.isActive():
+            state = 'waiting...'
+        else:
+            state = 'idle'
+        queued = self.tasks.pending_count('proxy') + (0 if self._desired is None else 1)
+        # each merged request is counted once: by request_apply() (debounced) or
+        # MainWindow::_on_apply_cancel() (dropped from the queue or superseded while running)
+        self.l_status.setText(f'Apply: {state}   queued: {queued}   coalesced: {self.apply_coalesced}' +
+                              (f'   {self.login_check}' if self.login_check else ''))
+
+    ## Queues a final apply or restore (after any running one) and calls a function when it completes.
+    # @param apply `bool` `True` to apply the local settings, `False` to restore the previous ones
+    # @param on_done `callable` function without args called when the task completes
+    def finish_config(self, apply, on_done):
+        self.apply_timer.stop()
+        self._desired = None
+        self.tasks.submit(self._do_apply_config(copy.deepcopy(self.localproxy)) if apply else self._do_restore_config,
+                          key='apply', group='proxy',
+                          on_finish=lambda result: on_done(), on_error=lambda message: on_done(),
+                          on_cancel=on_done)
+
+    ## Closes the window after the background tasks have completed.
+    def _close_now(self):
+        ProfileWatch.instance().stop()
+        self.offer_report()
+        self._can_close = True
+        self.close()
+
+    ## Closes the dialog via the OK / Cancel buttons (see `QDialog.done()`).
+    def done(self, result):
+        ProfileWatch.instance().stop()
+        self.offer_report()
+        super().done(result)
+
+    ## Offers to pack the profiles written in this session (see profiling module)
+    # and the log into a zip file for a bug report.
+    def offer_report(self):
+        if not profiling.session_files():
+            return
+        btn = QtWidgets.QMessageBox.question(self, 'Profiles recorded',
+                                             f'{len(profiling.session_files()) // 2} operation profile(s) were recorded ' +
+                                             f'in "{profiling.diag_dir()}".\nPack them with the log for a bug report?',
+                                             defaultButton=QtWidgets.QMessageBox.No)
+        if btn == QtWidgets.QMessageBox.Yes:
+            self.make_report()
+
+    ## Packs the profiles and the log into a zip file and shows its location.
+    def make_report(self):
+        try:
+            zip_path = profiling.bundle(all_files=not profiling.session_files())
+        except Exception as err:
+            traceback.print_exc()
+            QtWidgets.QMessageBox.critical(self, 'Bug report', f'Failed to create the report: {err}')
             return
-        self.thread_apply.on_run = self._do_restore_config
-        # self.thread_apply.on_finish = self._on_apply_finish
-        self.thread_apply.start()
+        QtWidgets.QMessageBox.information(self, 'Bug report', f'Report saved to:\n{zip_path}')
 
     ## Saves the app settings to `config.ini`.
     def save_app_settings(self):
-        utils.CONFIG['app']['debug'] = str(self.chb_debug.isChecked()).lower()
-        utils.CONFIG['app']['logfile'] = 'log.txt' if self.chb_log.isChecked() else None
+        utils.get_config()['app']['debug'] = str(self.chb_debug.isChecked()).lower()
+        utils.get_config()['app']['logfile'] = 'log.txt' if self.chb_log.isChecked() else None
+        utils.get_config()['app']['envcache'] = str(self.chb_envcache.isChecked()).lower()
+        utils.get_config()['app']['metrics'] = str(self.chb_metrics.isChecked()).lower()
+        utils.get_config()['app']['watch'] = str(self.chb_watch.isChecked()).lower()
+        utils.get_config()['app']['privhelper'] = str(self.chb_privhelper.isChecked()).lower()
         utils.config_save()
 
     # ============================================= SLOTS ================================================================ #
@@ -1175,28 +1930,41 @@ class MainWindow(BasicDialog):
     def showEvent(self, event):
         # show
         event.accept()
+        if not self._first_painted:
+            self._first_painted = True
+            QtCore.QTimer.singleShot(0, self._on_first_paint)
         # fill vars
         self.settings_to_gui()
 
     def closeEvent(self, event):
+        if self._can_close:
+            event.accept()
+            return
+        # the window is closed once the background tasks complete (see MainWindow::_close_now())
+        event.ignore()
+
         # apply app config
         self.save_app_settings()
 
-        # apply proxy config
-        if self.thread_apply.isRunning():
-            self.thread_apply.wait()
-        if self.sysproxy.asdict() != self.localproxy:
+        if self.sysproxy is None:
+            # closed before the system settings were read: nothing to apply
+            self.tasks.cancel()
+            self.tasks.call_when_idle(self._close_now)
+            return
+
+        # apply proxy config (once a running apply has completed)
+        self.tasks.call_when_idle(self._ask_apply_and_close)
+
+    ## Asks to apply or restore unsaved changes, then closes the window.
+    def _ask_apply_and_close(self):
+        if self.has_changes():
             # unsaved changes
             btn = QtWidgets.QMessageBox.question(self, 'Apply proxy settings',
                                                 'APPLY system proxy configuration before quit?',
                                                 defaultButton=QtWidgets.QMessageBox.Yes)
-            self.thread_apply.on_run = self._do_apply_config if btn == QtWidgets.QMessageBox.Yes else self._do_restore_config
-            self.thread_apply.on_start = None
-            self.thread_apply.on_finish = None
-            self.thread_apply.on_error = None
-            self.thread_apply.start()
-            self.thread_apply.wait()
-        event.accept()
+            self.finish_config(btn == QtWidgets.QMessageBox.Yes, self._close_now)
+        else:
+            self._close_now()
 
     ## Updates the GUI controls from the data in MainWindow::localproxy.
     @Slot()
@@ -1218,6 +1986,8 @@ class MainWindow(BasicDialog):
         noproxy_ = not self.localproxy['noproxy'] is None
         self.gb_noproxy.setChecked(noproxy_)
         self.te_noproxy.setPlainText('\n'.join(self.localproxy['noproxy'].split(',')) if noproxy_ else '')
+        # MainWindow::localproxy may have been replaced entirely
+        self._dirty_version = None
         self.update_actions_enabled()
 
         # reconnect signals
@@ -1230,69 +2000,104 @@ class MainWindow(BasicDialog):
     def on_btn_OK_clicked(self):
         if not self.validate(): return
         self.save_app_settings()
-        if self.sysproxy.asdict() != self.localproxy:
+        if self.has_changes():
             btn = QtWidgets.QMessageBox.question(self, 'Apply proxy settings',
                                                  'APPLY proxy configuration and quit?',
                                                  defaultButton=QtWidgets.QMessageBox.Yes)
             if btn != QtWidgets.QMessageBox.Yes:
                 return
-
-            if self.thread_apply.isRunning():
-                self.thread_apply.wait()
-            self.thread_apply.on_start = None
-            self.thread_apply.on_run = self._do_apply_config
-            self.thread_apply.on_finish = None
-            self.thread_apply.on_error = None
-            self.thread_apply.start()
-            self.thread_apply.wait()
-        self.accept()
+            self.finish_config(True, self.accept)
+        else:
+            self.tasks.call_when_idle(self.accept)
 
     ## Asks the user to cancel unsaved changes before quitting.
     @Slot()
     def on_btn_cancel_clicked(self):
         self.save_app_settings()
-        if self.sysproxy.asdict() != self.localproxy:
+        if self.has_changes():
             btn = QtWidgets.QMessageBox.question(self, 'Cancel proxy settings',
                                                  'RESTORE system proxy configuration and quit?',
                                                  defaultButton=QtWidgets.QMessageBox.Yes)
             if btn != QtWidgets.QMessageBox.Yes:
                 return
-            if self.thread_apply.isRunning():
-                self.thread_apply.wait()
-            self.thread_apply.on_start = None
-            self.thread_apply.on_run = self._do_restore_config
-            self.thread_apply.on_finish = None
-            self.thread_apply.on_error = None
-            self.thread_apply.start()
-            self.thread_apply.wait()
-        self.reject()
+            self.finish_config(False, self.reject)
+        else:
+            self.tasks.call_when_idle(self.reject)
 
-    ## Updates the app actions based on unsaved changes and active threads.
-    @Slot()
-    def update_actions_enabled(self):
+    ## @returns `Any` the value of a setting in a settings dictionary by its key in MainWindow::dirty
+    @staticmethod
+    def _setting_value(dconfig, key):
+        if isinstance(key, str):
+            return dconfig.get(key, None)
+        proxy, field = key
+        obj = dconfig.get(proxy, None)
+        if field is None:
+            return obj is not None
+        return obj.get(field, None) if obj else None
+
+    ## Updates MainWindow::dirty for the given settings comparing MainWindow::localproxy
+    # with the (memoized) system settings.
+    # @param keys `str`|`tuple` keys of the changed settings (see MainWindow::dirty)
+    def mark_dirty(self, *keys):
+        if self.sysproxy is None:
+            return
         sysdict = self.sysproxy.asdict()
-        has_changed = (self.localproxy != sysdict)
+        for key in keys:
+            if self._setting_value(self.localproxy, key) != self._setting_value(sysdict, key):
+                self.dirty.add(key)
+            else:
+                self.dirty.discard(key)
 
+    ## Recomputes MainWindow::dirty for all the settings (when MainWindow::localproxy
+    # is replaced or the system settings change).
+    def update_dirty(self):
+        self.dirty.clear()
+        if self.sysproxy is None:
+            return
+        # read before comparing: a change made meanwhile (by the apply worker) leaves the version stale
+        version = self.sysproxy.version
+        self.mark_dirty('enabled', 'noproxy', *((proxy, field) for proxy in PROXY_OBJS[:-1] for field in PROXY_FIELDS))
+        self._dirty_version = version
+
+    ## @returns `bool` whether MainWindow::localproxy has unsaved changes
+    def has_changes(self):
+        if self.sysproxy is None:
+            return False
+        if self._dirty_version != self.sysproxy.version:
+            self.update_dirty()
+        return bool(self.dirty)
+
+    ## Updates the app actions based on unsaved changes and highlights the changed settings.
+    @Slot()
+    def update_actions_enabled(self):
+        has_changed = self.has_changes()
         self.act_apply.setEnabled(has_changed)
         self.act_restore.setEnabled(has_changed)
 
         # update control styles to highlight unsaved properties
-        # proxy = PROXY_OBJS[self.btns_protocol.checkedId()]
-        # if (self.localproxy[proxy] and not sysdict[proxy]) or (not self.localproxy[proxy] and sysdict[proxy]):
-        #     self.gb_proxy.setStyleSheet('QGroupBox::indicator { background-color: yellow; }')
-        # else:
-        #     self.gb_proxy.setStyleSheet('QGroupBox::indicator { background-color: white; }')
-
-        # if self.localproxy[proxy]:
-        #     self.le_proxyhost.setStyleSheet('QLineEdit {{ background: {}; }} '.format(
-        #         'white' if self.localproxy[proxy]['host'] == sysdict[proxy]['host'] else 'yellow'))
+        proxy = PROXY_OBJS[self.btns_protocol.checkedId()]
+        for widget, key in ((self.gb_proxy, (proxy, None)), (self.le_proxyhost, (proxy, 'host')),
+                            (self.le_proxyport, (proxy, 'port')), (self.gb_auth, (proxy, 'auth')),
+                            (self.le_user, (proxy, 'uname')), (self.le_pass, (proxy, 'password')),
+                            (self.gb_noproxy, 'noproxy')):
+            highlight = key in self.dirty
+            if self._highlighted.get(widget, False) == highlight:
+                continue
+            self._highlighted[widget] = highlight
+            if not highlight:
+                widget.setStyleSheet('')
+            elif isinstance(widget, QtWidgets.QGroupBox):
+                widget.setStyleSheet(f'QGroupBox::indicator {{ background-color: {DIRTY_COLOR}; }}')
+            else:
+                widget.setStyleSheet(f'{widget.metaObject().className()} {{ background-color: {DIRTY_COLOR}; }}')
 
     ## Triggers when the Enable toggle is switched.
     @Slot(bool)
     def on_act_enable_proxy(self, checked):
         self.localproxy['enabled'] = checked
-        # apply immediately to system
-        self.apply_config()
+        self.mark_dirty('enabled')
+        # apply to system (bursts of toggles are debounced)
+        self.request_apply()
 
     ## Triggers when the `MainWindow::tb` toolbox is changed by selecting a group.
     @Slot(int)
@@ -1375,9 +2180,11 @@ class MainWindow(BasicDialog):
             prot_ = prot.split('_')[0]
             host_ = text
             port_ = self.le_proxyport.value()
-            self.localproxy[prot] = sysproxy.Proxyconf(None, prot_, host_,
+            self.localproxy[prot] = sysproxy.Proxyconf(prot_, host_,
                                                        port_, self.gb_auth.isChecked(),
                                                        self.le_user.text(), self.le_pass.text()).asdict()
+            self.mark_dirty(*((prot, field) for field in PROXY_FIELDS))
+        self.mark_dirty((prot, 'host'))
         self.update_actions_enabled()
 
     ## Triggers when the proxy port is changed.
@@ -1391,9 +2198,11 @@ class MainWindow(BasicDialog):
             prot_ = prot.split('_')[0]
             host_ = self.le_proxyhost.text()
             port_ = value
-            self.localproxy[prot] = sysproxy.Proxyconf(None, prot_, host_,
+            self.localproxy[prot] = sysproxy.Proxyconf(prot_, host_,
                                                        port_, self.gb_auth.isChecked(),
                                                        self.le_user.text(), self.le_pass.text()).asdict()
+            self.mark_dirty(*((prot, field) for field in PROXY_FIELDS))
+        self.mark_dirty((prot, 'port'))
         self.update_actions_enabled()
 
     ## Triggers when the proxy group box is checked or unchecked.
@@ -1407,9 +2216,10 @@ class MainWindow(BasicDialog):
             prot_ = prot.split('_')[0]
             host_ = self.le_proxyhost.text()
             port_ = self.le_proxyport.value()
-            self.localproxy[prot] = sysproxy.Proxyconf(None, prot_, host_,
+            self.localproxy[prot] = sysproxy.Proxyconf(prot_, host_,
                                                        port_, self.gb_auth.isChecked(),
                                                        self.le_user.text(), self.le_pass.text()).asdict()
+            self.mark_dirty(*((prot, field) for field in PROXY_FIELDS))
             self.update_actions_enabled()
 
     ## Triggers when the proxy auth group box is checked or unchecked.
@@ -1418,6 +2228,7 @@ class MainWindow(BasicDialog):
         prot = PROXY_OBJS[self.btns_protocol.checkedId()]
         if self.localproxy.get(prot, None):
             self.localproxy[prot]['auth'] = checked
+            self.mark_dirty((prot, 'auth'))
             self.update_actions_enabled()
 
     ## Triggers when the proxy user name is edited.
@@ -1426,6 +2237,7 @@ class MainWindow(BasicDialog):
         prot = PROXY_OBJS[self.btns_protocol.checkedId()]
         if self.localproxy.get(prot, None):
             self.localproxy[prot]['uname'] = text
+            self.mark_dirty((prot, 'uname'))
             self.update_actions_enabled()
 
     ## Triggers when the proxy password is edited.
@@ -1434,15 +2246,17 @@ class MainWindow(BasicDialog):
         prot = PROXY_OBJS[self.btns_protocol.checkedId()]
         if self.localproxy.get(prot, None):
             self.localproxy[prot]['password'] = text
+            self.mark_dirty((prot, 'password'))
             self.update_actions_enabled()
 
     ## Triggers when the no-proxy group box is checked or unchecked.
     @Slot(bool)
     def on_gb_noproxy_checked(self, checked):
-        if not checked:
+        if not checked or self.sysproxy is None:
             self.localproxy['noproxy'] = None
         else:
             self.localproxy['noproxy'] = str(self.sysproxy.noproxy) if not self.sysproxy.noproxy is None else None
+        self.mark_dirty('noproxy')
         self.update_actions_enabled()
 
     ## Triggers when the no-proxy text is changed.
@@ -1455,6 +2269,7 @@ class MainWindow(BasicDialog):
             self.localproxy['noproxy'] = ','.join(txt.split('\n'))
         else:
             self.localproxy['noproxy'] = None
+        self.mark_dirty('noproxy')
         self.update_actions_enabled()
 
     ## The 'Copy To' button handler: copies settings to the other proxies.
@@ -1472,6 +2287,22 @@ class MainWindow(BasicDialog):
     def on_act_envedit(self, checked):
         TestEnv().exec()
 
+    ## `MainWindow::act_log` handler: shows the gui::LogViewer dialog.
+    @Slot(bool)
+    def on_act_log(self, checked):
+        LogViewer(self).exec()
+
+    ## `MainWindow::act_diagnostics` handler: shows the gui::Diagnostics panel.
+    @Slot(bool)
+    def on_act_diagnostics(self, checked):
+        Diagnostics(self).exec()
+        self.chb_metrics.setChecked(metrics.is_enabled())
+
+    ## `MainWindow::act_report` handler: packs the profiles and the log for a bug report.
+    @Slot(bool)
+    def on_act_report(self, checked):
+        self.make_report()
+
     ## `MainWindow::act_help` handler: shows help docs in browser 
     @Slot(bool)
     def on_act_help(self, checked):
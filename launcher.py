@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+## @package proxen.launcher
+# @brief Per-process proxy injection: runs a command with a given proxy config
+# without writing anything to the system (see run()).
+import os, sys, json, subprocess
+
+import utils
+import sysproxy
+
+# --------------------------------------------------------------- #
+
+## `tuple` lower-case names of the env variables replaced in the child environment
+CHILD_PROXY_ENVS = sysproxy.PROXY_TYPES + ('all_proxy', 'no_proxy')
+
+# --------------------------------------------------------------- #
+
+## Loads a proxy config dictionary (in the Proxy::asdict() format).
+# @param spec `str` any of:
+# - a JSON string, e.g. `'{"enabled": true, "http_proxy": {...}}'`
+# - path to a JSON file (absolute or relative to the current dir)
+# - a config name: `name` or `name.json` in the project dir, e.g. 'proxy_config'
+# @returns `dict` the proxy config
+# @exception `ValueError` the config cannot be found or parsed, or is invalid (see sysproxy::check_config())
+def load_config(spec: str) -> dict:
+    spec = spec.strip()
+    if spec.startswith('{'):
+        try:
+            dconfig = json.loads(spec)
+        except json.JSONDecodeError as err:
+            raise ValueError(f'Invalid JSON config: {err}')
+    else:
+        candidates = [spec, utils.make_abspath(spec)]
+        if not spec.lower().endswith('.json'):
+            candidates.append(utils.make_abspath(f'{spec}.json'))
+        fname = next((c for c in candidates if os.path.isfile(c)), None)
+        if not fname:
+            raise ValueError(f'Config "{spec}" is not found!')
+        try:
+            with open(fname, 'r', encoding=utils.CODING) as f_:
+                dconfig = json.load(f_)
+        except json.JSONDecodeError as err:
+            raise ValueError(f'Invalid JSON in config file "{fname}": {err}')
+        except (OSError, UnicodeDecodeError) as err:
+            raise ValueError(f'Cannot read config file "{fname}": {err}')
+    if not isinstance(dconfig, dict):
+        raise ValueError('Proxy config must be a JSON object!')
+    return sysproxy.check_config(dconfig)
+
+## Builds the child process environment for a proxy config in memory.
+# All inherited proxy variables (any case) are dropped and replaced by the
+# lower- and upper-case variables of the config (see sysproxy::proxy_envs()).
+# @param dconfig `dict` the proxy config (see load_config())
+# @param base `dict` the base environment (default = `os.environ`)
+# @returns `dict` the new environment
+def child_env(dconfig: dict, base=None) -> dict:
+    env = {k: v for k, v in (os.environ if base is None else base).items() if not k.lower() in CHILD_PROXY_ENVS}
+    env.update(sysproxy.proxy_envs(dconfig))
+    return env
+
+## Runs a command with the proxy variables of the given config.
+# On Unix the current process is replaced by the command (`exec`), so this function
+# returns only on failure; on Windows the command is run as a child process.
+# @param cmd `list` the command and its arguments
+# @param dconfig `dict` the proxy config (see load_config())
+# @returns `int` the command's exit code (Windows) or 127 if the command cannot be started
+def run(cmd: list, dconfig: dict) -> int:
+    env = child_env(dconfig)
+    try:
+        if os.name == 'nt':
+            return subprocess.run(cmd, env=env).returncode
+        os.execvpe(cmd[0], cmd, env)
+    except OSError as err:
+        print(f'Cannot run "{cmd[0]}": {err}', file=sys.stderr)
+        return 127
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+## @package proxen.loginenv
+# @brief In-process simulator of the environment a new login shell gets from its
+# startup files (Unix), without spawning the shell.
+#
+# The startup files of each shell (see STARTUP_FILES) are read in the shell's order and
+# a small subset of the shell language is evaluated:
+# - `export NAME=value ...`, `NAME=value`, `export NAME`, `unset NAME` (sh / bash / zsh)
+# - `setenv NAME value`, `unsetenv NAME` (csh / tcsh)
+# - `. FILE` and `source FILE` includes (with globs and `for` / `foreach` loops over
+# globs, e.g. `for i in /etc/profile.d/*.sh; do . $i; done`)
+# - `$VAR`, `${VAR}`, `${VAR:-default}` and `~` expansion, single and double quotes
+#
+# `/etc/environment` is not shell code: it is read as PAM reads it, as literal
+# `NAME=value` lines (see sysproxy::parse_pam_env()).
+#
+# Conditions are not evaluated (all the branches of `if` / `case` are followed) and
+# command substitutions are kept as literal text, so the result is a close estimate
+# rather than an exact replay.
+#
+# Parsed files are memoized by their `stat` (see parse_file()) and whole results by
+# the `stat` of all the files (and globbed dirs) they depend on (see simulate()),
+# so repeated calls only cost a few `stat` calls.
+import os, glob
+
+import sysproxy
+
+# --------------------------------------------------------------- #
+
+## `tuple` supported shells
+SHELLS = ('bash', 'zsh', 'sh', 'csh')
+## `dict` startup files of a login shell in the reading order; a tuple means that only
+# the first existing file of the tuple is read. `/etc/environment` is read by PAM
+# before any shell starts.
+STARTUP_FILES = {
+    'bash': ['/etc/environment', '/etc/profile', ('~/.bash_profile', '~/.bash_login', '~/.profile')],
+    'zsh': ['/etc/environment', ('/etc/zsh/zshenv', '/etc/zshenv'), '~/.zshenv', ('/etc/zsh/zprofile', '/etc/zprofile'),
+            '~/.zprofile', ('/etc/zsh/zshrc', '/etc/zshrc'), '~/.zshrc', ('/etc/zsh/zlogin', '/etc/zlogin'), '~/.zlogin'],
+    'sh': ['/etc/environment', '/etc/profile', '~/.profile'],
+    'csh': ['/etc/environment', '/etc/csh.cshrc', '/etc/csh.login', ('~/.tcshrc', '~/.cshrc'), '~/.login'],
+}
+## `dict` shell names (as in `$SHELL`) mapped to the simulated shells
+SHELL_ALIASES = {'bash': 'bash', 'zsh': 'zsh', 'sh': 'sh', 'dash': 'sh', 'ksh': 'sh', 'csh': 'csh', 'tcsh': 'csh'}
+## `str` file read in the literal `NAME=value` format of PAM (all the assignments are exported)
+PAM_ENV_FILE = sysproxy.PAM_ENV_FILE
+## `int` max nesting depth of the includes
+MAX_INCLUDE_DEPTH = 16
+## `str` default `PATH` of a new login shell
+DEFAULT_PATH = '/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin'
+## `tuple` shell keywords skipped before a command, e.g. `then . ~/.bashrc`
+KEYWORDS = ('if', 'then', 'else', 'elif', 'fi', 'do', 'while', 'until', '{', '}', '(', ')', '!', 'esac', ';;')
+
+## `dict` parsed files: `{path: (stat signature, statements)}`
+_file_cache = {}
+## `dict` simulation results: `{(shell, home, root, base): (dependencies, env)}`
+_result_cache = {}
+
+# --------------------------------------------------------------- #
+
+## @returns `tuple` the `stat` signature of a path (`None` if it does not exist)
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+## Splits a line into simple commands (at `;`, `&&`, `||` and `|`) and these into raw words
+# (quotes are kept for expansion, see _expand()); a `#` at the start of a word begins a comment.
+# @returns `list` lists of raw words
+def _split_line(line) -> list:
+    commands, words, word = [], [], ''
+    quote = None
+    i = 0
+    while i < len(line):
+        c = line[i]
+        if quote:
+            word += c
+            if c == '\\' and quote == '"' and i + 1 < len(line):
+                word += line[i + 1]
+                i += 1
+            elif c == quote:
+                quote = None
+        elif c in ('"', "'"):
+            quote = c
+            word += c
+        elif c == '\\' and i + 1 < len(line):
+            word += line[i:i + 2]
+            i += 1
+        elif c == '#' and not word:
+            break
+        elif c in ' \t':
+            if word: words.append(word)
+            word = ''
+        elif c in ';&|':
+            if word: words.append(word)
+            word = ''
+            if words: commands.append(words)
+            words = []
+            if c in '&|' and line[i + 1:i + 2] == c:
+                i += 1
+        else:
+            word += c
+        i += 1
+    if word: words.append(word)
+    if words: commands.append(words)
+    return commands
+
+## Parses shell source into statements.
+# @param text `str` the file contents
+# @returns `list` statements: `('cmd', words)` for simple commands and
+# `('for', var, words, body)` for loops (body = nested statements; `while` / `until`
+# loops are `('for', None, [''], body)`, i.e. run once)
+def parse_text(text) -> list:
+    root = []
+    stack = [root]
+    for line in text.splitlines():
+        for words in _split_line(line):
+            if words[0] in ('while', 'until'):
+                loop = ('for', None, [''], [])
+                stack[-1].append(loop)
+                stack.append(loop[3])
+            while words and words[0] in KEYWORDS:
+                words = words[1:]
+            if not words:
+                continue
+            if words[0] in ('for', 'foreach') and len(words) > 1:
+                # `for i in a b c` / `foreach i (a b c)`
+                items = [w.strip('()') for w in words[2:] if not w in ('in', '(', ')') and w.strip('()')]
+                loop = ('for', words[1], items, [])
+                stack[-1].append(loop)
+                stack.append(loop[3])
+                continue
+            if words[0] in ('done', 'end') and len(stack) > 1:
+                stack.pop()
+                continue
+            stack[-1].append(('cmd', words))
+    return root
+
+## @returns `list` the statements of a file (see parse_text()), memoized by the file's `stat`;
+# empty if the file cannot be read
+# @param path `str` full path to the file
+def parse_file(path) -> list:
+    sig = _signature(path)
+    if sig is None:
+        return []
+    cached = _file_cache.get(path)
+    if cached and cached[0] == sig:
+        return cached[1]
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f_:
+            statements = parse_text(f_.read())
+    except OSError:
+        statements = []
+    _file_cache[path] = (sig, statements)
+    return statements
+
+# --------------------------------------------------------------- #
+
+## @brief Evaluates the startup files of one shell (see simulate()).
+class _Evaluator:
+
+    ## @param home `str` home directory (full path on this host)
+    # @param root `str` filesystem root or `None`
+    # @param base `dict` initial exported variables
+    def __init__(self, home, root, base):
+        ## `str` filesystem root (`None` = '/')
+        self.root = root
+        ## `dict` shell variables
+        self.vars = dict(base)
+        ## `set` names of the exported variables
+        self.exported = set(base)
+        ## `dict` `{path: stat signature}` of all the files and globbed dirs read
+        self.deps = {}
+        ## `list` files being read (to stop recursive includes)
+        self.stack = []
+
+    ## @returns `str` path on this host for a path in the shell (`~` and the root are resolved)
+    def host_path(self, path):
+        if path.startswith('~'):
+            path = self.vars.get('HOME', '') + path[1:]
+        if not os.path.isabs(path):
+            path = os.path.join(self.vars.get('HOME', '/'), path)
+        if self.root and not path.startswith(self.root + os.sep):
+            path = os.path.join(self.root, path.lstrip('/'))
+        return os.path.normpath(path)
+
+    ## @returns `str` the variable reference at `text[i]` (after the '$') expanded, and the next index
+    def _expand_var(self, text, i):
+        if text[i:i + 1] == '{':
+            end = text.find('}', i)
+            if end < 0:
+                return '$' + text[i:], len(text)
+            expr = text[i + 1:end]
+            for op in (':-', '-', ':=', '='):
+                name, sep, default = expr.partition(op)
+                if sep and name.isidentifier():
+                    value = self.vars.get(name)
+                    if value is None or (op.startswith(':') and not value):
+                        value = self._expand(default)
+                    return value, end + 1
+            return self.vars.get(expr, ''), end + 1
+        j = i
+        while j < len(text) and (text[j].isalnum() or text[j] == '_'):
+            j += 1
+        if j == i:
+            return '$', i
+        return self.vars.get(text[i:j], ''), j
+
+    ## @returns `str` a raw word with the quotes removed and the variables and `~` expanded
+    def _expand(self, word):
+        res = ''
+        quote = None
+        i = 0
+        if word.startswith('~'):
+            res = self.vars.get('HOME', '')
+            i = 1
+        while i < len(word):
+            c = word[i]
+            if quote == "'":
+                if c == "'": quote = None
+                else: res += c
+            elif c == '\\' and i + 1 < len(word):
+                res += word[i + 1]
+                i += 1
+            elif c == '$':
+                value, i = self._expand_var(word, i + 1)
+                res += value
+                continue
+            elif c in ('"', "'") and (quote is None or quote == c):
+                quote = None if quote else c
+            else:
+                res += c
+            i += 1
+        return res
+
+    ## @returns `list` paths on this host matching an include path (globs are expanded)
+    def _include_paths(self, path):
+        path = self.host_path(path)
+        if any(c in path for c in '*?['):
+            dirname = os.path.dirname(path)
+            self.deps[dirname] = _signature(dirname)
+            return sorted(glob.glob(path))
+        return [path]
+
+    ## Reads (evaluates) a startup file.
+    # @param path `str` full path on this host
+    def read_file(self, path):
+        self.deps[path] = _signature(path)
+        if self.deps[path] is None or path in self.stack or len(self.stack) >= MAX_INCLUDE_DEPTH:
+            return
+        self.stack.append(path)
+        try:
+            self.run(parse_file(path))
+        finally:
+            self.stack.pop()
+
+    ## Reads the PAM env file: literal `NAME=value` lines, all exported
+    # (see sysproxy::parse_pam_env(); no shell quoting or expansion).
+    # @param path `str` full path on this host
+    def read_pam_env(self, path):
+        self.deps[path] = _signature(path)
+        if self.deps[path] is None:
+            return
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f_:
+                text = f_.read()
+        except OSError:
+            return
+        for _, name, value in sysproxy.parse_pam_env(text):
+            self.assign(name, value, True)
+
+    ## Sets a variable.
+    def assign(self, name, value, export=False):
+        self.vars[name] = value
+        if export: self.exported.add(name)
+
+    ## Evaluates statements (see parse_text()).
+    def run(self, statements):
+        for st in statements:
+            if st[0] == 'for':
+                _, var, items, body = st
+                values = []
+                for item in items:
+                    value = self._expand(item)
+                    values += sorted(glob.glob(self.host_path(value))) if any(c in value for c in '*?[') else [value]
+                    if any(c in value for c in '*?['):
+                        dirname = os.path.dirname(self.host_path(value))
+                        self.deps[dirname] = _signature(dirname)
+                for value in values:
+                    if self.root and value.startswith(self.root + os.sep):
+                        value = value[len(self.root):]
+                    if var: self.vars[var] = value
+                    self.run(body)
+                continue
+            words = st[1]
+            cmd = words[0]
+            if cmd in ('.', 'source') and len(words) > 1:
+                for path in self._include_paths(self._expand(words[1])):
+                    self.read_file(path)
+            elif cmd == 'export':
+                for w in words[1:]:
+                    name, sep, value = w.partition('=')
+                    if not name.isidentifier():
+                        continue
+                    if sep:
+                        self.assign(name, self._expand(value), True)
+                    else:
+                        self.exported.add(name)
+            elif cmd in ('unset', 'unsetenv'):
+                for name in words[1:]:
+                    self.vars.pop(name, None)
+                    self.exported.discard(name)
+            elif cmd == 'setenv' and len(words) > 1:
+                self.assign(words[1], self._expand(words[2]) if len(words) > 2 else '', True)
+            elif '=' in cmd and cmd.partition('=')[0].isidentifier():
+                # `NAME=value` (only assignments: `NAME=value command` sets the var for the command only)
+                if all('=' in w and w.partition('=')[0].isidentifier() for w in words):
+                    for w in words:
+                        name, _, value = w.partition('=')
+                        self.assign(name, self._expand(value), name in self.exported)
+
+    ## @returns `dict` the exported variables
+    def environ(self) -> dict:
+        return {k: v for k, v in self.vars.items() if k in self.exported}
+
+# --------------------------------------------------------------- #
+
+## @returns `str` the simulated shell for a shell path or name, e.g. '/usr/bin/tcsh' -> 'csh'
+# (default = the current user's `$SHELL`; 'bash' for unknown shells)
+def shell_name(shell=None) -> str:
+    shell = shell or os.environ.get('SHELL', '') or 'bash'
+    return SHELL_ALIASES.get(os.path.basename(shell).lower(), 'bash')
+
+## Simulates the environment of a new login shell.
+# @param shell `str` any of loginenv::SHELLS (or a shell path, see shell_name())
+# @param home `str` home directory (default = the current user's home); with `root`,
+# a full path inside the root on this host, e.g. '/srv/image/home/user'
+# @param root `str` filesystem root (default = '/')
+# @param base `dict` initial environment (default = `HOME`, `USER`, `LOGNAME`, `SHELL` and `PATH`)
+# @returns `dict` the exported variables (do not modify: the result is memoized)
+def simulate(shell='bash', home=None, root=None, base=None) -> dict:
+    shell = shell if shell in SHELLS else shell_name(shell)
+    home = os.path.abspath(home or os.path.expanduser('~'))
+    root = os.path.abspath(root) if root and os.path.abspath(root) != '/' else None
+    if base is None:
+        shell_home = '/' + os.path.relpath(home, root) if root and home.startswith(root + os.sep) else home
+        user = os.path.basename(home) if (root or home != os.path.expanduser('~')) else os.environ.get('USER', '')
+        base = {'HOME': shell_home, 'USER': user, 'LOGNAME': user, 'SHELL': f'/bin/{shell}', 'PATH': DEFAULT_PATH}
+    key = (shell, home, root, tuple(sorted(base.items())))
+    cached = _result_cache.get(key)
+    if cached and all(_signature(path) == sig for path, sig in cached[0].items()):
+        return cached[1]
+    ev = _Evaluator(home, root, base)
+    for entry in STARTUP_FILES[shell]:
+        candidates = [ev.host_path(f) for f in (entry if isinstance(entry, tuple) else (entry,))]
+        for path in candidates:
+            if path == ev.host_path(PAM_ENV_FILE):
+                ev.read_pam_env(path)
+            else:
+                ev.read_file(path)
+            if ev.deps[path] is not None:
+                break
+    env = ev.environ()
+    _result_cache[key] = (ev.deps, env)
+    return env
+
+## @returns `dict` the proxy variables (any case of sysproxy::PROXY_ENV_NAMES) a new login shell gets
+# @see simulate()
+def proxy_env(shell='bash', home=None, root=None, base=None) -> dict:
+    return {k: v for k, v in simulate(shell, home, root, base).items() if k.lower() in sysproxy.PROXY_ENV_NAMES}
+
+## @returns `dict` the proxy variables per shell: `{shell: {name: value}}` (see proxy_env())
+# @param shells `iterable` the shells (default = all loginenv::SHELLS)
+def effective_proxies(home=None, root=None, shells=SHELLS) -> dict:
+    return {shell: proxy_env(shell, home, root) for shell in shells}
+
+## Drops the memoized files and results.
+def clear_cache():
+    _file_cache.clear()
+    _result_cache.clear()
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+## @package proxen.metrics
+# @brief Operation metrics: counters, timing spans and per-operation traces.
+#
+# Usage:
+# ```python
+# @metrics.timed()            # timing span around every call
+# def update_vars(self): ...
+#
+# @metrics.traced()           # same, and records a structured trace of each call
+# def fromdict(self, dconfig): ...
+#
+# metrics.incr('subprocesses') # counter
+# ```
+# Metrics are collected only when enabled (`metrics` option in `config.ini`,
+# `PROXEN_METRICS=1` env variable or enable()); otherwise each instrumented call
+# costs a single flag check. Collected data can be read with snapshot(), traces()
+# and dumped with to_json() or to_prometheus().
+import os, time, json, threading, functools, collections
+
+import utils
+
+# --------------------------------------------------------------- #
+
+## `tuple` standard counter names
+COUNTERS = ('subprocesses', 'files_read', 'files_written', 'bytes_read', 'bytes_written', 'registry_calls',
+            'lock_contended', 'write_conflicts', 'config_objects')
+## `int` max number of traces kept (the oldest are dropped)
+MAX_TRACES = 50
+## `str` Prometheus metric name prefix
+PROM_PREFIX = 'proxen'
+
+## `bool` whether metrics are collected (`None` = not yet read from the config, see is_enabled())
+_enabled = None
+## `threading.Lock` lock guarding the collected data
+_lock = threading.Lock()
+## `dict` counter values
+_counters = dict.fromkeys(COUNTERS, 0)
+## `dict` span stats: name -> `[calls, total seconds, max seconds]`
+_spans = {}
+## `collections.deque` recent traces (see traced())
+_traces = collections.deque(maxlen=MAX_TRACES)
+## `threading.local` per-thread current span (within a trace)
+_local = threading.local()
+
+# --------------------------------------------------------------- #
+
+## @returns `bool` whether metrics are collected
+def is_enabled():
+    global _enabled
+    if _enabled is None:
+        env = os.environ.get('PROXEN_METRICS', '')
+        _enabled = env.lower() in ('1', 'true', 'yes', 'on') if env else utils.get_metrics()
+    return _enabled
+
+## Switches metrics collection on or off (the collected data are kept).
+# @param on `bool` whether to collect metrics
+def enable(on=True):
+    global _enabled
+    _enabled = bool(on)
+
+## Clears all the collected data.
+def reset():
+    with _lock:
+        for name in _counters:
+            _counters[name] = 0
+        _spans.clear()
+        _traces.clear()
+
+## Increments a counter.
+# @param name `str` counter name (see metrics::COUNTERS)
+# @param value `int` increment
+def incr(name, value=1):
+    if _enabled is False or (_enabled is None and not is_enabled()):
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+    span = getattr(_local, 'span', None)
+    if span:
+        span.counters[name] = span.counters.get(name, 0) + value
+
+## Counts a file read.
+# @param nbytes `int` number of bytes (characters) read
+def file_read(nbytes=0):
+    incr('files_read')
+    incr('bytes_read', nbytes)
+
+## Counts a file write.
+# @param nbytes `int` number of bytes (characters) written
+def file_written(nbytes=0):
+    incr('files_written')
+    incr('bytes_written', nbytes)
+
+# --------------------------------------------------------------- #
+
+## @brief A timing span: one call of an instrumented operation.
+# Use as a context manager; spans opened inside a trace are nested into it.
+class Span:
+
+    __slots__ = ('name', 'trace', 'parent', 'start', 'duration', 'children', 'counters')
+
+    ## @param name `str` span (operation) name
+    # @param trace `bool` if `True`, the span starts a new trace unless there is one already
+    def __init__(self, name, trace=False):
+        ## `str` span (operation) name
+        self.name = name
+        ## `bool` whether the span starts a new trace
+        self.trace = trace
+        ## `metrics::Span` enclosing span in the current trace (or `None`)
+        self.parent = None
+        ## `float` start time (`time.perf_counter()`)
+        self.start = 0.0
+        ## `float` duration in seconds
+        self.duration = 0.0
+        ## `list` nested spans (in a trace)
+        self.children = []
+        ## `dict` counter increments made during the span (in a trace)
+        self.counters = {}
+
+    def __enter__(self):
+        self.parent = getattr(_local, 'span', None)
+        if self.parent or self.trace:
+            _local.span = self
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.duration = time.perf_counter() - self.start
+        _record(self.name, self.duration)
+        if self.parent:
+            self.parent.children.append(self)
+            for name, value in self.counters.items():
+                self.parent.counters[name] = self.parent.counters.get(name, 0) + value
+            _local.span = self.parent
+        elif self.trace:
+            _local.span = None
+            trace = self.asdict()
+            trace['time'] = time.time()
+            trace['error'] = repr(exc_value) if exc_value else None
+            with _lock:
+                _traces.append(trace)
+        return False
+
+    ## @returns `dict` the span and its nested spans as a dictionary
+    # @param origin `float` start time of the root span (offsets are relative to it)
+    def asdict(self, origin=None):
+        if origin is None: origin = self.start
+        return {'name': self.name, 'offset_ms': round((self.start - origin) * 1000, 3),
+                'duration_ms': round(self.duration * 1000, 3), 'counters': dict(self.counters),
+                'children': [child.asdict(origin) for child in self.children]}
+
+## Adds a duration to the span stats.
+# @param name `str` span name
+# @param duration `float` duration in seconds
+def _record(name, duration):
+    with _lock:
+        stats = _spans.get(name, None)
+        if stats is None:
+            _spans[name] = [1, duration, duration]
+        else:
+            stats[0] += 1
+            stats[1] += duration
+            if duration > stats[2]: stats[2] = duration
+
+## Records a duration measured by the caller (e.g. a wait) in the span stats.
+# @param name `str` span name, e.g. 'lock_wait'
+# @param duration `float` duration in seconds
+def observe(name, duration):
+    if _enabled is False or (_enabled is None and not is_enabled()):
+        return
+    _record(name, duration)
+
+## Decorator recording a timing span around every call of a function.
+# @param name `str` span name (default = the function's qualified name, e.g. 'Sysenv.update_vars')
+def timed(name=None):
+    def decorator(func):
+        span_name = name or func.__qualname__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _enabled is False or (_enabled is None and not is_enabled()):
+                return func(*args, **kwargs)
+            with Span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+## Decorator recording a trace of every call of a function: the tree of nested spans
+# with their durations and counters (see traces()). Inside another trace it works like timed().
+# @param name `str` trace name (default = the function's qualified name, e.g. 'Proxy.fromdict')
+def traced(name=None):
+    def decorator(func):
+        span_name = name or func.__qualname__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _enabled is False or (_enabled is None and not is_enabled()):
+                return func(*args, **kwargs)
+            with Span(span_name, True):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# --------------------------------------------------------------- #
+
+## @returns `dict` the counters and span stats:
+# ```python
+# {'enabled': True, 'counters': {'subprocesses': 2, ...},
+#  'spans': {'Sysenv.update_vars': {'calls': 3, 'total_ms': 1.5, 'avg_ms': 0.5, 'max_ms': 0.8}, ...}}
+# ```
+def snapshot() -> dict:
+    with _lock:
+        return {'enabled': bool(_enabled), 'counters': dict(_counters),
+                'spans': {name: {'calls': calls, 'total_ms': round(total * 1000, 3),
+                                 'avg_ms': round(total * 1000 / calls, 3), 'max_ms': round(maxd * 1000, 3)}
+                          for name, (calls, total, maxd) in _spans.items()}}
+
+## @returns `list` the recent traces, oldest first (see Span::asdict())
+def traces() -> list:
+    with _lock:
+        return list(_traces)
+
+## @returns `dict` the latest trace (or `None`)
+def last_trace():
+    with _lock:
+        return _traces[-1] if _traces else None
+
+## @returns `str` snapshot() and traces() in JSON format
+# @param indent `int` JSON indentation
+def to_json(indent=2) -> str:
+    data = snapshot()
+    data['traces'] = traces()
+    return json.dumps(data, indent=indent)
+
+## @returns `str` the counters and span stats in the Prometheus text exposition format
+def to_prometheus() -> str:
+    data = snapshot()
+    lines = []
+    for name, value in data['counters'].items():
+        metric = f'{PROM_PREFIX}_{name}_total'
+        lines += [f'# TYPE {metric} counter', f'{metric} {value}']
+    if data['spans']:
+        for metric, mtype, key, scale in (('span_calls_total', 'counter', 'calls', 1),
+                                          ('span_seconds_total', 'counter', 'total_ms', 0.001),
+                                          ('span_seconds_max', 'gauge', 'max_ms', 0.001)):
+            metric = f'{PROM_PREFIX}_{metric}'
+            lines.append(f'# TYPE {metric} {mtype}')
+            for name, stats in data['spans'].items():
+                label = name.replace('\\', '\\\\').replace('"', '\\"')
+                lines.append(f'{metric}{{span="{label}"}} {round(stats[key] * scale, 6)}')
+    return utils.NL.join(lines) + utils.NL
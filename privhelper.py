@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+## @package proxen.privhelper
+# @brief Privileged helper process for the system-domain profile files (Unix only).
+#
+# Writing the system files (sysproxy::UNIX_PROFILE_FILES_SYS) requires root privileges.
+# Rather than running the whole app as root, an unprivileged session may start this module
+# once as a root process (with `pkexec` on a desktop or `sudo` in a terminal) and send it
+# batches of changes over a pipe: the password is asked only once per session, and each
+# batch rewrites each system file at most once (see sysproxy::Sysenv::_unix_apply_batch()).
+#
+# The helper accepts proxy variables only (sysproxy::PROXY_ENV_NAMES, in any case), with
+# values that cannot break out of the quoted `export` line, and chooses the files itself:
+# a client cannot make it write anything else.
+#
+# Protocol: JSON lines. On start, the helper sends `{"ready": true, "pid": ...}`; then each
+# request `{"id": 1, "changes": {"http_proxy": "http://proxy:3128", "no_proxy": null}}`
+# (`null` = unset) gets `{"id": 1, "ok": true}` or `{"id": 1, "ok": false, "error": "message"}`.
+#
+# The helper is used by sysproxy::Sysenv if enabled in the app config (`privhelper` option).
+import os, re, sys, json, queue, shutil, atexit, threading, subprocess
+
+import utils
+import sysproxy
+
+# --------------------------------------------------------------- #
+
+## `re.Pattern` regex matching the allowed variable values
+REGEX_VALUE = re.compile(r'^[^"`$\\\r\n]*$')
+## `float` max time (seconds) to wait for the response to a request
+RESPONSE_TIMEOUT = 30.0
+
+## `privhelper::PrivHelper` the session helper (see get_helper())
+_helper = None
+## `bool` whether starting the session helper has failed (it is not tried again)
+_failed = False
+## `threading.Lock` guards the session helper creation
+_lock = threading.Lock()
+
+# --------------------------------------------------------------- #
+
+## Checks a batch of changes.
+# @param changes `dict` variable name -> value (`None` = unset)
+# @returns `dict` the changes with lower-case names and `str` values
+# @exception `ValueError` a variable is not allowed or a value is invalid
+def validate(changes) -> dict:
+    if not isinstance(changes, dict):
+        raise ValueError('Changes must be a dictionary')
+    res = {}
+    for name, value in changes.items():
+        if not isinstance(name, str) or not name.lower() in sysproxy.PROXY_ENV_NAMES:
+            raise ValueError(f'Variable "{name}" is not allowed')
+        if value is not None:
+            value = str(value)
+            if not REGEX_VALUE.match(value):
+                raise ValueError(f'Invalid value for "{name}"')
+        res[name.lower()] = value
+    return res
+
+## Helper process main loop: applies the batches read from `stdin` to the system files.
+# @param stdin `io.BufferedReader` request stream
+# @param stdout `io.BufferedWriter` response stream
+# @param root `str` filesystem root of the system files (a temp root in tests)
+def serve(stdin, stdout, root='/'):
+    def send(message):
+        stdout.write((json.dumps(message) + '\n').encode(utils.CODING))
+        stdout.flush()
+
+    sysenv = sysproxy.Sysenv(False, root=root)
+    send({'ready': True, 'pid': os.getpid()})
+    for line in stdin:
+        rid = None
+        try:
+            request = json.loads(line)
+            rid = request.get('id')
+            ok = sysenv._unix_apply_batch(validate(request.get('changes')))
+            send({'id': rid, 'ok': ok} if ok else {'id': rid, 'ok': False, 'error': 'Failed to write the system files'})
+        except Exception as err:
+            send({'id': rid, 'ok': False, 'error': str(err) or err.__class__.__name__})
+
+# --------------------------------------------------------------- #
+
+## @returns `list` the command elevating the helper: `pkexec` in a graphical session,
+# otherwise `sudo` (empty if neither is available)
+def elevation_command() -> list:
+    if (os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY')) and shutil.which('pkexec'):
+        return [shutil.which('pkexec')]
+    if shutil.which('sudo'):
+        return [shutil.which('sudo')]
+    return []
+
+## @brief Client end of the helper process (see the module description).
+class PrivHelper:
+
+    ## @param command `list` command elevating the helper (default = elevation_command())
+    # @param root `str` filesystem root of the system files (default = '/')
+    def __init__(self, command=None, root=None):
+        ## `list` command elevating the helper (empty = run unprivileged, e.g. when already root)
+        self.command = elevation_command() if command is None else command
+        ## `str` filesystem root passed to the helper (`None` = '/')
+        self.root = root
+        ## `subprocess.Popen` the helper process (`None` until started)
+        self.process = None
+        ## `queue.Queue` lines read from the helper's `stdout` (see PrivHelper::_read())
+        self._lines = None
+        self._id = 0
+        self._lock = threading.Lock()
+
+    ## Starts the helper process (asking for the password if required).
+    # @exception `OSError` the helper could not be started or elevated
+    def start(self):
+        if self.process and self.process.poll() is None:
+            return
+        self.process = subprocess.Popen(self.command + [sys.executable, os.path.abspath(__file__)] + ([self.root] if self.root else []),
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self._lines = queue.Queue()
+        threading.Thread(target=self._read, args=(self.process.stdout, self._lines), daemon=True).start()
+        # no timeout here: the user may be typing the password
+        line = self._lines.get()
+        try:
+            ready = json.loads(line).get('ready')
+        except (ValueError, AttributeError):
+            ready = False
+        if not ready:
+            self.close()
+            raise OSError('The privileged helper could not be started')
+        utils.log('Privileged helper started', 'info')
+
+    ## Reader thread: queues the lines read from the helper (an empty line at EOF).
+    @staticmethod
+    def _read(stream, lines):
+        for line in iter(stream.readline, b''):
+            lines.put(line)
+        lines.put(b'')
+
+    ## Applies a batch of changes to the system files. A helper that does not respond
+    # within privhelper::RESPONSE_TIMEOUT is stopped (and restarted on the next call).
+    # @param changes `dict` variable name -> value (`None` = unset)
+    # @returns `bool` success = `True`, failure = `False`
+    def apply(self, changes) -> bool:
+        with self._lock:
+            try:
+                changes = validate(changes)
+                self.start()
+                self._id += 1
+                self.process.stdin.write((json.dumps({'id': self._id, 'changes': changes}) + '\n').encode(utils.CODING))
+                self.process.stdin.flush()
+                response = json.loads(self._lines.get(timeout=RESPONSE_TIMEOUT) or 'null') or {}
+            except queue.Empty:
+                utils.log('Privileged helper did not respond in %.0f s', 'error', RESPONSE_TIMEOUT)
+                self.close()
+                return False
+            except (OSError, ValueError) as err:
+                utils.log('Privileged helper failed: %s', 'error', err)
+                return False
+            if not response.get('ok'):
+                utils.log('Privileged helper failed: %s', 'error', response.get('error', 'no response'))
+                return False
+            utils.log('Privileged helper applied %d change(s)', 'debug', len(changes))
+            return True
+
+    ## Stops the helper process.
+    def close(self):
+        if self.process:
+            try:
+                self.process.stdin.close()
+                self.process.wait(5)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+            self.process = None
+
+## @returns `bool` whether the session helper is to be used: enabled in the app config,
+# not running as admin, an elevation command is available and it has not failed before
+def is_enabled() -> bool:
+    return sysproxy.OS != 'Windows' and utils.get_privhelper() and not _failed and \
+           not sysproxy.current_user()[1] and bool(elevation_command())
+
+## @returns `privhelper::PrivHelper` the session helper, started on first call
+# (`None` if it cannot be started)
+def get_helper():
+    global _helper, _failed
+    with _lock:
+        if _helper is None and not _failed:
+            helper = PrivHelper()
+            try:
+                helper.start()
+                _helper = helper
+                atexit.register(helper.close)
+            except OSError as err:
+                _failed = True
+                utils.log('Cannot start the privileged helper: %s', 'error', err)
+        return _helper
+
+# --------------------------------------------------------------- #
+
+## Helper process entry point: `python privhelper.py [ROOT]`.
+if __name__ == '__main__':
+    # the helper runs as root: it must not create a root-owned app log
+    utils.get_config()['app']['logfile'] = ''
+    serve(sys.stdin.buffer, sys.stdout.buffer, sys.argv[1] if len(sys.argv) > 1 else '/')
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+## @package proxen.profiling
+# @brief Built-in profiling mode for the slow operations (reading, applying and
+# restoring the proxy settings, rereading the env variables).
+#
+# Profiling is off by default; it is switched on by any of:
+# - `PROXEN_PROFILE=1` env variable
+# - `profile = true` in `config.ini`
+# - `--profile` command-line flag (see proxen::parse_args())
+#
+# Each call of an operation decorated with profiled() then writes two files
+# into the diagnostics folder (see diag_dir()):
+# - `<time>_<operation>.pstats`: `cProfile` stats (open with `pstats` or `snakeviz`)
+# - `<time>_<operation>.folded`: collapsed stacks (one `frame;frame;... microseconds` line
+# per stack), the input format of `flamegraph.pl` and speedscope
+#
+# bundle() packs these files together with the log into a zip file for a bug report.
+import os, time, pstats, cProfile, zipfile, threading, functools, collections
+
+import utils
+import metrics
+
+# --------------------------------------------------------------- #
+
+## `str` diagnostics folder name (in the project dir)
+DIAG_DIR = 'diagnostics'
+## `int` max depth of the collapsed stacks
+MAX_STACK_DEPTH = 64
+
+## `bool` whether profiling is on (`None` = not yet read from the env / config, see is_enabled())
+_enabled = None
+## `threading.local` per-thread flag showing that a profiled operation is running
+# (nested profiled operations are included in the outer profile)
+_local = threading.local()
+## `list` profile files written in this session
+_written = []
+
+# --------------------------------------------------------------- #
+
+## @returns `bool` whether profiling is on
+def is_enabled():
+    global _enabled
+    if _enabled is None:
+        env = os.environ.get('PROXEN_PROFILE', '')
+        _enabled = env.lower() in ('1', 'true', 'yes', 'on') if env else utils.get_profile()
+    return _enabled
+
+## Switches profiling on or off.
+# @param on `bool` whether to profile the operations
+def enable(on=True):
+    global _enabled
+    _enabled = bool(on)
+
+## @returns `str` full path to the diagnostics folder
+def diag_dir():
+    return utils.make_abspath(DIAG_DIR)
+
+## @returns `list` profile files written in this session
+def session_files():
+    return list(_written)
+
+# --------------------------------------------------------------- #
+
+## @returns `str` a readable frame name for a `pstats` function key `(file, line, name)`
+def _frame_name(func):
+    filename, line, name = func
+    if filename == '~':
+        # built-in function, e.g. `<built-in method posix.stat>`
+        return name
+    return f'{os.path.basename(filename)}:{name}:{line}'
+
+## Converts profile stats to collapsed stacks.
+# `cProfile` records only caller -> callee edges, so the time of a function is split
+# between its stacks in proportion to the cumulative time of each incoming edge.
+# @param stats `pstats.Stats` the profile stats
+# @returns `list` lines in the `frame;frame;... microseconds` format (sorted)
+def collapse(stats) -> list:
+    callees = collections.defaultdict(dict)
+    roots = []
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        if not callers:
+            roots.append(func)
+        for caller, edge in callers.items():
+            callees[caller][func] = edge
+    folded = collections.defaultdict(float)
+
+    def walk(func, stack, weight):
+        ct = stats.stats[func][3]
+        share = weight / ct if ct else 0.0
+        folded[';'.join(_frame_name(f) for f in stack)] += stats.stats[func][2] * share
+        if len(stack) >= MAX_STACK_DEPTH:
+            return
+        for callee, edge in callees.get(func, {}).items():
+            # skip recursive calls (their time is included in the outer call)
+            if not callee in stack:
+                walk(callee, stack + (callee,), edge[3] * share)
+
+    # the profiled function is a root too, even if it is called recursively
+    # (e.g. a decorator wrapper shared by several functions)
+    top = max(stats.stats, key=lambda func: stats.stats[func][3], default=None)
+    if top and not top in roots:
+        roots.append(top)
+    for root in roots:
+        walk(root, (root,), stats.stats[root][3])
+    return sorted(f'{stack} {round(t * 1e6)}' for stack, t in folded.items() if round(t * 1e6) > 0)
+
+## Writes the `.pstats` and `.folded` files for a finished profile.
+# @param profiler `cProfile.Profile` the profiler
+# @param name `str` operation name (used in the file names)
+# @returns `list` paths of the written files
+def dump(profiler, name) -> list:
+    dirname = diag_dir()
+    os.makedirs(dirname, exist_ok=True)
+    stem = os.path.join(dirname, f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}_{name}")
+    profiler.dump_stats(f'{stem}.pstats')
+    with open(f'{stem}.folded', 'w', encoding=utils.CODING) as f_:
+        f_.write(utils.NL.join(collapse(pstats.Stats(profiler))) + utils.NL)
+    files = [f'{stem}.pstats', f'{stem}.folded']
+    _written.extend(files)
+    utils.log('Profile of "%s" written to "%s.*"', 'info', name, stem)
+    return files
+
+## Decorator profiling every call of a function when profiling is on (see is_enabled()).
+# @param name `str` operation name (default = the function's qualified name, e.g. 'Proxy.fromdict')
+def profiled(name=None):
+    def decorator(func):
+        op_name = name or func.__qualname__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not (_enabled or (_enabled is None and is_enabled())) or getattr(_local, 'active', False):
+                return func(*args, **kwargs)
+            profiler = cProfile.Profile()
+            _local.active = True
+            try:
+                return profiler.runcall(func, *args, **kwargs)
+            finally:
+                _local.active = False
+                try:
+                    dump(profiler, op_name)
+                except Exception as err:
+                    utils.log('Failed to write profile of "%s": %s', 'error', op_name, err)
+        return wrapper
+    return decorator
+
+# --------------------------------------------------------------- #
+
+## Packs the profile files and the log files into a zip file for a bug report.
+# @param zip_path `str` output file (default = `proxen-report-<time>.zip` in the diagnostics folder)
+# @param all_files `bool` if `True`, include all the profiles in the diagnostics folder;
+# otherwise, only those written in this session
+# @returns `str` path to the zip file
+def bundle(zip_path=None, all_files=False) -> str:
+    dirname = diag_dir()
+    if not zip_path:
+        os.makedirs(dirname, exist_ok=True)
+        zip_path = os.path.join(dirname, f"proxen-report-{time.strftime('%Y%m%d-%H%M%S')}.zip")
+    if all_files and os.path.isdir(dirname):
+        files = [os.path.join(dirname, f) for f in sorted(os.listdir(dirname)) if f.endswith(('.pstats', '.folded'))]
+    else:
+        files = [f for f in _written if os.path.isfile(f)]
+    utils.flush_logging()
+    logfile = utils.get_logfile()
+    if logfile:
+        logfile = os.path.abspath(logfile)
+        files += [f'{logfile}.{i}' for i in range(utils.get_logbackups(), 0, -1) if os.path.isfile(f'{logfile}.{i}')]
+        if os.path.isfile(logfile):
+            files.append(logfile)
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for fname in files:
+            zf.write(fname, os.path.basename(fname))
+        if metrics.is_enabled():
+            zf.writestr('metrics.json', metrics.to_json())
+    return zip_path
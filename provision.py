@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+## @package proxen.provision
+# @brief Bulk proxy provisioning: applies one proxy config to many user homes and / or
+# filesystem roots (e.g. chroots or container images) in parallel (Unix only).
+#
+# Each target is handled by a sysproxy::Proxy object over a sysproxy::Sysenv in target
+# mode (see Sysenv::is_target), in a pool of worker processes. Provisioning is idempotent:
+# - targets whose files have not changed (by `stat`) since they were last provisioned
+# with the same config are skipped without being read (see the state file, STATE_FILE)
+# - other targets are read and only rewritten if their settings differ from the config
+#
+# Command line (see proxen::parse_args()):
+# ```
+# python proxen.py provision -c proxy_config --home /home/* --root /srv/images/*
+# ```
+import os, json, time, hashlib, dataclasses, concurrent.futures
+
+import utils
+import sysproxy
+
+# --------------------------------------------------------------- #
+
+## `str` default state file (in the project dir) with the stats of the provisioned targets
+STATE_FILE = 'provision_state.json'
+
+# --------------------------------------------------------------- #
+
+## @brief A provisioning target: a home directory, a filesystem root or both.
+@dataclasses.dataclass(frozen=True)
+class Target:
+    ## `str` home directory (user files) or `None`
+    home: str = None
+    ## `str` filesystem root (system files in its `/etc`) or `None`
+    root: str = None
+
+    ## @returns `str` unique key of the target (used in the state file)
+    @property
+    def key(self) -> str:
+        return f'home={self.home or ""};root={self.root or ""}'
+
+    ## @returns `sysproxy::Sysenv` a new object operating the target's files
+    def sysenv(self, update_now=True) -> sysproxy.Sysenv:
+        return sysproxy.Sysenv(update_now, self.home, self.root)
+
+    def __str__(self):
+        return ' + '.join(f'{k} {v}' for k, v in (('home', self.home), ('root', self.root)) if v)
+
+## @brief The result of provisioning a single target.
+@dataclasses.dataclass
+class Outcome:
+    ## `provision::Target` the target
+    target: Target = None
+    ## `str` any of: 'changed' (files rewritten), 'unchanged' (already up to date),
+    # 'skipped' (not changed since the last run, see file_stats()) or 'failed'
+    status: str = 'failed'
+    ## `float` time spent on the target (ms)
+    ms: float = 0.0
+    ## `str` error message for failed targets
+    error: str = ''
+    ## `dict` file stats after provisioning (see file_stats())
+    stats: dict = None
+
+# --------------------------------------------------------------- #
+
+## @returns `str` hash of a proxy config (independent of the key order)
+def config_hash(dconfig: dict) -> str:
+    return hashlib.sha256(json.dumps(dconfig, sort_keys=True).encode(utils.CODING)).hexdigest()
+
+## @returns `dict` `{path: [mtime_ns, size]}` for all the profile files of a target
+# (`None` for missing files)
+def file_stats(target: Target) -> dict:
+    sysenv = target.sysenv(False)
+    res = {}
+    for fname in dict.fromkeys(sysenv.user_files() + sysenv.system_files()):
+        try:
+            st = os.stat(fname)
+            res[fname] = [st.st_mtime_ns, st.st_size]
+        except OSError:
+            res[fname] = None
+    return res
+
+## @returns `dict` the state file contents: `{target key: {'config': hash, 'files': stats}}`
+# @param filename `str` the state file (default = provision::STATE_FILE in the project dir)
+def load_state(filename=None) -> dict:
+    filename = filename or utils.make_abspath(STATE_FILE)
+    try:
+        with open(filename, 'r', encoding=utils.CODING) as f_:
+            return json.load(f_)
+    except (OSError, ValueError):
+        return {}
+
+## Writes the state file.
+# @param state `dict` the state (see load_state())
+# @param filename `str` the state file (default = provision::STATE_FILE in the project dir)
+def save_state(state, filename=None):
+    filename = filename or utils.make_abspath(STATE_FILE)
+    with open(filename, 'w', encoding=utils.CODING) as f_:
+        json.dump(state, f_, indent=2)
+
+# --------------------------------------------------------------- #
+
+## Applies a proxy config to a single target (run in a worker process).
+# @param target `provision::Target` the target
+# @param dconfig `dict` the proxy config (in the Proxy::asdict() format)
+# @returns `provision::Outcome` the result
+def provision_target(target: Target, dconfig: dict) -> Outcome:
+    t0 = time.perf_counter()
+    outcome = Outcome(target)
+    try:
+        if target.root and not os.path.isdir(target.root):
+            raise FileNotFoundError(f'Root "{target.root}" is not found!')
+        if target.home and not os.path.isdir(target.home):
+            raise FileNotFoundError(f'Home "{target.home}" is not found!')
+        before = file_stats(target)
+        proxy = sysproxy.Proxy(sysenv=target.sysenv())
+        proxy.fromdict(dconfig)
+        outcome.stats = file_stats(target)
+        outcome.status = 'unchanged' if outcome.stats == before else 'changed'
+    except Exception as err:
+        outcome.status = 'failed'
+        outcome.error = str(err) or err.__class__.__name__
+    outcome.ms = (time.perf_counter() - t0) * 1000
+    return outcome
+
+## Applies a proxy config to many targets in parallel.
+# @param targets `iterable` provision::Target objects
+# @param dconfig `dict` the proxy config (in the Proxy::asdict() format)
+# @param jobs `int` number of worker processes (default = number of CPUs; 1 = no pool)
+# @param force `bool` if `True`, do not skip the targets unchanged since the last run
+# @param state_file `str` the state file (default = provision::STATE_FILE in the project dir)
+# @param on_outcome `callable` called with each provision::Outcome as soon as it is ready
+# @returns `list` provision::Outcome objects in the order of the targets
+def provision(targets, dconfig: dict, jobs=None, force=False, state_file=None, on_outcome=None) -> list:
+    if sysproxy.OS == 'Windows':
+        raise Exception('Provisioning is supported on Unix platforms only!')
+    targets = list(dict.fromkeys(targets))
+    chash = config_hash(dconfig)
+    state = load_state(state_file)
+    outcomes = {}
+    pending = []
+
+    def done(outcome):
+        outcomes[outcome.target] = outcome
+        if outcome.status in ('changed', 'unchanged'):
+            state[outcome.target.key] = {'config': chash, 'files': outcome.stats}
+        elif outcome.status == 'failed':
+            state.pop(outcome.target.key, None)
+        if on_outcome: on_outcome(outcome)
+
+    # quick check: skip the targets provisioned with this config and not changed since
+    for target in targets:
+        t0 = time.perf_counter()
+        prev = state.get(target.key)
+        if not force and prev and prev.get('config') == chash:
+            stats = file_stats(target)
+            if stats == prev.get('files'):
+                done(Outcome(target, 'skipped', (time.perf_counter() - t0) * 1000, '', stats))
+                continue
+        pending.append(target)
+
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(pending) or 1))
+    if jobs == 1:
+        for target in pending:
+            done(provision_target(target, dconfig))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(provision_target, target, dconfig): target for target in pending}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    done(future.result())
+                except Exception as err:
+                    # the worker process died
+                    done(Outcome(futures[future], 'failed', 0.0, str(err) or err.__class__.__name__))
+
+    try:
+        save_state(state, state_file)
+    except OSError as err:
+        utils.log('Cannot write provisioning state: %s', 'error', err)
+    utils.log('Provisioned %d target(s): %s', 'info', len(targets),
+              ', '.join(f'{sum(1 for o in outcomes.values() if o.status == s)} {s}'
+                        for s in ('changed', 'unchanged', 'skipped', 'failed')))
+    return [outcomes[target] for target in targets]
+
+## @returns `str` provisioning results as a text table
+# @param outcomes `list` provision::Outcome objects
+def format_report(outcomes) -> str:
+    lines = [f"{'target':<60} {'status':<10} {'ms':>10}"]
+    for o in outcomes:
+        lines.append(f"{str(o.target):<60} {o.status:<10} {o.ms:>10.1f}" + (f'  {o.error}' if o.error else ''))
+    counts = {s: sum(1 for o in outcomes if o.status == s) for s in ('changed', 'unchanged', 'skipped', 'failed')}
+    lines.append(', '.join(f'{n} {s}' for s, n in counts.items()))
+    return '\n'.join(lines)
@@ -1,17 +1,243 @@
 # -*- coding: utf-8 -*-
 ## @package proxen.proxen
 # @brief Main application entry-point module that creates and launches the GUI app -- see main() function.
-import os, sys, traceback
-from qtimports import QtCore, QtWidgets
+#
+# Without arguments the GUI app is launched. Command-line mode:
+# ```
+# python proxen.py run [-c CONFIG] -- command [args...]
+# ```
+# runs `command` with the proxy settings from CONFIG injected into its environment
+# (see launcher module), without changing the system settings.
+# ```
+# python proxen.py provision [-c CONFIG] [--home DIR...] [--root DIR...] [-j JOBS] [--force]
+# ```
+# applies the proxy settings from CONFIG to many user homes and / or filesystem
+# roots in parallel (see provision module).
+# ```
+# python proxen.py audit [--root DIR...] [--home DIR...] [-c CONFIG] [--json FILE]
+# ```
+# reports the effective proxy settings and problems of all the accounts
+# (see audit module).
+# ```
+# python proxen.py fingerprint [--home DIR] [--root DIR] [--depth N] [--out FILE] [--compare FILE]
+# ```
+# prints the hash fingerprint of the proxy state or compares it with a saved one
+# (see fingerprint module).
+# ```
+# python proxen.py enforce [-c CONFIG] [--interval SECONDS] [--home DIR] [--root DIR] [--once]
+# ```
+# keeps the proxy settings from CONFIG in place, repairing any drift (see enforce module).
+# ```
+# python proxen.py daemon [--socket PATH] [--no-watch]
+# python proxen.py ctl [--socket PATH] {ping,get,apply,restore,fingerprint,stats,subscribe} [-c CONFIG]
+# ```
+# runs the proxen service or sends a request to it (see daemon module).
+#
+# With `--profile` (before the command), the slow operations are profiled
+# (see profiling module).
+import os, sys, traceback, argparse
 
 # ======================================================================================= #
 
-## Main function that creates and launches the application.
-def main():
+## Parses the command-line arguments.
+# @param argv `list` arguments to parse (default = `sys.argv[1:]`)
+# @returns `argparse.Namespace` parsed arguments (`command` is `None` for the GUI mode)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='proxen', description='System proxy configuration tool')
+    parser.add_argument('--profile', action='store_true', help='profile the slow operations (see the diagnostics folder)')
+    subparsers = parser.add_subparsers(dest='command')
+
+    parser_run = subparsers.add_parser('run', help='run a command with a proxy config (no system changes)')
+    parser_run.add_argument('-c', '--config', default='proxy_config',
+                            help='config name, JSON file or JSON string (default = "proxy_config")')
+    parser_run.add_argument('cmd', nargs=argparse.REMAINDER, help='command to run (after "--")')
+
+    parser_prov = subparsers.add_parser('provision', help='apply a proxy config to many homes and / or roots (Unix)')
+    parser_prov.add_argument('-c', '--config', default='proxy_config',
+                             help='config name, JSON file or JSON string (default = "proxy_config")')
+    parser_prov.add_argument('--home', nargs='+', default=[], metavar='DIR', help='target home directories')
+    parser_prov.add_argument('--root', nargs='+', default=[], metavar='DIR', help='target filesystem roots (system files)')
+    parser_prov.add_argument('-j', '--jobs', type=int, default=None, help='worker processes (default = number of CPUs)')
+    parser_prov.add_argument('--force', action='store_true', help='do not skip the targets unchanged since the last run')
+    parser_prov.add_argument('--state', default=None, help='state file (default = "provision_state.json" in the project dir)')
+
+    parser_audit = subparsers.add_parser('audit', help='report the proxy exports of all the users of hosts / images (Unix)')
+    parser_audit.add_argument('--root', nargs='+', default=[], metavar='DIR', help='filesystem roots (default = "/" if no homes are given)')
+    parser_audit.add_argument('--home', nargs='+', default=[], metavar='DIR', help='extra home directories')
+    parser_audit.add_argument('-c', '--config', default=None, help='reference config to find stale settings')
+    parser_audit.add_argument('-j', '--jobs', type=int, default=None, help='worker processes (default = number of CPUs)')
+    parser_audit.add_argument('--json', default=None, metavar='FILE', help='write the full report to a JSON file')
+    parser_audit.add_argument('--no-cache', action='store_true', help='parse all the files, ignoring the cache')
+
+    parser_fp = subparsers.add_parser('fingerprint', help='hash fingerprint of the proxy state and diffs between snapshots')
+    parser_fp.add_argument('--home', default=None, metavar='DIR', help='target home directory (Unix)')
+    parser_fp.add_argument('--root', default=None, metavar='DIR', help='target filesystem root (Unix)')
+    parser_fp.add_argument('--depth', type=int, default=None, help='max depth of the output (0 = the root hash only)')
+    parser_fp.add_argument('--out', default=None, metavar='FILE', help='write the fingerprint to a file')
+    parser_fp.add_argument('--compare', default=None, metavar='FILE', help='compare with a saved fingerprint')
+
+    parser_enf = subparsers.add_parser('enforce', help='keep a proxy config in place, repairing drift (Unix)')
+    parser_enf.add_argument('-c', '--config', default='proxy_config',
+                            help='config name, JSON file or JSON string (default = "proxy_config")')
+    parser_enf.add_argument('--interval', type=float, default=10.0, help='seconds between checks (default = 10)')
+    parser_enf.add_argument('--home', default=None, metavar='DIR', help='target home directory (default = yours)')
+    parser_enf.add_argument('--root', default=None, metavar='DIR', help='target filesystem root (system files)')
+    parser_enf.add_argument('--once', action='store_true', help='check (and repair) once and exit')
+
+    parser_daemon = subparsers.add_parser('daemon', help='run the proxen service (Unix socket API)')
+    parser_daemon.add_argument('--socket', default=None, metavar='PATH', help='socket file (default = in the runtime dir)')
+    parser_daemon.add_argument('--no-watch', action='store_true', help='do not watch the profile files')
+
+    parser_ctl = subparsers.add_parser('ctl', help='send a request to the proxen service')
+    parser_ctl.add_argument('method', choices=('ping', 'get', 'apply', 'restore', 'fingerprint', 'stats', 'subscribe'))
+    parser_ctl.add_argument('-c', '--config', default='proxy_config',
+                            help='config to apply: name, JSON file or JSON string (default = "proxy_config")')
+    parser_ctl.add_argument('--socket', default=None, metavar='PATH', help='socket file (default = in the runtime dir)')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        if args.cmd and args.cmd[0] == '--':
+            args.cmd = args.cmd[1:]
+        if not args.cmd:
+            parser_run.error('no command given')
+    elif args.command == 'provision':
+        if not (args.home or args.root):
+            parser_prov.error('no targets given (use --home and / or --root)')
+    elif args.command == 'audit':
+        if not (args.home or args.root):
+            args.root = ['/']
+    return args
+
+## Runs the `run` command: see launcher::run().
+# @returns `int` exit code
+def main_run(args):
+    import launcher
+    try:
+        dconfig = launcher.load_config(args.config)
+    except ValueError as err:
+        print(err, file=sys.stderr)
+        return 2
+    return launcher.run(args.cmd, dconfig)
+
+## Runs the `provision` command: see provision::provision().
+# @returns `int` exit code (1 if any target has failed)
+def main_provision(args):
+    import launcher, provision
+    try:
+        dconfig = launcher.load_config(args.config)
+    except ValueError as err:
+        print(err, file=sys.stderr)
+        return 2
+    targets = [provision.Target(home=d) for d in args.home] + [provision.Target(root=d) for d in args.root]
+    outcomes = provision.provision(targets, dconfig, args.jobs, args.force, args.state)
+    print(provision.format_report(outcomes))
+    return 1 if any(o.status == 'failed' for o in outcomes) else 0
 
+## Runs the `audit` command: see audit::audit().
+# @returns `int` exit code (1 if any account has issues)
+def main_audit(args):
+    import json, launcher, audit
+    dconfig = None
+    if args.config:
+        try:
+            dconfig = launcher.load_config(args.config)
+        except ValueError as err:
+            print(err, file=sys.stderr)
+            return 2
+    report = audit.audit(audit.list_accounts(args.root, args.home), dconfig, args.jobs, use_cache=not args.no_cache)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f_:
+            json.dump(report, f_, indent=2)
+    print(audit.format_report(report))
+    return 1 if any(acc['issues'] for acc in report['accounts']) else 0
+
+## Runs the `fingerprint` command: see sysproxy::Proxy::fingerprint().
+# @returns `int` exit code (1 if the fingerprint differs from the compared one)
+def main_fingerprint(args):
+    import sysproxy, fingerprint
+    sysenv = sysproxy.Sysenv(True, args.home, args.root) if args.home or args.root else None
+    node = sysproxy.Proxy(sysenv=sysenv).fingerprint()
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f_:
+            f_.write(fingerprint.dumps(node, args.depth))
+    if not args.compare:
+        if not args.out:
+            print(fingerprint.dumps(node, args.depth))
+        return 0
+    try:
+        with open(args.compare, 'r', encoding='utf-8') as f_:
+            other = fingerprint.loads(f_.read())
+    except (OSError, ValueError) as err:
+        print(err, file=sys.stderr)
+        return 2
+    rows = fingerprint.diff(other, node)
+    print(fingerprint.format_diff(rows) if rows else 'No differences')
+    return 1 if rows else 0
+
+## Runs the `enforce` command: see enforce::Enforcer.
+# @returns `int` exit code (with `--once`: 1 if the drift could not be repaired)
+def main_enforce(args):
+    import launcher, sysproxy, enforce
+    try:
+        dconfig = launcher.load_config(args.config)
+    except ValueError as err:
+        print(err, file=sys.stderr)
+        return 2
+    sysenv = sysproxy.Sysenv(False, args.home, args.root) if args.home or args.root else None
+    enforcer = enforce.Enforcer(dconfig, sysenv, args.interval)
+    if args.once:
+        result = enforcer.check()
+        print(f'{result}: {enforce.format_report(enforcer.report())}')
+        return 1 if result in ('failed', 'deferred') else 0
+    try:
+        enforcer.run()
+    except KeyboardInterrupt:
+        pass
+    print(enforce.format_report(enforcer.report()))
+    return 0
+
+## Runs the `daemon` command: see daemon::Server.
+# @returns `int` exit code
+def main_daemon(args):
+    import daemon
+    try:
+        server = daemon.Server(args.socket, watch=not args.no_watch)
+        server.bind()
+    except daemon.DaemonError as err:
+        print(err, file=sys.stderr)
+        return 2
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+## Runs the `ctl` command: sends a request to the daemon (see daemon::Client)
+# and prints the result (or the change events for `subscribe`) as JSON.
+# @returns `int` exit code (2 if the daemon cannot be reached or the request fails)
+def main_ctl(args):
+    import json, launcher, daemon
+    try:
+        params = {'config': launcher.load_config(args.config)} if args.method == 'apply' else {}
+        with daemon.Client.connect(args.socket) as client:
+            print(json.dumps(client.call(args.method, **params), indent=2))
+            if args.method == 'subscribe':
+                for event in client.events():
+                    print(json.dumps(event), flush=True)
+    except (ValueError, daemon.DaemonError) as err:
+        print(err, file=sys.stderr)
+        return 2
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+## Creates and launches the GUI application.
+def main_gui():
+
+    from qtimports import QtCore, QtWidgets
     from gui import MainWindow
-    
-    try:        
+
+    try:
         # change working dir to current for correct calls to git
         os.chdir(os.path.dirname(os.path.abspath(__file__)))
         # initialize Qt Core App settings
@@ -39,7 +265,29 @@ def main():
         traceback.print_exc(limit=None)
         sys.exit(1)
 
-# ======================================================================================= #    
+## Main function that parses the command line and dispatches to the GUI app or a command.
+def main():
+    args = parse_args()
+    if args.profile:
+        import profiling
+        profiling.enable()
+    if args.command == 'run':
+        sys.exit(main_run(args))
+    if args.command == 'provision':
+        sys.exit(main_provision(args))
+    if args.command == 'audit':
+        sys.exit(main_audit(args))
+    if args.command == 'fingerprint':
+        sys.exit(main_fingerprint(args))
+    if args.command == 'enforce':
+        sys.exit(main_enforce(args))
+    if args.command == 'daemon':
+        sys.exit(main_daemon(args))
+    if args.command == 'ctl':
+        sys.exit(main_ctl(args))
+    main_gui()
+
+# ======================================================================================= #
 
 ## Program entry point.
 if __name__ == '__main__':
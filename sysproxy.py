@@ -1,17 +1,14 @@
 # -*- coding: utf-8 -*-
 ## @package proxen.sysproxy
 # @brief Implements classes to work with the system proxy configuration. See Sysenv and Proxy.
-import os, platform, traceback, re, json, subprocess
+import os, platform, traceback, re, json, subprocess, functools, threading, weakref
+import urllib.parse
 import dataclasses
-from collections.abc import Callable
 from typing import Union
 
 ## @brief `str` the current OS platform name, e.g. 'Windows', 'Linux' or 'Darwin' (MacOS)
 OS = platform.system()
 
-if not OS in ('Windows', 'Linux', 'Darwin'):
-    raise Exception(f'Your platform ({OS}) is not [yet] supported, sorry! ((')
-
 if OS == 'Windows':
     import winreg
     ## `dict` Windows registry branch names
@@ -28,11 +25,13 @@ if OS == 'Windows':
                         }
 
 import utils
+import metrics
+import profiling
+import fingerprint
+import filetx
 
 # --------------------------------------------------------------- #
 
-## `tuple` current user name and admin privileges mark (see utils::has_admin())
-CURRENT_USER = utils.has_admin()
 ## `str` Windows registry key containing current proxy settings
 WIN_PROXY_KEY = r'Software\Microsoft\Windows\CurrentVersion\Internet Settings'
 ## `str` Windows registry key containing user environment variables (in HKCU branch)
@@ -45,109 +44,286 @@ WIN_DUMMY_KEYNAME = 'ttt'
 UNIX_PROFILE_FILES_USR = ['~/.profile', '~/.bashrc', '~/.bash_profile', '~/.zshrc', '~/.cshrc', '~/.tcshrc', ' ~/.login']
 ## `list` Unix root/system settings files
 UNIX_PROFILE_FILES_SYS = ['/etc/environment', '/etc/profile', '/etc/bashrc', '/etc/bash.bashrc', '/etc/zsh/zshrc', '/etc/csh.cshrc', '/etc/csh.login']
-## `str` default Unix local settings file (loaded on user logon)
-UNIX_LOCAL_FILE = '~/.profile'
-## `str` default Unix system settings file
-UNIX_SYSTEM_FILE = '/etc/environment'
-if OS != 'Windows':
+
+## Raises an exception if the current platform is not supported.
+# Called when a Sysenv object is created rather than on import, so the module
+# itself can always be imported.
+def check_platform():
+    if not OS in ('Windows', 'Linux', 'Darwin'):
+        raise Exception(f'Your platform ({OS}) is not [yet] supported, sorry! ((')
+
+## @returns `tuple` current user name and admin privileges mark (see utils::has_admin()).
+# The result is computed on first call and cached.
+@functools.lru_cache(maxsize=None)
+def current_user():
+    return utils.has_admin()
+
+## @returns `str` default Unix local settings file (loaded on user logon),
+# chosen from the `$SHELL` variable on first call and cached
+@functools.lru_cache(maxsize=None)
+def unix_local_file():
     shenv = os.environ.get('SHELL', None)
     if shenv:
         shell = shenv.split(os.sep)[-1].lower()
         if shell == 'bash':
-            UNIX_LOCAL_FILE = '~/.bashrc'
+            return '~/.bashrc'
         elif shell == 'zsh':
-            UNIX_LOCAL_FILE = '~/.zshrc'
+            return '~/.zshrc'
         elif shell == 'csh':
-            UNIX_LOCAL_FILE = '~/.cshrc'
+            return '~/.cshrc'
+    return '~/.profile'
+
+## @returns `str` default Unix system settings file: the first existing file
+# in sysproxy::UNIX_PROFILE_FILES_SYS (computed on first call and cached)
+@functools.lru_cache(maxsize=None)
+def unix_system_file():
     for fn in UNIX_PROFILE_FILES_SYS:
         if os.path.isfile(fn):
-            UNIX_SYSTEM_FILE = fn
-            break
+            return fn
+    return '/etc/environment'
+
+## Lazy module attributes kept for backward compatibility:
+# - `CURRENT_USER`: see current_user()
+# - `UNIX_LOCAL_FILE`: see unix_local_file()
+# - `UNIX_SYSTEM_FILE`: see unix_system_file()
+def __getattr__(name):
+    if name == 'CURRENT_USER':
+        return current_user()
+    if name == 'UNIX_LOCAL_FILE':
+        return unix_local_file() if OS != 'Windows' else '~/.profile'
+    if name == 'UNIX_SYSTEM_FILE':
+        return unix_system_file() if OS != 'Windows' else '/etc/environment'
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+## `tuple` proxy types handled by the app (correspond to the lower-case env variable names)
+PROXY_TYPES = ('http_proxy', 'https_proxy', 'ftp_proxy', 'rsync_proxy')
+## `tuple` lower-case names of all the proxy-relevant env variables
+PROXY_ENV_NAMES = PROXY_TYPES + ('all_proxy', 'no_proxy')
 ## `str` regex template to search for env vars in Unix files
 REGEX_ENV_EXPORT = r'(export\s{}=)(.*)'
 ## `str` regex template to search for proxy env vars
 REGEX_PROXY_EXPORT = r'export\s[\w_]+proxy'
+## `re.Pattern` regex matching an export line in a Unix profile file (groups: name, value)
+REGEX_EXPORT_LINE = re.compile(r'^\s*export\s+(\w+)=(.*)$')
+## `str` the PAM env file: plain `NAME=value` lines rather than shell code
+PAM_ENV_FILE = '/etc/environment'
+
+## Parses the `export NAME=value` lines of a Unix profile file.
+# Quoted values are unquoted; unquoted values end at the first whitespace (e.g. before a comment).
+# @param text `str` the file contents
+# @returns `list` `(line number, name, value)` tuples in the file order
+def parse_exports(text) -> list:
+    res = []
+    for i, line in enumerate(text.splitlines(), 1):
+        m = REGEX_EXPORT_LINE.match(line)
+        if not m: continue
+        val = m[2].strip()
+        if val[:1] in ('"', "'"):
+            end = val.find(val[0], 1)
+            val = val[1:end] if end > 0 else val[1:]
+        else:
+            val = val.split(None, 1)[0] if val else ''
+        res.append((i, m[1], val))
+    return res
+
+## Parses a file in the PAM env format (see PAM_ENV_FILE): `NAME=value` lines, all exported.
+# pam_env reads the values literally: an optional `export ` prefix and a pair of surrounding
+# quotes are stripped, but nothing is expanded or split (`$`, `;` and `#` are kept as is).
+# @param text `str` the file contents
+# @returns `list` `(line number, name, value)` tuples in the file order (as parse_exports())
+def parse_pam_env(text) -> list:
+    res = []
+    for i, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if line.startswith('export') and line[6:7] in (' ', '\t'):
+            line = line[7:].lstrip()
+        name, sep, val = line.partition('=')
+        if not sep or not name.isidentifier(): continue
+        if len(val) > 1 and val[0] in ('"', "'") and val[-1] == val[0]:
+            val = val[1:-1]
+        res.append((i, name, val))
+    return res
+
+## @returns `bool` whether a file is the PAM env file (see PAM_ENV_FILE), possibly under a target root
+def is_pam_env_file(path) -> bool:
+    return path.replace(os.sep, '/').endswith(PAM_ENV_FILE)
+
+## Parses the variables set in a Unix profile file: `NAME=value` lines in the PAM env file
+# (see parse_pam_env()), `export NAME=value` lines in the others (see parse_exports()).
+# @param text `str` the file contents
+# @param path `str` the file path
+# @returns `list` `(line number, name, value)` tuples in the file order
+def parse_profile(text, path) -> list:
+    return parse_pam_env(text) if is_pam_env_file(path) else parse_exports(text)
 
 # --------------------------------------------------------------- #
 
-## @brief Base data class for proxy / noproxy config classes.
-@dataclasses.dataclass
+## @brief Base class for the immutable proxy / noproxy config values.
+#
+# The objects are compact (`__slots__`, no per-instance `__dict__`) and immutable:
+# to change a value, make a new object with Dclass::replace() and assign it to the
+# corresponding sysproxy::Proxy property (which writes the changes to the system).
+# Identical values are interned: constructing an object equal to an existing one
+# returns that object, so comparing configs is mostly an identity check. The values
+# are converted to the field types (see Dclass::_types) first, so that equal values
+# of other types (e.g. a `float` port) never share an object with different fields.
+# The hash and the string representation (Dclass::proxystr) are computed once.
 class Dclass:
-    ## `callable` called when a member attribute is written to (set)
-    on_setattr: Callable = None
-
-    ## @returns `str` string representation of the object (must be implemented in child classes)
+    __slots__ = ('_hash', '_str', '__weakref__')
+    ## `tuple` names of the value attributes (in the constructor order)
+    _fields = ()
+    ## `tuple` types the values are converted to before interning (in the Dclass::_fields order)
+    _types = ()
+    ## `weakref.WeakValueDictionary` interned objects by attribute values (one per class)
+    _interned = weakref.WeakValueDictionary()
+    ## `threading.Lock` guards the interned objects
+    _intern_lock = threading.Lock()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._interned = weakref.WeakValueDictionary()
+
+    ## @returns `sysproxy::Dclass` the interned object with the given attribute values
+    # @param values `tuple` attribute values in the Dclass::_fields order
+    # @exception `ValueError`, `TypeError` a value cannot be converted to its field type
+    @classmethod
+    def _intern(cls, values):
+        values = tuple(type_(value) for type_, value in zip(cls._types, values))
+        with cls._intern_lock:
+            obj = cls._interned.get(values)
+            if obj is None:
+                obj = object.__new__(cls)
+                for name, value in zip(cls._fields, values):
+                    object.__setattr__(obj, name, value)
+                object.__setattr__(obj, '_hash', hash((cls.__name__,) + values))
+                object.__setattr__(obj, '_str', None)
+                cls._interned[values] = obj
+                metrics.incr('config_objects')
+            return obj
+
+    ## @returns `tuple` the attribute values in the Dclass::_fields order
+    def values(self):
+        return tuple(getattr(self, name) for name in self._fields)
+
+    ## @returns `str` string representation of the object (computed by Dclass::_make_str() and cached)
     @property
     def proxystr(self):
+        if self._str is None:
+            object.__setattr__(self, '_str', self._make_str())
+        return self._str
+
+    ## @returns `str` string representation of the object (must be implemented in child classes)
+    def _make_str(self):
         return ''
 
-    ## @returns `dict` dict representation of the object (default = all members)
+    ## @returns `dict` dict representation of the object (default = all attributes)
     def asdict(self):
-        # return dataclasses.asdict(self)
-        return dict((field.name, getattr(self, field.name)) for field in dataclasses.fields(self) if field.name != 'on_setattr')
+        return dict(zip(self._fields, self.values()))
+
+    ## @returns `sysproxy::Dclass` a copy of the object with some attributes changed, e.g.
+    # `proxyconf.replace(port=3000)`
+    def replace(self, **changes):
+        return self.__class__(**dict(zip(self._fields, self.values()), **changes))
 
     ## @returns `str` string representation of the object (calls Dclass::proxystr())
     def __str__(self):
         return self.proxystr
 
-    ## Hook executed when a member attribute is written to (set)
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__,
+                               ', '.join(f'{name}={value!r}' for name, value in zip(self._fields, self.values())))
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._hash == other._hash and self.values() == other.values()
+
+    def __hash__(self):
+        return self._hash
+
     def __setattr__(self, name, value):
-        super().__setattr__(name, value)
-        if getattr(self, 'on_setattr', None) and name != 'on_setattr':
-            self.on_setattr(self, name, value)
+        raise AttributeError(f'{self.__class__.__name__} objects are immutable, use replace()')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{self.__class__.__name__} objects are immutable')
+
+    def __reduce__(self):
+        return (self.__class__, self.values())
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
 
 # --------------------------------------------------------------- #
 
 ## @brief System proxy configuration object, e.g. for HTTP_PROXY or HTTPS_PROXY.
-@dataclasses.dataclass
 class Proxyconf(Dclass):
-    ## `str` the proxy protocol (type): any of 'http', 'https', 'ftp' or 'rsync'
-    protocol: str = 'http'
-    ## `str` the proxy host / IP, e.g. '192.168.1.0'
-    host: str = ''
-    ## `int` the proxy port (default = 3128)
-    port: int = 3128
-    ## `bool` whether the proxy server must use authentication (default = `False`)
-    auth: bool = False
-    ## `str` proxy user name (if auth is `True`)
-    uname: str = ''
-    ## `str` proxy user password (if auth is `True`)
-    password: str = ''
+    ## @var protocol
+    # `str` the proxy protocol (type): any of 'http', 'https', 'ftp' or 'rsync'
+    ## @var host
+    # `str` the proxy host / IP, e.g. '192.168.1.0'
+    ## @var port
+    # `int` the proxy port (default = 3128)
+    ## @var auth
+    # `bool` whether the proxy server must use authentication (default = `False`);
+    # always `False` without a user name (the URL would carry no credentials)
+    ## @var uname
+    # `str` proxy user name (if auth is `True`)
+    ## @var password
+    # `str` proxy user password (if auth is `True`)
+    __slots__ = ('protocol', 'host', 'port', 'auth', 'uname', 'password')
+    _fields = __slots__
+    _types = (str, str, int, bool, str, str)
+
+    def __new__(cls, protocol='http', host='', port=3128, auth=False, uname='', password=''):
+        return cls._intern((protocol, host, port, bool(auth) and bool(uname), uname, password))
+
+    ## @returns `str` the host and port, e.g. `proxy:3128` or `[fe80::1]:3128` for an IPv6 host
+    @property
+    def hostport(self):
+        host = f'[{self.host}]' if ':' in self.host else self.host
+        return f'{host}:{self.port}'
 
     ## @returns `str` string representation in the format: 
     # `protocol://[username:password@]host:port`
-    @property
-    def proxystr(self):
+    # (the user name and password are percent-encoded, see parse_proxy())
+    def _make_str(self):
         if self.auth and self.uname:
-            auth_ = ':'.join((self.uname, self.password)) + '@'
+            auth_ = ':'.join((urllib.parse.quote(self.uname, safe=''), urllib.parse.quote(self.password, safe=''))) + '@'
         else:
             auth_ = ''
-        return f'{self.protocol}://{auth_}{self.host}:{self.port}'
+        return f'{self.protocol}://{auth_}{self.hostport}'
 
 # --------------------------------------------------------------- #
 
 ## @brief Proxy bypass (no-proxy) configuration object.
-@dataclasses.dataclass
 class Noproxy(Dclass):
-    ## `str` comma-separated list of proxy bypass addresses, e.g.
+    ## @var noproxies
+    # `str` comma-separated list of proxy bypass addresses, e.g.
     # `localhost, 127.0.0.1, *.example.com`
-    noproxies: str = ''
+    __slots__ = ('noproxies',)
+    _fields = __slots__
+    _types = (str,)
+
+    def __new__(cls, noproxies=''):
+        return cls._intern((noproxies,))
 
     ## Returns the concatenated string representation of the bypassed addresses.
     # @param winreg `bool` if `True`, the string will be formatted using the Windows
     # registry convention (`HKCU\SOFTWARE\Microsoft\Windows\CurrentVersion\Internet Settings\ProxyOverrid`e)
     # @returns `str` delimited list of proxy bypass addresses
     def asstr(self, winreg=False):
+        if not winreg:
+            return self.proxystr
         l_noproxies = self.aslist()
-        if not l_noproxies:
-            return ''
-        if winreg:
-            vals = [val for val in l_noproxies if not val in ('localhost', '127.0.0.1')]
-            if 'localhost' in l_noproxies or '127.0.0.1' in l_noproxies:
-                vals.append('<local>')
-            return ';'.join(vals)
-        else:
-            return ','.join(l_noproxies)
+        vals = [val for val in l_noproxies if not val in ('localhost', '127.0.0.1')]
+        if 'localhost' in l_noproxies or '127.0.0.1' in l_noproxies:
+            vals.append('<local>')
+        return ';'.join(vals)
 
     ## @returns `list` bypassed addresses as a list, e.g.
     # ```['localhost', '127.0.0.1', '*.example.com']```
@@ -162,9 +338,8 @@ class Noproxy(Dclass):
     def asdict(self):
         return {'noproxies': str(self)}
 
-    @property
-    def proxystr(self):
-        return self.asstr(False)
+    def _make_str(self):
+        return ','.join(self.aslist())
 
     ## @returns `bool` convenience to check object validity:
     # returns `False` if Noproxy::noproxies is empty and `True` otherwise
@@ -173,6 +348,149 @@ class Noproxy(Dclass):
 
 # --------------------------------------------------------------- #
 
+## @brief Raised when a proxy URL cannot be parsed (see parse_proxy()).
+class ProxyParseError(ValueError):
+    pass
+
+## `re.Pattern` regex matching the scheme of a proxy URL, e.g. `http://` or `socks5h://`
+REGEX_SCHEME = re.compile(r'^[A-Za-z][A-Za-z0-9+.\-]*://')
+## `int` max number of parsed proxy URLs cached by parse_proxy()
+PARSE_CACHE_SIZE = 256
+
+## Parses a proxy URL, e.g. the value of `http_proxy`.
+#
+# The URL has the format `[protocol://][username[:password]@]host[:port][/path]`:
+# - the protocol defaults to 'http' and is lower-cased (any scheme is accepted, e.g. `socks5h`)
+# - the user name and password may be percent-encoded (as written by Proxyconf::proxystr)
+# - an IPv6 host must be in brackets, e.g. `http://[fe80::1]:3128`
+# - the port defaults to 3128 (a given port must be 1 to 65535); a trailing path is ignored
+# - authentication is on if a user name is given (as in Proxyconf::auth)
+#
+# The results are cached (the returned objects are immutable), so reading the same
+# values again costs a dictionary lookup.
+# @param proxystr `str` the proxy URL
+# @returns `sysproxy::Proxyconf` the parsed proxy configuration
+# @exception `sysproxy::ProxyParseError` the URL is invalid
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_proxy(proxystr: str) -> Proxyconf:
+    value = proxystr.strip() if isinstance(proxystr, str) else ''
+    if not value or any(c.isspace() for c in value):
+        raise ProxyParseError('Invalid proxy URL: empty or contains spaces')
+    if not REGEX_SCHEME.match(value):
+        value = 'http://' + value
+    hostport = value.partition('://')[2].partition('/')[0].rpartition('@')[2]
+    if not hostport.startswith('[') and hostport.count(':') > 1:
+        raise ProxyParseError('Invalid proxy URL: IPv6 host must be enclosed in brackets')
+    try:
+        parts = urllib.parse.urlsplit(value)
+        port = parts.port
+    except ValueError as err:
+        raise ProxyParseError(f'Invalid proxy URL: {err}') from None
+    if port == 0:
+        raise ProxyParseError('Invalid proxy URL: Port out of range 1-65535')
+    hostport = parts.netloc.rpartition('@')[2]
+    host = hostport[1:].partition(']')[0] if hostport.startswith('[') else hostport.partition(':')[0]
+    if not host:
+        raise ProxyParseError('Invalid proxy URL: no host')
+    uname = urllib.parse.unquote(parts.username or '')
+    # a password without a user name is not rendered by Proxyconf::proxystr: dropped
+    password = urllib.parse.unquote(parts.password or '') if uname else ''
+    return Proxyconf(parts.scheme.lower(), host, 3128 if port is None else port, bool(uname), uname, password)
+
+## Parses many proxy URLs at once, e.g. when loading stored configs or auditing profiles.
+# Each distinct URL is parsed once; invalid URLs are collected instead of raising.
+# @param proxystrs `iterable` proxy URLs
+# @returns `tuple` `(parsed, errors)`: `{url: sysproxy::Proxyconf}` for the valid URLs
+# and `{url: error message}` for the invalid ones
+def parse_proxies(proxystrs) -> tuple:
+    parsed = {}
+    errors = {}
+    for proxystr in proxystrs:
+        if proxystr in parsed or proxystr in errors:
+            continue
+        try:
+            parsed[proxystr] = parse_proxy(proxystr)
+        except ProxyParseError as err:
+            errors[proxystr] = str(err)
+    return parsed, errors
+
+# --------------------------------------------------------------- #
+
+## Checks the shape of a proxy config dictionary (in the Proxy::asdict() format):
+# each proxy type is `None` or a dictionary with an `int` port and `str` fields, `noproxy` is
+# `None` or a string and `enabled` is a boolean (missing keys are allowed).
+# @param dconfig `dict` the proxy configuration
+# @returns `dict` the same config
+# @exception `ValueError` the config is invalid
+def check_config(dconfig: dict) -> dict:
+    if not isinstance(dconfig, dict):
+        raise ValueError('Proxy config must be a dictionary (JSON object)!')
+    for attr in PROXY_TYPES:
+        obj = dconfig.get(attr, None)
+        if obj is None:
+            continue
+        if not isinstance(obj, dict):
+            raise ValueError(f'"{attr}" must be an object with the proxy settings or null!')
+        port = obj.get('port', 3128)
+        if not isinstance(port, int) or isinstance(port, bool) or not 0 < port < 65536:
+            raise ValueError(f'"{attr}": port must be an integer from 1 to 65535!')
+        for field in ('protocol', 'host', 'uname', 'password'):
+            if not isinstance(obj.get(field, ''), str):
+                raise ValueError(f'"{attr}": {field} must be a string!')
+        if not isinstance(obj.get('auth', False), bool):
+            raise ValueError(f'"{attr}": auth must be a boolean!')
+    if not isinstance(dconfig.get('noproxy', None), (str, type(None))):
+        raise ValueError('"noproxy" must be a string or null!')
+    if not isinstance(dconfig.get('enabled', True), bool):
+        raise ValueError('"enabled" must be a boolean!')
+    return dconfig
+
+## Builds the proxy environment variables described by a proxy config dictionary
+# (as produced by Proxy::asdict()) without touching the system.
+# @param dconfig `dict` the proxy configuration
+# @param case_variants `bool` if `True`, each variable is returned in both lower and upper case
+# @returns `dict` env variables, e.g. `{'http_proxy': 'http://proxy:3128', 'HTTP_PROXY': ...}`.
+# Proxy types that are not set (and `http_proxy` if the proxy is disabled) are omitted.
+def proxy_envs(dconfig: dict, case_variants=True) -> dict:
+    envs = {}
+    for attr in PROXY_TYPES:
+        obj = dconfig.get(attr, None)
+        if not obj or (attr == 'http_proxy' and not dconfig.get('enabled', True)):
+            continue
+        envs[attr] = Proxyconf(obj.get('protocol', 'http'), obj.get('host', ''),
+                               obj.get('port', 3128), obj.get('auth', False),
+                               obj.get('uname', ''), obj.get('password', '')).proxystr
+    if dconfig.get('noproxy', None):
+        envs['no_proxy'] = Noproxy(dconfig['noproxy']).asstr(False)
+    if case_variants:
+        envs.update({k.upper(): v for k, v in envs.items()})
+    return envs
+
+# --------------------------------------------------------------- #
+
+## @brief A single pending environment variable change (see Sysenv::apply_changes()).
+@dataclasses.dataclass
+class Envchange:
+    ## `str` the change type: 'set' (set existing variable), 'create' (set or create) or 'unset'
+    action: str = 'set'
+    ## `str` the environment variable name
+    envname: str = ''
+    ## `Any` the new value (ignored for 'unset')
+    value: object = None
+    ## `str`|`int` the type of the value to create (see Sysenv::win_create_reg())
+    valtype: object = None
+    ## `tuple` domains the change applies to: either or both of 'user' and 'system'
+    modes: tuple = ('user',)
+
+    ## @returns `str` human-readable description of the change
+    def __str__(self):
+        modes = '+'.join(self.modes)
+        if self.action == 'unset':
+            return f'unset {self.envname} [{modes}]'
+        return f'{self.action} {self.envname} = "{self.value}" [{modes}]'
+
+# --------------------------------------------------------------- #
+
 ## @brief A class to operate system environment variables (cross-platform).
 #
 # This class provides a set of relatively low-level tools to manipulate
@@ -202,6 +520,15 @@ class Noproxy(Dclass):
 # in both domains and persisting them in the system by writing to the corresponding files
 # and registry values.
 #
+# On Unix, a Sysenv object may also target another user's home directory and / or
+# another filesystem root (e.g. a chroot or a container image) instead of the current
+# session: see the `home` and `root` constructor parameters. In this *target mode*:
+# - only the files in the given home (user domain) and the given root's `/etc`
+# (system domain) are read and written
+# - the variables are read from these files rather than from the current environment
+# (see Sysenv::update_vars())
+# - the current process environment is never changed
+#
 # @warning This class persists all proxy configurations in the system!
 # For Windows, it will set / create registry values in `HKCU\Environment`.
 # For Unix systems (Linux and Max), it will write the proxy environment variables to
@@ -209,22 +536,141 @@ class Noproxy(Dclass):
 class Sysenv:
 
     ## @param update_now `bool` if `True`, retrieves the env variables on object creation
-    def __init__(self, update_now=True):
-        ## `str` for Unix, the file with user settings where the proxy 
-        # environment variables will be written (= sysproxy::UNIX_LOCAL_FILE)
-        self.unix_file_local = os.path.expanduser(UNIX_LOCAL_FILE)
-        ## `str` for Unix, the file with system settings where the proxy 
-        # environment variables will be written (= sysproxy::UNIX_SYSTEM_FILE)
-        self.unix_file_system = os.path.expanduser(UNIX_SYSTEM_FILE)
+    # @param home `str` Unix only: target home directory used instead of `~` (target mode)
+    # @param root `str` Unix only: target filesystem root used instead of `/` for the
+    # system files (target mode)
+    def __init__(self, update_now=True, home=None, root=None):
+        check_platform()
+        if (home or root) and OS == 'Windows':
+            raise Exception('Target homes and roots are supported on Unix platforms only!')
+        ## `str` target home directory (`None` = the current user's home)
+        self.home = os.path.abspath(home) if home else None
+        ## `str` target filesystem root (`None` = the current system)
+        self.root = os.path.abspath(root) if root else None
+        if OS != 'Windows':
+            ## `str` for Unix, the file with user settings where the proxy 
+            # environment variables will be written (= sysproxy::unix_local_file());
+            # `None` for a target without a home
+            self.unix_file_local = self.user_path(unix_local_file()) if self.home or not self.root else None
+            ## `str` for Unix, the file with system settings where the proxy 
+            # environment variables will be written (= sysproxy::unix_system_file());
+            # `None` for a target without a root
+            if self.root:
+                self.unix_file_system = next((f for f in self.system_files() if os.path.isfile(f)), 
+                                             self.system_path('/etc/environment'))
+            else:
+                self.unix_file_system = os.path.expanduser(unix_system_file()) if not self.home else None
+        else:
+            self.unix_file_local = self.unix_file_system = None
         ## `dict` local (user) environment variables 
         # (key = variable name, value = variable value)
         self.locals = {}
         ## `dict` global (system) environment variables 
         # (key = variable name, value = variable value)
         self.globals = {}
+        ## `bool` on Windows, whether an env change broadcast (`setx`) is deferred
+        # until the end of a batch (see Sysenv::apply_changes())
+        self._defer_broadcast = False
+        ## `bool` on Windows, whether a deferred broadcast is pending
+        self._broadcast_pending = False
+        ## `dict` on Unix, system file changes queued for the privileged helper while
+        # a batch is open (`None` = no batch, see Sysenv::begin_system_batch())
+        self._system_batch = None
         if update_now: self.update_vars()
 
+    ## @returns `bool` whether the object targets another home or root rather than the current session
+    @property
+    def is_target(self) -> bool:
+        return bool(self.home or self.root)
+
+    ## @returns `str` full path to a user file, e.g. '~/.bashrc' -> '/home/user/.bashrc'
+    # (relative to the target home, if any)
+    def user_path(self, fname) -> str:
+        fname = fname.strip()
+        if self.home and fname.startswith('~'):
+            return os.path.join(self.home, fname[1:].lstrip('/'))
+        return os.path.expanduser(fname)
+
+    ## @returns `str` full path to a system file, e.g. '/etc/profile' (relative to the target root, if any)
+    def system_path(self, fname) -> str:
+        return os.path.join(self.root, fname.lstrip('/')) if self.root else fname
+
+    ## @returns `list` full paths to the Unix user files (see sysproxy::UNIX_PROFILE_FILES_USR);
+    # empty for a target without a home
+    def user_files(self) -> list:
+        if self.root and not self.home:
+            return []
+        return [self.user_path(f) for f in UNIX_PROFILE_FILES_USR]
+
+    ## @returns `list` full paths to the Unix system files (see sysproxy::UNIX_PROFILE_FILES_SYS);
+    # empty for a target without a root
+    def system_files(self) -> list:
+        if self.home and not self.root:
+            return []
+        return [self.system_path(f) for f in UNIX_PROFILE_FILES_SYS]
+
+    ## @returns `bool` whether the system files may be written: for the current session,
+    # this requires admin privileges (see sysproxy::current_user()) or the privileged
+    # helper (see Sysenv::uses_privhelper()); for a target, a root must be given
+    # (file permissions are checked on writing)
+    def can_write_system(self) -> bool:
+        if self.is_target:
+            return bool(self.root)
+        return current_user()[1] or self.uses_privhelper()
+
+    ## @returns `bool` whether the system files are written by the privileged helper
+    # process (see privhelper module): Unix only, for the current session without
+    # admin privileges, if enabled in the app config (`privhelper` option)
+    def uses_privhelper(self) -> bool:
+        if OS == 'Windows' or self.is_target or current_user()[1]:
+            return False
+        import privhelper
+        return privhelper.is_enabled()
+
+    ## Opens a batch of system file changes: the changes for the privileged helper are
+    # queued until Sysenv::end_system_batch() and then sent at once.
+    def begin_system_batch(self):
+        if self._system_batch is None:
+            self._system_batch = {}
+
+    ## Closes a batch opened by Sysenv::begin_system_batch() and sends the queued changes.
+    # @returns `bool` success = `True`, failure = `False`
+    def end_system_batch(self) -> bool:
+        final, self._system_batch = self._system_batch, None
+        return self._privhelper_apply(final) if final else True
+
+    ## Applies changes to the system files through the privileged helper
+    # (or queues them while a batch is open).
+    # @param final `dict` final state per lower-case variable name: the value to set
+    # or `None` to unset
+    # @returns `bool` success = `True`, failure = `False`
+    def _privhelper_apply(self, final: dict) -> bool:
+        if self._system_batch is not None:
+            self._system_batch.update(final)
+            return True
+        import privhelper
+        helper = privhelper.get_helper()
+        return bool(helper) and helper.apply(final)
+
+    ## Reads the exported variables from Unix profile files.
+    # @param files `iterable` full paths to the files (missing files are skipped)
+    # @returns `dict` `{env: value}` pairs (later exports override earlier ones)
+    @staticmethod
+    def _unix_read_exports(files) -> dict:
+        res = {}
+        for fname in files:
+            if not os.path.isfile(fname): continue
+            with open(fname, 'r', encoding=utils.CODING, errors='replace') as f_:
+                txt = f_.read()
+            metrics.file_read(len(txt))
+            res.update((name, val) for _, name, val in parse_profile(txt, fname))
+        return res
+
     ## Reads environment variables into Sysenv::locals and Sysenv::globals.
+    # In target mode (see Sysenv::is_target), the variables are read from the target files:
+    # Sysenv::globals gets the system exports and Sysenv::locals, the exports seen by
+    # a login shell (system exports overridden by the user ones).
+    @metrics.timed()
     def update_vars(self):
         self.locals = {}
         self.globals = {}
@@ -232,6 +678,9 @@ class Sysenv:
             # on Win it's possible to get local and system (machine) vars separately from the registry
             self.locals = self.win_list_reg(WIN_ENV_LOCAL_KEY) or {}
             self.globals = self.win_list_reg(WIN_ENV_SYSTEM_KEY, 'HKLM') or {}
+        elif self.is_target:
+            self.globals = self._unix_read_exports(self.system_files())
+            self.locals = dict(self.globals, **self._unix_read_exports(self.user_files()))
         else:
             # hard to separate 'user' from 'system' vars on Unix, so use only user domain
             self.locals.update(**os.environ)
@@ -251,6 +700,7 @@ class Sysenv:
     # ```python
     # {'user': value or None, 'system': value or None}
     # ```
+    @metrics.timed()
     def get_env(self, envname, case_sensitive=False, modes=('user', 'system'), default=None) -> dict: 
         res = None      
         if 'user' in modes:
@@ -277,6 +727,7 @@ class Sysenv:
         if flags:
             flags = f' {flags}'
         try:
+            metrics.incr('subprocesses')
             res = subprocess.run(f'grep{flags} "export\s{envname_pattern}" "{filename}"', shell=True, check=True, capture_output=True, encoding=utils.CODING)
             res.check_returncode()
             if raw:
@@ -304,22 +755,24 @@ class Sysenv:
     # @param filename `str` full path to the file to search in (path must be expanded!)
     # @param case_sensitive `bool` perform case-sensitive pattern search (default = `False`)
     # @returns `bool` success = `True`, failure = `False`
-    # @see Sysenv::_unix_get_from_file()
+    # @see filetx::update()
     def _unix_delete_from_file(self, envname_pattern, filename, case_sensitive=False) -> bool:
         if OS == 'Windows':
             raise Exception('This method is only for UNIX platforms!')
-        txt = ''
-        with open(filename, 'r', encoding=utils.CODING) as f_:
-            txt = f_.read()
-        res = self._unix_get_from_file(envname_pattern, filename, case_sensitive, True, True)
-        if res is None:
+        # the PAM env file may also set variables without `export`
+        pattern = r'export\s' + envname_pattern
+        if is_pam_env_file(filename):
+            pattern = rf'{pattern}|^\s*(?:{envname_pattern})='
+        reg = re.compile(pattern, 0 if case_sensitive else re.I)
+        try:
+            changed = filetx.update(filename, lambda txt: ''.join(line for line in txt.splitlines(True) if not reg.search(line)))
+        except OSError as err:
+            utils.log('Cannot delete envs from file "%s": %s', 'error', filename, err)
             return False
-        if res == txt:
-            utils.log(f'No envs with pattern "{envname_pattern}" are found in file "{filename}"', 'debug')
+        if not changed:
+            utils.log('No envs with pattern "%s" are found in file "%s"', 'debug', envname_pattern, filename)
             return True
-        with open(filename, 'w', encoding=utils.CODING) as f_:
-            f_.write(res)
-        utils.log(f'Deleted envs with pattern "{envname_pattern}" from file "{filename}"', 'debug')
+        utils.log('Deleted envs with pattern "%s" from file "%s"', 'debug', envname_pattern, filename)
         return True
 
     ## Deletes (unsets) an env variable on Unix systems.
@@ -328,23 +781,27 @@ class Sysenv:
     # - `user`: unset user variable (from `~/...` files)
     # - `system`: unset system variable (from `/etc/...` files)
     # @returns `bool` success = `True`, failure = `False`
+    @metrics.timed()
     def unix_del_env(self, envname, modes=('user', 'system')) -> bool:
         if OS == 'Windows':
             raise Exception('This method is only for UNIX platforms!')
         try:
             # reg = re.compile(r'^\s*export\s{}.*$'.format(envname), re.I | re.MULTILINE)
+            res = True
             for mode in modes:
                 if mode == 'user':
-                    file_list = UNIX_PROFILE_FILES_USR
+                    file_list = self.user_files()
                 elif mode == 'system':
-                    if not CURRENT_USER[1]:
+                    if not self.can_write_system():
+                        continue
+                    elif self.uses_privhelper():
+                        res = self._privhelper_apply({envname.lower(): None}) and res
                         continue
                     else:
-                        file_list = UNIX_PROFILE_FILES_SYS
+                        file_list = self.system_files()
                 else:
                     continue
                 for fname in file_list: 
-                    fname = os.path.expanduser(fname)
                     if not os.path.isfile(fname): continue
                     self._unix_delete_from_file(envname, fname)
                     """
@@ -355,9 +812,9 @@ class Sysenv:
                     ftext = reg.sub('\n:', ftext)
                     with open(fname, 'w', encoding=utils.CODING) as f_:
                         f_.write(ftext)
-                    utils.log(f'Deleted env "{envname}" from file "{fname}"', 'debug')
+                    utils.log('Deleted env "%s" from file "%s"', 'debug', envname, fname)
                     """                    
-            return True
+            return res
 
         except:
             traceback.print_exc()
@@ -367,30 +824,47 @@ class Sysenv:
     # @param envname `str` the environment variable name, e.g. 'http_proxy'
     # @param value `Any` the variable value, e.g. '192.168.1.0' (string) or 25 (number)
     # @returns `bool` success = `True`, failure = `False`
+    @metrics.timed()
     def unix_write_env(self, envname, value, write_system=True) -> bool:
         if OS == 'Windows':
             raise Exception('This method is only for UNIX platforms!')
         try:
-            # 1 - delete exports in local AND/OR systems files with this env
-            self.unix_del_env(envname)
-
-            # 2 - write env to files
-            files = [self.unix_file_local]
-            if write_system and CURRENT_USER[1]:
+            helper = self.uses_privhelper()
+            admin = self.can_write_system() and not helper
+            # files getting the new exports
+            files = [self.unix_file_local] if self.unix_file_local else []
+            if write_system and admin:
                 files.append(self.unix_file_system)
+            elif helper and not self._privhelper_apply({envname.lower(): str(value) if write_system else None}):
+                return False
+
+            # the old exports are deleted from all the files; in the files getting the new
+            # exports, both are done in the same transaction, so that concurrent writers
+            # cannot leave duplicate exports
+            exports = ''.join(f'{utils.NL}export {e_}="{value}"' for e_ in (envname.lower(), envname.upper()))
+            for fname in dict.fromkeys(self.user_files() + (self.system_files() if admin else []) + files):
+                if fname in files:
+                    filetx.update(fname, lambda txt: self._unix_strip_exports(txt, [envname], is_pam_env_file(fname)) + exports,
+                                  create=True)
+                    utils.log('Written env "%s" = "%s" to file "%s"', 'debug', envname, value, fname)
+                elif os.path.isfile(fname):
+                    self._unix_delete_from_file(envname, fname)
 
-            for fname in files:
-                with open(fname, 'a', encoding=utils.CODING) as f_:               
-                    for e_ in (envname.lower(), envname.upper()):
-                        f_.write(f'{utils.NL}export {e_}="{value}"')
-                utils.log(f'Written env "{envname}" = "{value}" to file "{fname}"', 'debug')
-                
             return True
 
         except:
             traceback.print_exc()
             return False
 
+    ## Propagates registry env changes to the running processes by calling `setx`
+    # (or only marks the broadcast as pending while a batch is being applied).
+    def _win_broadcast_env(self):
+        if self._defer_broadcast:
+            self._broadcast_pending = True
+            return
+        metrics.incr('subprocesses')
+        subprocess.run('setx ttt t > nul', shell=True)
+
     ## Gets the value of a specified key/val from the Windows registry.
     # @param keyname `str` the registry key path
     # @param valname `str` the registry value name
@@ -399,9 +873,11 @@ class Sysenv:
     # -# `str` the retrieved value (as a string)
     # -# `int` the value type (see [winreg docs](https://docs.python.org/3/library/winreg.html#value-types))
     # `None` is returned on error
+    @metrics.timed()
     def win_get_reg(self, keyname, valname, branch='HKEY_CURRENT_USER') -> tuple[str, int]:
         if OS != 'Windows':
             raise Exception('This method is available only on Windows platforms!')
+        metrics.incr('registry_calls')
         if isinstance(branch, str):
             branch = WIN_REG_BRANCHES[branch]
         k = None
@@ -410,7 +886,7 @@ class Sysenv:
             k = winreg.OpenKeyEx(branch, keyname)
             res = winreg.QueryValueEx(k, valname)
         except:
-            utils.log(f'!!! Failed to get Win reg value {keyname}\\{valname}', 'debug')
+            utils.log('!!! Failed to get Win reg value %s\\%s', 'debug', keyname, valname)
         finally:
             if k: winreg.CloseKey(k)
         return res
@@ -425,9 +901,11 @@ class Sysenv:
     # -# `str` the value of the entry written to (as a string)
     # -# `int` the value type (see [winreg docs](https://docs.python.org/3/library/winreg.html#value-types))
     # `None` is returned on error (e.g. if the value doesn't exist in the registry)
+    @metrics.timed()
     def win_set_reg(self, keyname, valname, value, branch='HKEY_CURRENT_USER') -> tuple[str, int]:
         if OS != 'Windows':
             raise Exception('This method is available only on Windows platforms!')
+        metrics.incr('registry_calls')
         if isinstance(branch, str):
             branch = WIN_REG_BRANCHES[branch]
         if keyname == WIN_ENV_LOCAL_KEY and valname == WIN_DUMMY_KEYNAME:
@@ -439,7 +917,7 @@ class Sysenv:
             try:
                 val = winreg.QueryValueEx(k, valname)
             except:
-                utils.log(f'Unable to set win reg key "{keyname}\\{valname}" (value does not exist!)', 'debug')
+                utils.log('Unable to set win reg key "%s\\%s" (value does not exist!)', 'debug', keyname, valname)
                 res = None
             else:
                 if isinstance(value, str) and not val[1] in (winreg.REG_SZ, winreg.REG_EXPAND_SZ):
@@ -450,16 +928,15 @@ class Sysenv:
                         value = int(value)
                 if val[0] != value:
                     winreg.SetValueEx(k, valname, 0, val[1], value)
-                    # propagate env vars by calling setx
-                    subprocess.run('setx ttt t > nul', shell=True)
+                    self._win_broadcast_env()
                     res = winreg.QueryValueEx(k, valname) 
-                    utils.log(f'Set win reg key "{keyname}\\{valname}" = "{res[0]}"', 'debug')
+                    utils.log('Set win reg key "%s\\%s" = "%s"', 'debug', keyname, valname, res[0])
                 else:                    
                     res = val    
-                    utils.log(f'Win reg key "{keyname}\\{valname}" is already "{res[0]}", skipping reset', 'debug')
+                    utils.log('Win reg key "%s\\%s" is already "%s", skipping reset', 'debug', keyname, valname, res[0])
         except:
             traceback.print_exc()
-            utils.log(f'Error setting win reg key "{keyname}\\{valname}" = "{value}"', 'debug')
+            utils.log('Error setting win reg key "%s\\%s" = "%s"', 'debug', keyname, valname, value)
         finally:
             if k: winreg.CloseKey(k)
         return res
@@ -481,9 +958,11 @@ class Sysenv:
     # -# `str` the value of the created entry (as a string)
     # -# `int` the value type (see [winreg docs](https://docs.python.org/3/library/winreg.html#value-types))
     # `None` is returned on error (e.g. if the value already exists in the registry)
+    @metrics.timed()
     def win_create_reg(self, keyname, valname, value, valtype=None, branch='HKEY_CURRENT_USER') -> tuple[str, int]:
         if OS != 'Windows':
             raise Exception('This method is available only on Windows platforms!')
+        metrics.incr('registry_calls')
         if isinstance(branch, str):
             branch = WIN_REG_BRANCHES[branch]
         if keyname == WIN_ENV_LOCAL_KEY and valname == WIN_DUMMY_KEYNAME:
@@ -521,17 +1000,16 @@ class Sysenv:
             k = winreg.OpenKeyEx(branch, keyname, 0, winreg.KEY_ALL_ACCESS)
             try:
                 res = winreg.QueryValueEx(k, valname)
-                utils.log(f'Failed to create win reg key "{keyname}\\{valname}" (already exists!)', 'debug')
+                utils.log('Failed to create win reg key "%s\\%s" (already exists!)', 'debug', keyname, valname)
                 res = None
             except FileNotFoundError:
                 winreg.SetValueEx(k, valname, 0, valtype, value)
                 res = winreg.QueryValueEx(k, valname)
-                # propagate env vars by calling setx
-                subprocess.run('setx ttt t > nul', shell=True)
-                utils.log(f'Created win reg key "{keyname}\\{valname}" = "{res[0]}"', 'debug')
+                self._win_broadcast_env()
+                utils.log('Created win reg key "%s\\%s" = "%s"', 'debug', keyname, valname, res[0])
         except:
             traceback.print_exc()
-            utils.log(f'Error creating win reg key "{keyname}\\{valname}" = "{value}"', 'debug')
+            utils.log('Error creating win reg key "%s\\%s" = "%s"', 'debug', keyname, valname, value)
         finally:
             if k: winreg.CloseKey(k)
         return res
@@ -541,9 +1019,11 @@ class Sysenv:
     # @param valname `str` the registry value name
     # @param branch `str` the registry branch name
     # @returns `bool` success = `True`, failure = `False`
+    @metrics.timed()
     def win_del_reg(self, keyname, valname, branch='HKEY_CURRENT_USER') -> bool:
         if OS != 'Windows':
             raise Exception('This method is available only on Windows platforms!')
+        metrics.incr('registry_calls')
         if isinstance(branch, str):
             branch = WIN_REG_BRANCHES[branch]
         k = None
@@ -552,15 +1032,14 @@ class Sysenv:
             k = winreg.OpenKeyEx(branch, keyname, 0, winreg.KEY_ALL_ACCESS)
             try:
                 winreg.DeleteValue(k, valname)
-                # propagate env vars by calling setx
-                subprocess.run('setx ttt t > nul', shell=True)
-                utils.log(f'Deleted win reg key "{keyname}\\{valname}"', 'debug')
+                self._win_broadcast_env()
+                utils.log('Deleted win reg key "%s\\%s"', 'debug', keyname, valname)
             except FileNotFoundError:
-                utils.log(f'Win reg key "{keyname}\\{valname}" is not found, skipping delete', 'debug')            
+                utils.log('Win reg key "%s\\%s" is not found, skipping delete', 'debug', keyname, valname)            
             res = True
         except:
             traceback.print_exc()
-            utils.log(f'Error deleting win reg key "{keyname}\\{valname}"', 'debug')
+            utils.log('Error deleting win reg key "%s\\%s"', 'debug', keyname, valname)
         finally:
             if k: winreg.CloseKey(k)
         return res
@@ -575,9 +1054,11 @@ class Sysenv:
     # {'variable name': value}               # if with_types == False
     # {'variable name': (value, value_type)} # if with_types == True
     # ```
+    @metrics.timed()
     def win_list_reg(self, keyname, branch='HKEY_CURRENT_USER', expand_vars=True, with_types=False) -> dict:
         if OS != 'Windows':
             raise Exception('This method is available only on Windows platforms!')
+        metrics.incr('registry_calls')
         if isinstance(branch, str):
             branch = WIN_REG_BRANCHES[branch]
         res = {}
@@ -608,6 +1089,7 @@ class Sysenv:
     # Proxy settings are located in `HKCU\Software\Microsoft\Windows\CurrentVersion\Internet Settings`
     # @param valname `str` the value (setting) name, e.g. 'ProxyServer'
     # @returns `str` the retreived value or `None` on failure
+    @metrics.timed()
     def win_get_reg_proxy(self, valname) -> str:
         res = self.win_get_reg(WIN_PROXY_KEY, valname)
         return res[0] if res else None
@@ -617,6 +1099,7 @@ class Sysenv:
     # @param valname `str` the value (setting) name, e.g. 'ProxyServer'
     # @param value `str` the value to set
     # @returns `str` the newly set value or `None` on failure
+    @metrics.timed()
     def win_set_reg_proxy(self, valname, value) -> str:
         res = self.win_set_reg(WIN_PROXY_KEY, valname, value)
         if res is None:
@@ -631,6 +1114,7 @@ class Sysenv:
     #    'system': {'http_proxy': value, 'https_proxy': value, ...}
     # }
     # ```
+    @metrics.timed()
     def list_sys_envs_proxy(self) -> dict:
         proxies = [item for sublist in [[p.lower(), p.upper()] for p in ('http_proxy', 'https_proxy', 'ftp_proxy', 'rsync_proxy', 'no_proxy')] for item in sublist]
         return {'user': {k: v for k, v in self.locals if k in proxies},
@@ -643,6 +1127,7 @@ class Sysenv:
     # ```python
     # {'user': value or None, 'system': value or None}
     # ```
+    @metrics.timed()
     def get_sys_env(self, envname, default=None) -> dict:
         return {'user': self.get_env(envname, False, ('user',), default),
                 'system': self.get_env(envname, False, ('system',), default)}
@@ -656,13 +1141,14 @@ class Sysenv:
     # to indicate the domain(s) where the variable must be persisted
     # @param update_vars `bool` whether to repopulate the variables after this operation
     # @returns `bool` success = `True`, failure = `False`
+    @metrics.timed()
     def set_sys_env(self, envname, value, create=True, valtype=None, modes=('user',), update_vars=True) -> bool:
-        if ('system' in modes) and (not CURRENT_USER[1]):
+        if ('system' in modes) and (not self.can_write_system()):
             raise Exception('Cannot execute command: SU privilege asked!')
         
         env = self.get_sys_env(envname)
         if ('user' in modes and env['user'] == value) or ('system' in modes and env['system'] == value):
-            utils.log(f'System env "{envname}" is already "{value}", skipping reset', 'debug')
+            utils.log('System env "%s" is already "%s", skipping reset', 'debug', envname, value)
             return True
 
         res = False
@@ -694,14 +1180,14 @@ class Sysenv:
             else:
                 res = None
         
-        if res and isinstance(value, str):
+        if res and isinstance(value, str) and not self.is_target:
             for e_ in {envname, envname.lower(), envname.upper()}:
                 os.environ[e_] = value
         
         if update_vars: 
             self.update_vars()
         if res:    
-            utils.log(f'Set system env "{envname}" = "{value}"', 'debug')
+            utils.log('Set system env "%s" = "%s"', 'debug', envname, value)
         return res
 
     ## Deletes (unsets) an environment variable.
@@ -710,12 +1196,13 @@ class Sysenv:
     # to indicate the domain(s) where the variable must be deleted from
     # @param update_vars `bool` whether to repopulate the variables after this operation
     # @returns `bool` success = `True`, failure = `False`
+    @metrics.timed()
     def unset_sys_env(self, envname: str, modes=('user',), update_vars=True) -> bool:
-        if ('system' in modes) and (not CURRENT_USER[1]):
+        if ('system' in modes) and (not self.can_write_system()):
             raise Exception('Cannot execute command: SU privilege asked!')
         env = self.get_sys_env(envname)
         if ('user' in modes and not env['user']) or ('system' in modes and not env['system']):
-            utils.log(f'System env "{envname}" does not exist, skipping unset', 'debug')
+            utils.log('System env "%s" does not exist, skipping unset', 'debug', envname)
             return True
         res = False
         if OS == 'Windows':            
@@ -733,13 +1220,194 @@ class Sysenv:
         else:
             res = self.unix_del_env(envname)
 
-        if res:
+        if res and not self.is_target:
             for e_ in {envname, envname.lower(), envname.upper()}:
                 if e_ in os.environ:
                     os.environ.pop(e_, None)
 
         if update_vars: self.update_vars()
-        utils.log(f'Delete system env "{envname}"', 'debug')
+        utils.log('Delete system env "%s"', 'debug', envname)
+        return res
+
+    ## Removes the exports of the given variables from a Unix file's text.
+    # @param text `str` the file contents
+    # @param envnames `iterable` variable names (matched case-insensitively)
+    # @param plain `bool` whether to remove plain `NAME=...` lines too (the PAM env file)
+    # @returns `str` the text without the matching `export NAME=...` lines
+    @staticmethod
+    def _unix_strip_exports(text, envnames, plain=False):
+        if not envnames:
+            return text
+        names = '|'.join(re.escape(e_) for e_ in envnames)
+        pattern = rf'export\s+(?:{names})(?![\w])'
+        if plain:
+            pattern = rf'{pattern}|^\s*(?:{names})='
+        reg = re.compile(pattern, re.I)
+        return ''.join(line for line in text.splitlines(True) if not reg.search(line))
+
+    ## Applies a batch of Unix env changes rewriting each affected profile file once.
+    # @param final `dict` final state per lower-case variable name: the value to set
+    # or `None` to unset
+    # @returns `bool` success = `True`, failure = `False`
+    def _unix_apply_batch(self, final: dict) -> bool:
+        # with the privileged helper, the system files are rewritten by the helper process
+        helper = self.uses_privhelper()
+        admin = self.can_write_system() and not helper
+        appends = ''.join(f'{utils.NL}export {e_}="{v}"' for k, v in final.items() 
+                          if not v is None for e_ in (k.lower(), k.upper()))
+        file_list = self.user_files()
+        if admin:
+            file_list += self.system_files()
+        append_to = [self.unix_file_local] if self.unix_file_local else []
+        if admin:
+            append_to.append(self.unix_file_system)
+        res = True
+        for fname in dict.fromkeys(file_list + append_to):
+            try:
+                append = appends if fname in append_to else ''
+                if not filetx.update(fname, lambda txt: self._unix_strip_exports(txt, final.keys(), is_pam_env_file(fname)) + append,
+                                     create=bool(append)):
+                    continue
+                utils.log('Applied %d env change(s) to file "%s"', 'debug', len(final), fname)
+            except:
+                traceback.print_exc()
+                res = False
+        if helper:
+            res = self._privhelper_apply(final) and res
+        return res
+
+    ## Applies a batch of env variable changes in a single transaction.
+    # The result is the same as calling Sysenv::set_sys_env() / Sysenv::unset_sys_env()
+    # for each change in turn, but:
+    # - on Unix, each affected profile file is read and rewritten only once
+    # - on Windows, the env change broadcast (`setx`) is run only once at the end
+    # - the variables are repopulated (if `update_vars` is `True`) only once
+    # @param changes `iterable` sysproxy::Envchange objects (applied in order; for
+    # repeated variables the last change wins)
+    # @param update_vars `bool` whether to repopulate the variables after this operation
+    # @returns `bool` success = `True`, failure = `False`
+    @metrics.traced()
+    def apply_changes(self, changes, update_vars=True) -> bool:
+        changes = list(changes)
+        if not changes:
+            return True
+        if any('system' in c.modes for c in changes) and not self.can_write_system():
+            raise Exception('Cannot execute command: SU privilege asked!')
+
+        res = True
+        if OS == 'Windows':
+            self._defer_broadcast = True
+            self._broadcast_pending = False
+            try:
+                for c in changes:
+                    if c.action == 'unset':
+                        ok = self.unset_sys_env(c.envname, c.modes, False)
+                    else:
+                        ok = self.set_sys_env(c.envname, c.value, c.action == 'create', c.valtype, c.modes, False)
+                    res = res and bool(ok)
+            finally:
+                self._defer_broadcast = False
+                if self._broadcast_pending:
+                    self._win_broadcast_env()
+        else:
+            # final state per variable (last change wins), skipping no-ops
+            final = {}
+            for c in changes:
+                name = c.envname.lower()
+                # current value, taking the previous changes in this batch into account
+                cur = final[name] if name in final else self.get_env(c.envname, False, ('user',))
+                if c.action == 'unset':
+                    if cur is None and not name in final:
+                        continue
+                    final[name] = None
+                else:
+                    if cur is None and c.action != 'create':
+                        continue
+                    if cur == c.value and not name in final:
+                        continue
+                    final[name] = str(c.value)
+            if final:
+                res = self._unix_apply_batch(final)
+                if res and not self.is_target:
+                    for name, value in final.items():
+                        for e_ in (name, name.upper()):
+                            if value is None:
+                                os.environ.pop(e_, None)
+                            else:
+                                os.environ[e_] = value
+
+        if update_vars:
+            self.update_vars()
+        utils.log('Applied %d env change(s)', 'debug', len(changes))
+        return res
+
+    ## Simulates the proxy variables that new login shells will get from the startup files
+    # (see loginenv module), e.g. to check the result of an apply: unlike Sysenv::locals,
+    # this is not the environment of the current process.
+    # @param shells `iterable` shells to simulate (see loginenv::SHELLS; default = the user's shell)
+    # @returns `dict` `{shell: {name: value}}` (empty on Windows)
+    @metrics.timed()
+    def login_envs(self, shells=None) -> dict:
+        if OS == 'Windows':
+            return {}
+        import loginenv
+        home = self.home or (os.path.join(self.root, 'root') if self.root else None)
+        return loginenv.effective_proxies(home, self.root, shells or (loginenv.shell_name(),))
+
+    ## Computes a hierarchical hash fingerprint of the proxy-relevant state (see fingerprint module).
+    # The tree is: domain -> location -> variable (any case of sysproxy::PROXY_ENV_NAMES), where:
+    # - on Unix, the `user` and `system` domains hold the profile files by their generic names
+    # (e.g. '~/.bashrc', '/etc/environment', so that different homes and roots are comparable)
+    # and the `env` domain holds the current process environment (`environ`, not in target mode)
+    # - on Windows, the `user` and `system` domains hold the `registry` env variables and
+    # `user` also holds the `internet_settings` proxy values
+    # @returns `fingerprint::Node` the fingerprint
+    @metrics.timed()
+    def fingerprint(self) -> fingerprint.Node:
+        is_proxy = lambda name: name.lower() in PROXY_ENV_NAMES
+        tree = {}
+        if OS == 'Windows':
+            tree['user'] = {'registry': {k: v for k, v in self.locals.items() if is_proxy(k)},
+                            'internet_settings': {v: self.win_get_reg_proxy(v) for v in ('ProxyEnable', 'ProxyServer', 'ProxyOverride')}}
+            tree['system'] = {'registry': {k: v for k, v in self.globals.items() if is_proxy(k)}}
+            return fingerprint.build(tree)
+        for domain, names, paths in (('user', UNIX_PROFILE_FILES_USR, self.user_files()),
+                                     ('system', UNIX_PROFILE_FILES_SYS, self.system_files())):
+            files = {}
+            for name, path in zip(names, paths):
+                if not os.path.isfile(path): continue
+                with open(path, 'r', encoding=utils.CODING, errors='replace') as f_:
+                    txt = f_.read()
+                metrics.file_read(len(txt))
+                envs = {env: val for _, env, val in parse_profile(txt, path) if is_proxy(env)}
+                if envs:
+                    files[name.strip()] = envs
+            tree[domain] = files
+        if not self.is_target:
+            tree['env'] = {'environ': {k: v for k, v in self.locals.items() if is_proxy(k)}}
+        return fingerprint.build(tree)
+
+    ## Takes over variable changes made outside the app (see watcher module) without
+    # writing anything: updates Sysenv::locals (and the current process environment,
+    # unless in target mode).
+    # @param changes `iterable` sysproxy::Envchange objects ('unset' or 'create' / 'set')
+    # @returns `list` names of the variables that have actually changed
+    def apply_external(self, changes) -> list:
+        res = []
+        for c in changes:
+            value = None if c.action == 'unset' else str(c.value)
+            if self.locals.get(c.envname) == value:
+                continue
+            if value is None:
+                self.locals.pop(c.envname, None)
+            else:
+                self.locals[c.envname] = value
+            if not self.is_target and OS != 'Windows':
+                if value is None:
+                    os.environ.pop(c.envname, None)
+                else:
+                    os.environ[c.envname] = value
+            res.append(c.envname)
         return res
 
     ## @brief Gets the current HTTP proxy setting from the system.
@@ -749,6 +1417,7 @@ class Sysenv:
     # ```python
     # {'user': value or None, 'system': value or None}
     # ``` 
+    @metrics.timed()
     def get_sys_http_proxy(self) -> dict:
         env1 = self.get_sys_env('all_proxy')
         env2 = self.get_sys_env('http_proxy')
@@ -777,6 +1446,7 @@ class Sysenv:
         return env
 
     ## @returns `True` if system proxy is enabled and `False` otherwise
+    @metrics.timed()
     def get_sys_proxy_enabled(self) -> bool:
         if OS == 'Windows':
             res = self.win_get_reg_proxy('ProxyEnable')
@@ -788,12 +1458,13 @@ class Sysenv:
 
     ## @returns `sysproxy::Noproxy` the current proxy bypass configuration or `None`
     # if not present.
+    @metrics.timed()
     def get_sys_noproxy(self) -> Noproxy:
         if OS == 'Windows':
             res = self.win_get_reg_proxy('ProxyOverride')
-            return None if res is None else Noproxy(None, res)
+            return None if res is None else Noproxy(res)
         res = self.get_sys_env('no_proxy')
-        return None if res is None else Noproxy(None, res['user'] or res['system'] or '')
+        return None if res is None else Noproxy(res['user'] or res['system'] or '')
 
     ## Gets the value of a proxy setting as a `sysproxy::Proxyconf` object.
     # @param proxy `str` the proxy type (protocol) to get:
@@ -801,28 +1472,19 @@ class Sysenv:
     # - `https_proxy`: the HTTPS proxy
     # - `ftp_proxy`: the FTP proxy
     # - `rsync_proxy`: the RSYNC proxy
-    ## @returns `sysproxy::Proxyconf` the parsed proxy configuration or `None` if not present.
+    ## @returns `sysproxy::Proxyconf` the parsed proxy configuration or `None` if not present
+    # or invalid (see parse_proxy()).
+    @metrics.timed()
     def get_sys_proxy_parsed(self, proxy='http_proxy') -> Proxyconf:
         _proxy = self.get_sys_http_proxy() if proxy == 'http_proxy' else self.get_sys_env(proxy)
         if (_proxy is None) or not (_proxy['user'] or _proxy['system']): 
             return None
         # prefer user (local) proxy config over system
-        _proxy = _proxy['user'] or _proxy['system']
-        spl = _proxy.split('://')
-        prot = spl[0].lower() if len(spl) > 1 else 'http'
-        other = spl[1] if len(spl) > 1 else _proxy
-        spl1 = other.split('@')
-        if len(spl1) > 1:
-            spl11 = spl1[0].split(':')
-            uname = spl11[0]
-            passw = spl11[1] if len(spl11) > 1 else None
-        else:
-            uname, passw = (None, None)
-        other2 = spl1[1] if len(spl1) > 1 else other
-        spl2 = other2.split(':')
-        host = spl2[0]
-        port = int(spl2[1]) if len(spl2) > 1 else None
-        return Proxyconf(None, prot, host or '', port or 3128, not uname is None, uname or '', passw or '')
+        try:
+            return parse_proxy(_proxy['user'] or _proxy['system'])
+        except ProxyParseError as err:
+            utils.log('Ignoring "%s": %s', 'error', proxy, err)
+            return None
 
 # --------------------------------------------------------------- #
 
@@ -835,8 +1497,10 @@ class Sysenv:
 # - `Proxy::rsync_proxy`
 #
 # Each of these has the type sysproxy::Proxyconf, so their internal attributes like
-# host, port etc. can be accesssed directly, e.g. to set a new port for the HTTP
-# proxy: `proxyobj.http_proxy.port = 3000`
+# host, port etc. can be read directly. The config objects are immutable: to change
+# an attribute, assign a modified copy, e.g. to set a new port for the HTTP
+# proxy: `proxyobj.http_proxy = proxyobj.http_proxy.replace(port=3000)`
+# (or `proxyobj.update_proxy('http_proxy', port=3000)`)
 #
 # It also exposes the property `Proxy::noproxy` to manipulate the proxy bypasses
 # (most commonly, the localhost). Its `Proxy::enabled` property lets one enable or
@@ -851,23 +1515,60 @@ class Proxy:
 
     ## @param storage_file `str` default settings file that can be used to read and store
     # the proxy settings
-    def __init__(self, storage_file='proxy_config.json'):
+    # @param sysenv `sysproxy::Sysenv` the object to operate the env variables, e.g.
+    # one targeting another home or root (default = a new object for the current session)
+    def __init__(self, storage_file='proxy_config.json', sysenv=None):
         ## `str` default settings file that can be used to read and store the proxy settings 
         self.storage_file = utils.make_abspath(storage_file) if not os.path.isabs(storage_file) else storage_file
         ## `sysproxy::Sysenv` object to operate proxy-related environment variables
-        self.sysenv = Sysenv(True)
+        self.sysenv = sysenv or Sysenv(True)
         ## `bool` update mode counter
         self._isupdating = 0
+        ## `int` settings version: incremented on every change of the settings
+        self._version = 0
+        ## `tuple` memoized Proxy::asdict() result as `(version, dict)`
+        self._dict_cache = None
         self.read_system()
         self.save()
 
-    ## @returns `dict` proxy settings serialized as a Python dictionary
+    ## @returns `int` the settings version (incremented on every change of the settings):
+    # two equal versions of the same object mean the settings have not changed
+    @property
+    def version(self) -> int:
+        return self._version
+
+    ## Increments the settings version (Proxy::version) and drops the memoized Proxy::asdict() result.
+    def _touch(self):
+        self._version += 1
+        self._dict_cache = None
+
+    ## @returns `dict` proxy settings serialized as a Python dictionary.
+    # The result is memoized until the settings change (see Proxy::version) and is shared
+    # between callers, so it must not be modified: use `copy.deepcopy()` to get an editable copy.
     def asdict(self) -> dict:
-        d = {'enabled': self.enabled, 'noproxy': str(self.noproxy)}
-        for attr in ('http_proxy', 'https_proxy', 'ftp_proxy', 'rsync_proxy'):
-            prop = getattr(self, attr, None)
-            d[attr] = prop.asdict() if prop else None
-        return d
+        cache = self._dict_cache
+        if cache is None or cache[0] != self._version:
+            # the version is read first: if the settings change (in another thread) while
+            # the dict is built, the dict is cached under the old version and is rebuilt on the next call
+            version = self._version
+            d = {'enabled': self.enabled, 'noproxy': str(self.noproxy)}
+            for attr in ('http_proxy', 'https_proxy', 'ftp_proxy', 'rsync_proxy'):
+                prop = getattr(self, attr, None)
+                d[attr] = prop.asdict() if prop else None
+            cache = (version, d)
+            self._dict_cache = cache
+        return cache[1]
+
+    ## Computes a hierarchical hash fingerprint of the proxy settings and the underlying
+    # env variables (see fingerprint module): the `settings` branch holds the fields of
+    # Proxy::asdict() except the credentials (see fingerprint::CREDENTIAL_FIELDS);
+    # the other branches are those of Sysenv::fingerprint().
+    # @returns `fingerprint::Node` the fingerprint
+    @metrics.timed()
+    def fingerprint(self) -> fingerprint.Node:
+        settings = {k: {f: v for f, v in val.items() if not f in fingerprint.CREDENTIAL_FIELDS} if isinstance(val, dict) else val
+                    for k, val in self.asdict().items()}
+        return fingerprint.Node.branch(dict(self.sysenv.fingerprint().children, settings=fingerprint.build(settings)))
 
     ## @returns `str` proxy settings serialized as a string (in JSON format)
     def asstr(self) -> str:
@@ -875,31 +1576,46 @@ class Proxy:
 
     ## @brief Sets member properties reading from a Python dictionary.
     # The dictionary may have been produced by a previous call to Proxy::asdict().
-    def fromdict(self, dconfig: dict):
+    # @param dconfig `dict` the proxy settings
+    # @param check_cancel `callable` optional function without args called at safe points
+    # (between the individual settings); it may raise an exception to abort the operation,
+    # in which case the settings applied so far are kept and the exception is propagated
+    @profiling.profiled()
+    @metrics.traced()
+    def fromdict(self, dconfig: dict, check_cancel=None):
         if self.asdict() == dconfig:
             return
         self.begin_updates()
-        for attr in ('http_proxy', 'https_proxy', 'ftp_proxy', 'rsync_proxy'):
-            obj = dconfig.get(attr, None)
-            if not obj is None:
-                obj = Proxyconf(self._on_setattr, obj.get('protocol', 'http'), obj.get('host', ''),
-                                obj.get('port', 3128), obj.get('auth', False), 
-                                obj.get('uname', ''), obj.get('password', ''))
-            setattr(self, attr, obj)
-        ## `sysproxy::Noproxy` proxy bypass configuration object
-        self.noproxy = Noproxy(self._on_setattr, dconfig['noproxy']) if dconfig.get('noproxy', None) else None
-        ## `bool` property to get and set the enabled status of the system proxy
-        self.enabled = dconfig.get('enabled', self.enabled)
-        self.end_updates()
+        try:
+            for attr in ('http_proxy', 'https_proxy', 'ftp_proxy', 'rsync_proxy'):
+                if check_cancel: check_cancel()
+                obj = dconfig.get(attr, None)
+                if not obj is None:
+                    obj = Proxyconf(obj.get('protocol', 'http'), obj.get('host', ''),
+                                    obj.get('port', 3128), obj.get('auth', False), 
+                                    obj.get('uname', ''), obj.get('password', ''))
+                setattr(self, attr, obj)
+            if check_cancel: check_cancel()
+            ## `sysproxy::Noproxy` proxy bypass configuration object
+            self.noproxy = Noproxy(dconfig['noproxy']) if dconfig.get('noproxy', None) else None
+            if check_cancel: check_cancel()
+            ## `bool` property to get and set the enabled status of the system proxy
+            self.enabled = dconfig.get('enabled', self.enabled)
+        finally:
+            self.end_updates()
+        self.update_env_cache()
 
     ## @brief Sets member properties reading from a JSON-formatted string.
     # The string may have been produced by a previous call to Proxy::asstr().
+    @metrics.timed()
     def fromstr(self, strconfig: str):
         self.fromdict(json.loads(strconfig))
 
     ## Increments the update mode counter (Proxy::_isupdating) to show that a new
     # update operation is under way.
     def begin_updates(self):
+        if self._isupdating == 0:
+            self.sysenv.begin_system_batch()
         self._isupdating += 1
 
     ## Decrements the update mode counter (Proxy::_isupdating) and updates the 
@@ -909,14 +1625,12 @@ class Proxy:
             return
         self._isupdating -= 1
         if self._isupdating == 0:
+            self.sysenv.end_system_batch()
             self.sysenv.update_vars()
 
     ## @returns `sysproxy::Noproxy` the system no-proxy (proxy bypass) configuration
     def _get_sys_noproxy(self):
-        noproxy = self.sysenv.get_sys_noproxy()
-        if noproxy:
-            noproxy.on_setattr = self._on_setattr
-        return noproxy
+        return self.sysenv.get_sys_noproxy()
 
     ## Gets the system settings for a specific proxy.
     # @param proxystr `str` the proxy type to get the config for (e.g. 'http_proxy')
@@ -924,12 +1638,11 @@ class Proxy:
     # If no proxy setting exists, `None` is returned.
     # @see sysproxy::Sysenv::get_sys_proxy_parsed().
     def _get_sys_proxy(self, proxystr):
-        proxy = self.sysenv.get_sys_proxy_parsed(proxystr)
-        if proxy:
-            proxy.on_setattr = self._on_setattr
-        return proxy
+        return self.sysenv.get_sys_proxy_parsed(proxystr)
 
     ## Initializes the member properties from the current system proxy settings.
+    @profiling.profiled()
+    @metrics.timed()
     def read_system(self):
         ## `bool` current proxy enabled status
         self._enabled = self.sysenv.get_sys_proxy_enabled()
@@ -943,9 +1656,46 @@ class Proxy:
         self._ftp_proxy = self._get_sys_proxy('ftp_proxy')
         ## `sysproxy::Proxyconf` RSYNC proxy object (or `None` if not set)
         self._rsync_proxy = self._get_sys_proxy('rsync_proxy')
-        utils.log(f'SYSTEM SETTINGS: {str(self)}', 'debug')
+        self._touch()
+        utils.log('SYSTEM SETTINGS: %s', 'debug', self)
+
+    ## Takes over variable changes made outside the app (see watcher module): only the
+    # settings depending on the changed variables are read again; nothing is written.
+    # @param changes `iterable` sysproxy::Envchange objects
+    # @returns `bool` whether the settings have changed
+    @metrics.timed()
+    def apply_external(self, changes) -> bool:
+        names = {name.lower() for name in self.sysenv.apply_external(changes)}
+        if not names:
+            return False
+        old = self.asdict()
+        if names & {'http_proxy', 'all_proxy'}:
+            self._enabled = self.sysenv.get_sys_proxy_enabled()
+        for attr in PROXY_TYPES:
+            if attr in names or (attr == 'http_proxy' and 'all_proxy' in names):
+                setattr(self, f'_{attr}', self._get_sys_proxy(attr))
+        if 'no_proxy' in names:
+            self._noproxy = self._get_sys_noproxy()
+        self._touch()
+        return self.asdict() != old
+
+    ## Rewrites the shell env cache files (see envcache module) from the current
+    # settings if the cache is enabled in the app config (`envcache` option)
+    # and the settings are those of the current session (not of a target home or root).
+    # @returns `list` paths of the cache files actually rewritten
+    @metrics.timed()
+    def update_env_cache(self) -> list:
+        if self.sysenv.is_target or not utils.get_envcache():
+            return []
+        import envcache
+        try:
+            return envcache.write_cache(proxy_envs(self.asdict(), False))
+        except OSError:
+            traceback.print_exc()
+            return []
 
     ## Stores the current proxy settings in a JSON file.
+    @metrics.timed()
     def store_config(self, config_file=None):
         if not config_file:
             config_file = self.storage_file
@@ -955,6 +1705,7 @@ class Proxy:
             json.dump(self.asdict(), f_, indent=4)
 
     ## Reads proxy settings from a JSON file and applies them.
+    @metrics.timed()
     def read_config(self, config_file=None):
         if not config_file:
             config_file = self.storage_file
@@ -967,31 +1718,6 @@ class Proxy:
             d = json.load(f_)
             self.fromdict(d)
 
-    ## Hook callback method to monitor setting proxy attributes and make corresponding
-    # changes in the system (writing the env variables).
-    def _on_setattr(self, obj, name, value):
-        if isinstance(obj, Noproxy):
-            if OS == 'Windows':
-                self.sysenv.win_set_reg_proxy('ProxyOverride', obj.asstr(True))
-            if obj:
-                self.sysenv.set_sys_env('no_proxy', obj.asstr(False), update_vars=not self._isupdating)
-            else:
-                self.sysenv.unset_sys_env('no_proxy', update_vars=not self._isupdating)
-        elif isinstance(obj, Proxyconf):
-            if obj is self._http_proxy:
-                proxy = 'http_proxy'
-            elif obj is self._https_proxy:
-                proxy = 'https_proxy'
-            elif obj is self._ftp_proxy:
-                proxy = 'ftp_proxy'
-            elif obj is self._rsync_proxy:
-                proxy = 'rsync_proxy'
-            else:
-                return
-            if proxy == 'http_proxy' and OS == 'Windows':
-                self.sysenv.win_set_reg_proxy('ProxyServer', f'{obj.host}:{obj.port}')
-            self.sysenv.set_sys_env(proxy, str(obj), update_vars=not self._isupdating)
-
     ## Getter for Proxy::_enabled.
     @property
     def enabled(self):
@@ -1001,6 +1727,7 @@ class Proxy:
 
     ## Setter for Proxy::_enabled: enables or disables the system proxy.
     @enabled.setter
+    @metrics.timed('Proxy.enabled.setter')
     def enabled(self, is_enabled) -> bool:
         if is_enabled == self._enabled:
             return
@@ -1018,6 +1745,7 @@ class Proxy:
         if not self._isupdating:
             self.sysenv.update_vars()
         self._enabled = is_enabled
+        self._touch()
 
     ## Getter for Proxy::_noproxy.
     @property
@@ -1028,6 +1756,7 @@ class Proxy:
 
     ## Setter for Proxy::_noproxy: sets or unsets the proxy bypass addresses.
     @noproxy.setter
+    @metrics.timed('Proxy.noproxy.setter')
     def noproxy(self, value: Noproxy):
         if self._noproxy == value:
             return
@@ -1038,6 +1767,7 @@ class Proxy:
         elif value.noproxies:
             self.sysenv.set_sys_env('no_proxy', value.asstr(False), update_vars=not self._isupdating)
         self._noproxy = value
+        self._touch()
 
     ## Getter for Proxy::_http_proxy.
     @property
@@ -1048,6 +1778,7 @@ class Proxy:
 
     ## Setter for Proxy::_http_proxy.
     @http_proxy.setter
+    @metrics.timed('Proxy.http_proxy.setter')
     def http_proxy(self, value: Proxyconf):
         if self._http_proxy == value:
             return
@@ -1061,11 +1792,12 @@ class Proxy:
         else:
             self.sysenv.set_sys_env('http_proxy', str(value), update_vars=False)
             if OS == 'Windows':
-                self.sysenv.win_set_reg_proxy('ProxyServer', f'{value.host}:{value.port}')
+                self.sysenv.win_set_reg_proxy('ProxyServer', value.hostport)
         
         if not self._isupdating:
             self.sysenv.update_vars()
         self._http_proxy = value
+        self._touch()
 
     ## Getter for Proxy::_https_proxy.
     @property
@@ -1076,6 +1808,7 @@ class Proxy:
 
     ## Setter for Proxy::_https_proxy.
     @https_proxy.setter
+    @metrics.timed('Proxy.https_proxy.setter')
     def https_proxy(self, value: Proxyconf):
         if self._https_proxy == value:
             return
@@ -1084,6 +1817,7 @@ class Proxy:
         else:
             self.sysenv.set_sys_env('https_proxy', str(value), update_vars=not self._isupdating)
         self._https_proxy = value
+        self._touch()
 
     ## Getter for Proxy::_ftp_proxy.
     @property
@@ -1094,6 +1828,7 @@ class Proxy:
 
     ## Setter for Proxy::_ftp_proxy.
     @ftp_proxy.setter
+    @metrics.timed('Proxy.ftp_proxy.setter')
     def ftp_proxy(self, value: Proxyconf):
         if self._ftp_proxy == value:
             return
@@ -1102,6 +1837,7 @@ class Proxy:
         else:
             self.sysenv.set_sys_env('ftp_proxy', str(value), update_vars=not self._isupdating)
         self._ftp_proxy = value
+        self._touch()
 
     ## Getter for Proxy::_rsync_proxy.
     @property
@@ -1112,6 +1848,7 @@ class Proxy:
 
     ## Setter for Proxy::_rsync_proxy.
     @rsync_proxy.setter
+    @metrics.timed('Proxy.rsync_proxy.setter')
     def rsync_proxy(self, value: Proxyconf):
         if self._rsync_proxy == value:
             return
@@ -1120,6 +1857,7 @@ class Proxy:
         else:
             self.sysenv.set_sys_env('rsync_proxy', str(value), update_vars=not self._isupdating)
         self._rsync_proxy = value
+        self._touch()
 
     ## Returns a proxy object by its short name, e.g. 'http' -> `self.http_proxy`.
     # @param proxy `str` alias for the proxy, e.g. 'http', 'https', 'ftp' or 'rsync'
@@ -1134,10 +1872,23 @@ class Proxy:
         if proxy == 'rsync':
             return self.rsync_proxy
 
+    ## Changes some attributes of a proxy (the config objects are immutable,
+    # so a modified copy is assigned to the proxy property).
+    # @param proxy `str` the proxy property name, e.g. 'http_proxy' or 'noproxy'
+    # @param changes `kwargs` the new attribute values, e.g. `port=3000`
+    # @exception `ValueError` the proxy is not set
+    @metrics.timed()
+    def update_proxy(self, proxy='http_proxy', **changes):
+        obj = getattr(self, proxy)
+        if obj is None:
+            raise ValueError(f'Proxy "{proxy}" is not set')
+        setattr(self, proxy, obj.replace(**changes))
+
     ## Applies the settings from one proxy object to all the others.
     # @param source `str` alias of the source proxy object, e.g. 'http'
     # @param targets `list of str` aliases of the target proxy objects;
     # if `None` or empty, all the *other* proxies are used.
+    @metrics.timed()
     def copy_from(self, source='http', targets=['https', 'ftp', 'rsync']):
         src = self.proxy_by_name(source)
         if not src: return
@@ -1163,12 +1914,15 @@ class Proxy:
 
     ## Saves the current proxy config to a dictonary as backup.
     # @see Proxy::restore()
+    @metrics.timed()
     def save(self):
         ## `dict` backup proxy settings as a dictionary
         self.stored = self.asdict()
 
     ## Restores the proxy settings from the backup.
     # @see Proxy::save()
+    @profiling.profiled()
+    @metrics.timed()
     def restore(self):
         if getattr(self, 'stored', None):
             self.fromdict(self.stored)
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+# Test setup: the app modules are imported from the project dir; the log goes
+# to the in-memory buffer only (no log file, no console output).
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('USER', 'tester')
+
+import utils
+
+utils.get_config()['app']['logfile'] = ''
+utils.get_config()['app']['debug'] = 'false'
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import os, socket, threading
+
+import pytest
+
+import daemon
+import sysproxy
+
+pytestmark = pytest.mark.skipif(sysproxy.OS == 'Windows', reason='Unix only')
+
+def make_config(host='proxy', port=3128, noproxy='localhost'):
+    proxy = {'protocol': 'http', 'host': host, 'port': port, 'auth': False, 'uname': '', 'password': ''}
+    return {'enabled': True, 'noproxy': noproxy, 'http_proxy': proxy,
+            'https_proxy': None, 'ftp_proxy': None, 'rsync_proxy': None}
+
+@pytest.fixture
+def server(tmp_path):
+    sysenv = sysproxy.Sysenv(False, home=str(tmp_path))
+    srv = daemon.Server(str(tmp_path / 'proxen.sock'), sysproxy.Proxy(str(tmp_path / 'proxy.json'), sysenv), watch=False)
+    yield srv
+    srv.close()
+
+def read_exports(server):
+    with open(server.proxy.sysenv.unix_file_local, encoding='utf-8') as f_:
+        return [(name, value) for _, name, value in sysproxy.parse_exports(f_.read())]
+
+def test_ping_and_get(server):
+    with server.local_client() as client:
+        assert client.call('ping')['pid'] == os.getpid()
+        res = client.get()
+        assert res['state'] == server.proxy.asdict()
+        assert res['version'] == server.proxy.version
+
+def test_apply_and_restore(server):
+    initial = server.proxy.asdict()
+    with server.local_client() as client:
+        res = client.apply(make_config(port=8080))
+        assert res['state']['http_proxy']['port'] == 8080
+        assert ('http_proxy', 'http://proxy:8080') in read_exports(server)
+        res = client.restore()
+        assert res['state'] == initial
+        assert not any(name.lower() == 'http_proxy' for name, _ in read_exports(server))
+
+def test_subscribe_gets_changes(server):
+    with server.local_client() as subscriber, server.local_client() as client:
+        subscriber.subscribe()
+        client.apply(make_config(port=8081))
+        # the event is queued before the response to a later request
+        subscriber.call('ping')
+        event = next(subscriber.events())
+        assert event['event'] == 'changed' and event['source'] == 'apply'
+        assert event['state']['http_proxy']['port'] == 8081
+        assert client.call('stats')['subscribers'] == 1
+
+def test_error_responses(server):
+    with server.local_client() as client:
+        with pytest.raises(daemon.DaemonError, match='Unknown method'):
+            client.call('nosuchmethod')
+        with pytest.raises(daemon.DaemonError, match='config'):
+            client.call('apply', config='http://proxy:3128')
+        version = server.proxy.version
+        with pytest.raises(daemon.DaemonError, match='http_proxy'):
+            client.apply(dict(make_config(), http_proxy='http://proxy:3128'))
+        with pytest.raises(daemon.DaemonError, match='port'):
+            client.apply(make_config(port='3128'))
+        # nothing has been applied
+        assert server.proxy.version == version
+        client.sock.sendall(b'not json\n')
+        assert client._read() == {'id': None, 'error': 'Invalid JSON request'}
+        # the connection still works
+        assert client.call('ping')['pid'] == os.getpid()
+
+def test_concurrent_clients_are_serialized(server):
+    errors = []
+
+    def worker(n):
+        try:
+            with server.local_client() as client:
+                for i in range(5):
+                    config = make_config(f'proxy{n}', 9000 + i)
+                    # the state returned by apply is the applied config: no interleaving
+                    assert client.apply(config)['state'] == config
+        except Exception as err:
+            errors.append(err)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(6)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join(60)
+    assert not errors
+    exports = [(name, value) for name, value in read_exports(server) if name.lower() == 'http_proxy']
+    assert len(exports) == 2 and exports[0][1] == exports[1][1]
+    assert exports[0][1] == server.proxy.http_proxy.proxystr
+
+def test_stalled_subscriber_is_dropped(server):
+    noproxy = ','.join(f'host{i}.example.com' for i in range(3000))
+    with server.local_client() as stalled, server.local_client(5) as client:
+        stalled.subscribe()
+        # the stalled subscriber never reads its events
+        for i in range(daemon.MAX_QUEUED + 10):
+            client.apply(make_config(port=1000 + i, noproxy=f'{noproxy},{i}'))
+        stats = client.call('stats')
+        assert stats['subscribers'] == 0
+        with server.local_client(5) as other:
+            assert other.call('ping')['pid'] == os.getpid()
+
+def test_long_message_is_rejected_unbuffered(server, monkeypatch):
+    monkeypatch.setattr(daemon, 'MAX_MESSAGE', 1000)
+    with server.local_client() as client:
+        # no newline: the daemon must not wait for the end of the line
+        client.sock.sendall(b'{"id": 1, "method": "ping", "params": {"x": "' + b'x' * 5000)
+        assert client._read() == {'id': None, 'error': 'Message too long'}
+        with pytest.raises(daemon.DaemonError, match='closed'):
+            client._read()
+
+@pytest.mark.parametrize('data', [b'not json\n', b'{"id": 1, "res\n', b'[1, 2]\n', b'{"id": 1'])
+def test_client_rejects_malformed_responses(data):
+    server_end, client_end = socket.socketpair()
+    with server_end, daemon.Client(client_end, 5) as client:
+        server_end.sendall(data)
+        if not data.endswith(b'\n'):
+            # truncated by the connection closing
+            server_end.shutdown(socket.SHUT_WR)
+        with pytest.raises(daemon.DaemonError, match='Invalid message'):
+            client._read()
+
+def test_default_socket_dir_is_private(tmp_path, monkeypatch):
+    monkeypatch.delenv('XDG_RUNTIME_DIR', raising=False)
+    monkeypatch.setattr(daemon.tempfile, 'tempdir', str(tmp_path))
+    path = daemon.default_socket_path()
+    assert path == str(tmp_path / f'proxen-{os.getuid()}' / 'proxen.sock')
+    srv = daemon.Server(proxy=sysproxy.Proxy(str(tmp_path / 'proxy.json'), sysproxy.Sysenv(False, home=str(tmp_path))),
+                        watch=False)
+    srv.bind()
+    thread = threading.Thread(target=srv.serve_forever)
+    thread.start()
+    try:
+        assert os.stat(os.path.dirname(path)).st_mode & 0o777 == 0o700
+        with daemon.Client.connect(path) as client:
+            assert client.call('ping')['pid'] == os.getpid()
+        # a client refuses a daemon run by another user
+        monkeypatch.setattr(daemon.os, 'getuid', lambda: os.geteuid() + 1)
+        with pytest.raises(daemon.DaemonError, match='another user'):
+            daemon.Client.connect(path)
+    finally:
+        srv.shutdown()
+        thread.join(10)
+
+def test_shared_socket_dir_is_refused(tmp_path, monkeypatch):
+    monkeypatch.delenv('XDG_RUNTIME_DIR', raising=False)
+    monkeypatch.setattr(daemon.tempfile, 'tempdir', str(tmp_path))
+    # e.g. pre-created by another user
+    shared = tmp_path / f'proxen-{os.getuid()}'
+    shared.mkdir()
+    shared.chmod(0o777)
+    srv = daemon.Server(proxy=sysproxy.Proxy(str(tmp_path / 'proxy.json'), sysproxy.Sysenv(False, home=str(tmp_path))),
+                        watch=False)
+    with pytest.raises(daemon.DaemonError, match='current user only'):
+        srv.bind()
+    srv.close()
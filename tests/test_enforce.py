@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+import sysproxy
+import enforce
+
+pytestmark = pytest.mark.skipif(sysproxy.OS == 'Windows', reason='Unix only')
+
+DCONFIG = {'enabled': True, 'noproxy': 'localhost', 'http_proxy': {'host': 'proxy', 'port': 3128}}
+WANTED = 'http://proxy:3128'
+
+@pytest.fixture
+def sysenv(tmp_path):
+    os.makedirs(tmp_path / 'etc')
+    os.makedirs(tmp_path / 'home')
+    return sysproxy.Sysenv(False, home=str(tmp_path / 'home'), root=str(tmp_path))
+
+def write(path, text):
+    with open(path, 'w', encoding='utf-8') as f_:
+        f_.write(text)
+
+def read(path):
+    with open(path, encoding='utf-8') as f_:
+        return f_.read()
+
+def in_sync(sysenv):
+    write(sysenv.system_path('/etc/environment'), f'http_proxy="{WANTED}"\nHTTP_PROXY="{WANTED}"\n'
+          'no_proxy="localhost"\nNO_PROXY="localhost"\nPATH="/usr/bin"\n')
+
+def test_stat_only_path(sysenv):
+    in_sync(sysenv)
+    enforcer = enforce.Enforcer(DCONFIG, sysenv)
+    assert enforcer.check() == 'ok'
+    hashed, parsed = enforcer.stats['hashed'], enforcer.stats['parsed']
+    assert parsed == 1
+    # nothing changed: no file hashed or parsed
+    assert enforcer.check() == 'ok'
+    assert enforcer.stats['stat_only'] == 1
+    assert (enforcer.stats['hashed'], enforcer.stats['parsed']) == (hashed, parsed)
+    # touched but not changed: hashed, not parsed
+    path = sysenv.system_path('/etc/environment')
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert enforcer.check() == 'ok'
+    assert enforcer.stats['hashed'] == hashed + 1
+    assert enforcer.stats['parsed'] == parsed
+
+def test_drift_repair(sysenv):
+    in_sync(sysenv)
+    bashrc = os.path.join(sysenv.home, '.bashrc')
+    write(bashrc, 'alias ll="ls -l"\nexport http_proxy="http://other:8080"\n')
+    enforcer = enforce.Enforcer(DCONFIG, sysenv)
+    assert enforcer.check() == 'repaired'
+    assert enforcer.stats['drifts'] == enforcer.stats['repairs'] == 1
+    assert len(enforcer.latencies) == 1
+    text = read(bashrc)
+    assert 'http://other:8080' not in text
+    assert 'alias ll="ls -l"' in text
+    assert enforcer.effective()['http_proxy'] == WANTED
+    # unrelated variables are not touched
+    assert 'PATH="/usr/bin"' in read(sysenv.system_path('/etc/environment'))
+    assert enforcer.check() == 'ok'
+
+def test_repair_deferred_by_backoff(sysenv, monkeypatch):
+    monkeypatch.setattr(enforce, 'BACKOFF_MIN', 60.0)
+    in_sync(sysenv)
+    bashrc = os.path.join(sysenv.home, '.bashrc')
+    enforcer = enforce.Enforcer(DCONFIG, sysenv)
+    write(bashrc, 'export http_proxy="http://other:8080"\n')
+    assert enforcer.check() == 'repaired'
+    # another writer fights back: the drift is detected but not repaired yet
+    write(bashrc, 'export http_proxy="http://again:8080"\n')
+    assert enforcer.check() == 'deferred'
+    assert enforcer.check() == 'deferred'
+    assert enforcer.stats['drifts'] == 2
+    assert enforcer.stats['deferred'] == 2
+    assert 'http://again:8080' in read(bashrc)
+    # once the backoff has elapsed, the repair runs and the next backoff doubles
+    enforcer._next_repair = 0.0
+    assert enforcer.check() == 'repaired'
+    assert enforcer._backoff == 120.0
+    assert 'http://again:8080' not in read(bashrc)
+    assert enforcer.stats['repairs'] == 2
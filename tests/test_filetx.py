@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import os, time, multiprocessing
+
+import pytest
+
+import filetx
+import sysproxy
+
+pytestmark = pytest.mark.skipif(sysproxy.OS == 'Windows', reason='Unix profile files only')
+
+WRITERS = 2
+ROUNDS = 30
+
+def _write_env(home, value, barrier, rounds):
+    # widen the window between the file transactions (the race shows up even on a single CPU)
+    update = filetx.update
+    def slow_update(*args, **kwargs):
+        res = update(*args, **kwargs)
+        time.sleep(0.002)
+        return res
+    filetx.update = slow_update
+    sysenv = sysproxy.Sysenv(False, home=home)
+    for i in range(rounds):
+        barrier.wait()
+        if not sysenv.unix_write_env('http_proxy', f'{value}:{i}'):
+            os._exit(1)
+
+def _exports(path):
+    with open(path, encoding='utf-8') as f_:
+        return [(name, value) for _, name, value in sysproxy.parse_exports(f_.read())]
+
+def test_concurrent_writers_leave_one_export(tmp_path):
+    home = str(tmp_path)
+    rcfile = sysproxy.Sysenv(False, home=home).unix_file_local
+    with open(rcfile, 'w', encoding='utf-8') as f_:
+        f_.write('alias ll="ls -l"\n')
+    ctx = multiprocessing.get_context('fork')
+    barrier = ctx.Barrier(WRITERS)
+    procs = [ctx.Process(target=_write_env, args=(home, f'http://writer{n}', barrier, ROUNDS))
+             for n in range(WRITERS)]
+    for proc in procs: proc.start()
+    for proc in procs: proc.join(60)
+    assert all(proc.exitcode == 0 for proc in procs)
+
+    exports = _exports(rcfile)
+    names = [name for name, _ in exports]
+    assert sorted(names) == ['HTTP_PROXY', 'http_proxy']
+    assert exports[0][1] == exports[1][1]
+    assert exports[0][1].endswith(f':{ROUNDS - 1}')
+    with open(rcfile, encoding='utf-8') as f_:
+        assert f_.read().startswith('alias ll="ls -l"\n')
+
+def test_update_transform(tmp_path):
+    path = str(tmp_path / 'profile')
+    assert not filetx.update(path, lambda txt: txt + 'x')
+    assert filetx.update(path, lambda txt: txt + 'export a=1\n', create=True)
+    assert not filetx.update(path, lambda txt: txt)
+    with open(path, encoding='utf-8') as f_:
+        assert f_.read() == 'export a=1\n'
+
+def test_update_keeps_undecodable_bytes(tmp_path):
+    path = str(tmp_path / 'profile')
+    with open(path, 'wb') as f_:
+        f_.write(b'# caf\xe9\nexport http_proxy="http://old:1"\n')
+    assert sysproxy.Sysenv(False, home=str(tmp_path))._unix_delete_from_file('http_proxy', path)
+    with open(path, 'rb') as f_:
+        assert f_.read() == b'# caf\xe9\n'
+
+def test_failed_write_keeps_file(tmp_path, monkeypatch):
+    path = str(tmp_path / 'profile')
+    with open(path, 'w', encoding='utf-8') as f_:
+        f_.write('export a=1\n')
+    def no_space(fd):
+        raise OSError(28, 'No space left on device')
+    monkeypatch.setattr(os, 'fsync', no_space)
+    with pytest.raises(OSError):
+        filetx.update(path, lambda txt: '')
+    with open(path, encoding='utf-8') as f_:
+        assert f_.read() == 'export a=1\n'
+    assert os.listdir(tmp_path) == ['profile']
+
+def test_update_keeps_mode_and_symlink(tmp_path):
+    target = tmp_path / 'dotfiles_bashrc'
+    target.write_text('export a=1\n')
+    os.chmod(target, 0o600)
+    link = tmp_path / '.bashrc'
+    link.symlink_to(target)
+    assert filetx.update(str(link), lambda txt: txt + 'export b=2\n')
+    assert link.is_symlink()
+    assert target.read_text() == 'export a=1\nexport b=2\n'
+    assert os.stat(target).st_mode & 0o777 == 0o600
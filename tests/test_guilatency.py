@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+import sysproxy
+
+pytestmark = pytest.mark.skipif(sysproxy.OS == 'Windows', reason='Unix only')
+
+@pytest.fixture
+def guilatency(monkeypatch):
+    monkeypatch.setenv('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        import qtimports
+    except ImportError:
+        pytest.skip('Qt is not installed')
+    import utils
+    from bench import guilatency
+    # the GUI saves the app settings on close; run_gui_suite() changes the working dir
+    monkeypatch.setattr(utils, 'config_save', lambda: None)
+    monkeypatch.chdir(os.getcwd())
+    return guilatency
+
+def test_gui_suite_smoke(guilatency):
+    results = guilatency.run_gui_suite(nvars=50, repeat=1, lines=50)
+    scenarios = ('startup', 'apply', 'toggle', 'env_open', 'env_refresh')
+    for scenario in scenarios:
+        for metric in ('p50_stall', 'p99_stall', 'max_stall'):
+            res = results['results'][f'gui_{scenario}:{metric}']
+            assert res['runs'] == 1 and 0 <= res['min_ms'] <= res['max_ms']
+        assert isinstance(results['freezes'][f'gui_{scenario}:freezes'][0], int)
+    # the freeze counts are not reported as times
+    assert not any(key.endswith(':freezes') for key in results['results'])
+    assert results['results']['gui_startup:tti']['median_ms'] > 0
+    assert 'gui_apply:freezes' in guilatency.format_freezes(results)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+import launcher
+
+def test_load_config_json():
+    dconfig = {'enabled': True, 'noproxy': 'localhost', 'http_proxy': {'host': 'proxy', 'port': 8080}}
+    assert launcher.load_config(json.dumps(dconfig)) == dconfig
+
+@pytest.mark.parametrize('spec', [
+    '{"http_proxy": "http://x:1"}',
+    '{"http_proxy": {"host": "x", "port": "1"}}',
+    '{"http_proxy": {"host": "x", "port": 70000}}',
+    '{"https_proxy": {"host": 1}}',
+    '{"noproxy": ["localhost"]}',
+    '[]',
+    '{"http_proxy": ',
+])
+def test_load_config_invalid(spec):
+    with pytest.raises(ValueError):
+        launcher.load_config(spec)
+
+def test_child_env_replaces_proxies():
+    env = launcher.child_env({'http_proxy': {'host': 'proxy', 'port': 8080}, 'noproxy': 'localhost'},
+                             {'PATH': '/bin', 'HTTPS_PROXY': 'http://old:1', 'no_proxy': 'old'})
+    assert env == {'PATH': '/bin', 'http_proxy': 'http://proxy:8080', 'HTTP_PROXY': 'http://proxy:8080',
+                   'no_proxy': 'localhost', 'NO_PROXY': 'localhost'}
+
+@pytest.mark.parametrize('content', [b'{"noproxy": "\xff\xfe"}', b'{"noproxy": '])
+def test_load_config_bad_file(tmp_path, content):
+    path = tmp_path / 'proxy.json'
+    path.write_bytes(content)
+    with pytest.raises(ValueError, match=str(path)):
+        launcher.load_config(str(path))
+
+def test_load_config_unreadable_file(tmp_path, monkeypatch):
+    path = tmp_path / 'proxy.json'
+    path.write_text('{}')
+    def fail(*args, **kwargs):
+        raise PermissionError(13, 'Permission denied')
+    monkeypatch.setattr('builtins.open', fail)
+    with pytest.raises(ValueError, match='Cannot read'):
+        launcher.load_config(str(path))
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+import loginenv
+import sysproxy
+
+pytestmark = pytest.mark.skipif(sysproxy.OS == 'Windows', reason='Unix only')
+
+@pytest.fixture
+def root(tmp_path):
+    for d in ('etc/profile.d', 'home/user'):
+        os.makedirs(tmp_path / d)
+    loginenv.clear_cache()
+    yield tmp_path
+    loginenv.clear_cache()
+
+def write(root, path, text):
+    (root / path).write_text(text)
+    # a new mtime for each write, even within the filesystem timestamp granularity
+    st = os.stat(root / path)
+    os.utime(root / path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+def simulate(root, shell='bash'):
+    return loginenv.simulate(shell, str(root / 'home' / 'user'), str(root))
+
+def test_pam_env_is_literal(root):
+    write(root, 'etc/environment', 'http_proxy=http://u:p$ss@h:1\nno_proxy=a;b\nFTP_PROXY="http://q:2"\n# x=1\n')
+    env = simulate(root)
+    assert env['http_proxy'] == 'http://u:p$ss@h:1'
+    assert env['no_proxy'] == 'a;b'
+    assert env['FTP_PROXY'] == 'http://q:2'
+    assert not 'x' in env
+
+def test_includes_and_glob_loops(root):
+    write(root, 'etc/profile', 'for i in /etc/profile.d/*.sh; do\n  if [ -r $i ]; then\n    . $i\n  fi\ndone\nunset i\n')
+    write(root, 'etc/profile.d/a.sh', 'export http_proxy=http://a:1\n')
+    write(root, 'etc/profile.d/b.sh', 'export http_proxy=http://b:2\n')
+    write(root, 'home/user/.profile', '[ -f ~/.proxyrc ] && . ~/.proxyrc\n')
+    write(root, 'home/user/.proxyrc', 'https_proxy="http://home:3"; export https_proxy\n')
+    env = simulate(root)
+    # the glob is sorted: b.sh is read last
+    assert env['http_proxy'] == 'http://b:2'
+    assert env['https_proxy'] == 'http://home:3'
+    assert not 'i' in env
+
+def test_default_expansion(root):
+    write(root, 'home/user/.profile', 'BASE=http://base:1\nexport http_proxy=${BASE:-http://x:1}\n'
+                                      'export no_proxy=${UNSET_VAR:-localhost}\nexport EMPTY=\nexport ftp_proxy="${EMPTY:-$BASE}"\n')
+    env = simulate(root)
+    assert env['http_proxy'] == 'http://base:1'
+    assert env['no_proxy'] == 'localhost'
+    assert env['ftp_proxy'] == 'http://base:1'
+    # a plain assignment is not exported
+    assert not 'BASE' in env
+
+def test_csh_setenv(root):
+    write(root, 'etc/csh.login', 'setenv http_proxy http://csh:1\nsetenv FOO bar\n')
+    write(root, 'home/user/.cshrc', 'setenv no_proxy "localhost,.lan"\nunsetenv FOO\n')
+    env = simulate(root, '/bin/tcsh')
+    assert env['http_proxy'] == 'http://csh:1'
+    assert env['no_proxy'] == 'localhost,.lan'
+    assert not 'FOO' in env
+    assert loginenv.proxy_env('csh', str(root / 'home' / 'user'), str(root)) == \
+           {'http_proxy': 'http://csh:1', 'no_proxy': 'localhost,.lan'}
+
+def test_cache_invalidated_by_stat(root):
+    write(root, 'etc/profile', 'for i in /etc/profile.d/*.sh; do . $i; done\n')
+    write(root, 'home/user/.profile', 'export http_proxy=http://old:1\n')
+    env = simulate(root)
+    assert env['http_proxy'] == 'http://old:1'
+    # unchanged files: the memoized result
+    assert simulate(root) is env
+    write(root, 'home/user/.profile', 'export http_proxy=http://new:2\n')
+    assert simulate(root)['http_proxy'] == 'http://new:2'
+    # a new file in a globbed dir
+    write(root, 'etc/profile.d/z.sh', 'export no_proxy=localhost\n')
+    assert simulate(root)['no_proxy'] == 'localhost'
+    # a new file earlier in the startup order: read instead of ~/.profile
+    write(root, 'home/user/.bash_profile', 'export https_proxy=http://bash:3\n')
+    env = simulate(root)
+    assert env['https_proxy'] == 'http://bash:3' and not 'http_proxy' in env
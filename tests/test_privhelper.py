@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import io, sys, json, time
+
+import pytest
+
+import privhelper
+import sysproxy
+import watcher
+
+pytestmark = pytest.mark.skipif(sysproxy.OS == 'Windows', reason='Unix only')
+
+## a helper that starts and then never responds (it exits when its stdin is closed)
+HUNG_HELPER = 'import sys; print(\'{"ready": true}\', flush=True); sys.stdin.read()'
+
+def test_apply_times_out_on_hung_helper(monkeypatch):
+    monkeypatch.setattr(privhelper, 'RESPONSE_TIMEOUT', 0.5)
+    # the elevation command runs the hung helper instead (it ignores the helper script args)
+    helper = privhelper.PrivHelper([sys.executable, '-c', HUNG_HELPER])
+    process = None
+    try:
+        helper.start()
+        process = helper.process
+        t0 = time.monotonic()
+        assert not helper.apply({'http_proxy': 'http://proxy:3128'})
+        assert time.monotonic() - t0 < 10
+        assert helper.process is None
+    finally:
+        helper.close()
+        if process and process.poll() is None:
+            process.kill()
+
+def test_validate():
+    assert privhelper.validate({'HTTP_PROXY': 'http://proxy:3128', 'no_proxy': None, 'ftp_proxy': 3128}) == \
+           {'http_proxy': 'http://proxy:3128', 'no_proxy': None, 'ftp_proxy': '3128'}
+    with pytest.raises(ValueError, match='dictionary'):
+        privhelper.validate([('http_proxy', 'x')])
+    with pytest.raises(ValueError, match='not allowed'):
+        privhelper.validate({'PATH': '/tmp'})
+    with pytest.raises(ValueError, match='not allowed'):
+        privhelper.validate({1: 'x'})
+    for value in ('http://p"; rm -rf /; "', 'http://`id`:1', 'http://$(id):1', 'http://${HOME}:1',
+                  'http://p:1\\', 'http://p:1\nexport PATH=/tmp', 'http://p:1\r'):
+        with pytest.raises(ValueError, match='Invalid value'):
+            privhelper.validate({'http_proxy': value})
+
+@pytest.fixture
+def root(tmp_path):
+    (tmp_path / 'etc').mkdir()
+    return str(tmp_path)
+
+def system_exports(root):
+    return watcher.read_exports(sysproxy.Sysenv(False, root=root).unix_file_system)
+
+def test_serve_requests(root):
+    requests = [{'id': 1, 'changes': {'http_proxy': 'http://proxy:3128'}},
+                {'id': 2, 'changes': {'PATH': '/tmp'}},
+                {'id': 3, 'changes': {'http_proxy': 'http://p:1\nexport PATH=/tmp'}}]
+    stdin = io.BytesIO(b''.join(json.dumps(r).encode() + b'\n' for r in requests) + b'not json\n')
+    stdout = io.BytesIO()
+    privhelper.serve(stdin, stdout, root)
+    responses = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    assert responses[0]['ready']
+    assert responses[1] == {'id': 1, 'ok': True}
+    assert [(r['id'], r['ok']) for r in responses[2:]] == [(2, False), (3, False), (None, False)]
+    assert system_exports(root) == {'http_proxy': 'http://proxy:3128', 'HTTP_PROXY': 'http://proxy:3128'}
+
+def test_helper_process_over_pipe(root):
+    # an empty elevation command runs the helper unprivileged (on the temp root)
+    helper = privhelper.PrivHelper([], root=root)
+    try:
+        assert helper.apply({'http_proxy': 'http://proxy:3128', 'no_proxy': 'localhost'})
+        assert system_exports(root)['no_proxy'] == 'localhost'
+        assert not helper.apply({'no_proxy': '$(id)'})
+        assert helper.apply({'no_proxy': None})
+        assert system_exports(root) == {'http_proxy': 'http://proxy:3128', 'HTTP_PROXY': 'http://proxy:3128'}
+    finally:
+        helper.close()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import os, time, threading
+
+import pytest
+
+import sysproxy
+import watcher
+
+pytestmark = pytest.mark.skipif(sysproxy.OS == 'Windows', reason='Unix only')
+
+@pytest.fixture
+def sysenv(tmp_path):
+    os.makedirs(tmp_path / 'etc')
+    os.makedirs(tmp_path / 'home')
+    return sysproxy.Sysenv(False, home=str(tmp_path / 'home'), root=str(tmp_path))
+
+def write(path, text):
+    with open(path, 'w', encoding='utf-8') as f_:
+        f_.write(text)
+
+## @returns `tuple` `(watcher, events)`: a started watcher and the list of its reports
+def start_watcher(sysenv, polling, debounce_ms=50):
+    events = []
+    reported = threading.Event()
+    def on_change(changes, paths):
+        events.append(([(c.action, c.envname, c.value) for c in changes], paths))
+        reported.set()
+    w = watcher.Watcher(on_change, sysenv, debounce_ms, polling)
+    if polling:
+        w._backend.interval = 0.02
+    w.reported = reported
+    w.start()
+    return w, events
+
+@pytest.mark.parametrize('polling', [True, False])
+def test_file_created_later_is_watched(sysenv, polling):
+    bashrc = os.path.join(sysenv.home, '.bashrc')
+    assert not os.path.exists(bashrc)
+    w, events = start_watcher(sysenv, polling)
+    try:
+        write(bashrc, 'export http_proxy="http://new:3128"\n')
+        assert w.reported.wait(5)
+    finally:
+        w.stop()
+    assert events == [([('create', 'http_proxy', 'http://new:3128')], [bashrc])]
+
+@pytest.mark.parametrize('polling', [True, False])
+def test_debounce_wait_is_capped(sysenv, polling, monkeypatch):
+    monkeypatch.setattr(watcher, 'MAX_DEBOUNCE_MS', 300)
+    profile = os.path.join(sysenv.home, '.profile')
+    w, events = start_watcher(sysenv, polling, debounce_ms=200)
+    try:
+        # keep writing faster than the debounce interval for well over the cap
+        t_end = time.monotonic() + 3
+        i = 0
+        while time.monotonic() < t_end and not w.reported.is_set():
+            write(profile, f'export no_proxy="host{i}"\n')
+            i += 1
+            time.sleep(0.03)
+        assert w.reported.is_set()
+    finally:
+        w.stop()
+    assert events[0][0][0][:2] == ('create', 'no_proxy')
+
+def test_process_reports_effective_changes(sysenv):
+    env_file = os.path.join(sysenv.root, 'etc', 'environment')
+    profile = os.path.join(sysenv.home, '.profile')
+    write(env_file, 'http_proxy=http://sys:1\nno_proxy=localhost\n')
+    w = watcher.Watcher(lambda changes, paths: None, sysenv, polling=True)
+    assert w.values == {'http_proxy': 'http://sys:1', 'no_proxy': 'localhost'}
+    # the user files override the system files
+    write(profile, 'export http_proxy="http://user:2"\nexport ftp_proxy=http://ftp:3\n')
+    changes = w.process({profile})
+    assert [(c.action, c.envname, c.value) for c in changes] == [('create', 'ftp_proxy', 'http://ftp:3'),
+                                                                ('create', 'http_proxy', 'http://user:2')]
+    # a system change hidden by a user export is not reported
+    write(env_file, 'http_proxy=http://sys:9\nno_proxy=localhost\n')
+    assert w.process({env_file}) == []
+    # unchanged files
+    assert w.process({env_file, profile}) == []
+    os.remove(profile)
+    changes = w.process({profile})
+    assert [(c.action, c.envname) for c in changes] == [('unset', 'ftp_proxy'), ('create', 'http_proxy')]
+    assert w.values['http_proxy'] == 'http://sys:9'
+
+def test_polling_backend(tmp_path):
+    path = str(tmp_path / 'profile')
+    backend = watcher.PollingBackend([path], interval=0.01)
+    assert backend.wait(0) == set()
+    write(path, 'export a=1\n')
+    assert backend.wait(0) == {path}
+    assert backend.wait(0) == set()
+    write(path, 'export a=12\n')
+    assert backend.wait(0) == {path}
+    os.remove(path)
+    assert backend.wait(0) == {path}
+    # an interrupted wait returns at once
+    backend.interval = 10
+    backend.interrupt()
+    t0 = time.monotonic()
+    assert backend.wait(10) == set()
+    assert time.monotonic() - t0 < 5
@@ -1,38 +1,184 @@
 # -*- coding: utf-8 -*-
 ## @package proxen.utils
 # @brief Globals and utility functions used across the app.
-import os, logging
-from config import *
+import os, queue, atexit, logging, logging.handlers, collections
+from config import CONFIG_FILE, get_config, config_save
 
 # --------------------------------------------------------------- #
 
-## `bool` debug mode switcher (`True` = print debug messages to console)
-DEBUG = CONFIG['app'].getboolean('debug', fallback=False) if 'app' in CONFIG else False
 ## `str` newline symbol
 NL = '\n'
 ## `str` default coding (for file IO)
 CODING = 'utf-8'
 ## `str` log message mask
 LOGMSGFORMAT = '[{asctime}] {message}'
-## `str` log file name (relative to project dir); empty = no log output
-LOGFILE = CONFIG['app'].get('logfile', None) if 'app' in CONFIG else None
 ## `logging.Logger` the global logger object
 logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
 ## `logging.Formatter` logging formatter object
 formatter = logging.Formatter(fmt=LOGMSGFORMAT, datefmt='%Y-%m-%d %H:%M:%S', style='{')
+## `int` default max log file size in bytes before it is rotated
+LOGMAXSIZE = 1024 * 1024
+## `int` default number of rotated log files to keep (`log.txt.1`, `log.txt.2` ...)
+LOGBACKUPS = 3
+## `int` default number of recent log records kept in memory (see RingBufferHandler)
+LOGBUFFER = 2000
+## `dict` log message types accepted by log() mapped to logging levels
+LOGLEVELS = {'info': logging.INFO, 'warn': logging.WARNING, 'error': logging.ERROR, 'debug': logging.DEBUG,
+             'critical': logging.CRITICAL, 'exception': logging.ERROR}
+## `bool` whether the log handlers have been attached (see setup_logging())
+_logging_ready = False
+## `logging.handlers.QueueListener` the background thread writing the log records (see setup_logging())
+_log_listener = None
+## `utils::RingBufferHandler` the in-memory buffer of the recent log records
+_log_buffer = None
 
-if DEBUG:
-    ch_debug = logging.StreamHandler()
-    ch_debug.setLevel(logging.DEBUG)
-    ch_debug.setFormatter(formatter)
-    logger.addHandler(ch_debug)
+## @returns `bool` debug mode switcher (`True` = print debug messages to console)
+def get_debug():
+    config = get_config()
+    return config['app'].getboolean('debug', fallback=False) if 'app' in config else False
 
-if LOGFILE:
-    ch_logfile = logging.FileHandler(os.path.abspath(LOGFILE), mode='w', encoding=CODING, delay=True)
-    ch_logfile.setLevel(logging.DEBUG)
-    ch_logfile.setFormatter(formatter)
-    logger.addHandler(ch_logfile)
+## @returns `str` log file name (relative to project dir); empty = no log output
+def get_logfile():
+    config = get_config()
+    return config['app'].get('logfile', None) if 'app' in config else None
+
+## @returns `int` max log file size in bytes (`logmaxsize` option); 0 = no rotation
+def get_logmaxsize():
+    config = get_config()
+    return config['app'].getint('logmaxsize', fallback=LOGMAXSIZE) if 'app' in config else LOGMAXSIZE
+
+## @returns `int` number of rotated log files to keep (`logbackups` option)
+def get_logbackups():
+    config = get_config()
+    return config['app'].getint('logbackups', fallback=LOGBACKUPS) if 'app' in config else LOGBACKUPS
+
+## @returns `bool` whether to maintain the shell env cache files (see envcache module)
+def get_envcache():
+    config = get_config()
+    return config['app'].getboolean('envcache', fallback=False) if 'app' in config else False
+
+## @returns `bool` whether to collect operation metrics (see metrics module)
+def get_metrics():
+    config = get_config()
+    return config['app'].getboolean('metrics', fallback=False) if 'app' in config else False
+
+## @returns `bool` whether to watch the profile files for external changes (see watcher module)
+def get_watch():
+    config = get_config()
+    return config['app'].getboolean('watch', fallback=True) if 'app' in config else True
+
+## @returns `bool` whether to write the system files through a privileged helper
+# process when not running as admin (see privhelper module)
+def get_privhelper():
+    config = get_config()
+    return config['app'].getboolean('privhelper', fallback=False) if 'app' in config else False
+
+## @returns `bool` whether to profile the slow operations (see profiling module)
+def get_profile():
+    config = get_config()
+    return config['app'].getboolean('profile', fallback=False) if 'app' in config else False
+
+## Lazy module attributes: `DEBUG`, `LOGFILE` and `CONFIG` are read from the config
+# on first access rather than on import.
+def __getattr__(name):
+    if name == 'DEBUG':
+        return get_debug()
+    if name == 'LOGFILE':
+        return get_logfile()
+    if name == 'CONFIG':
+        return get_config()
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+## @brief Log handler keeping the recent log records in a bounded in-memory buffer
+# (the oldest records are dropped) and notifying listeners of new records, e.g. a log viewer.
+class RingBufferHandler(logging.Handler):
+
+    ## @param capacity `int` max number of records to keep
+    def __init__(self, capacity=LOGBUFFER):
+        super().__init__(logging.DEBUG)
+        ## `collections.deque` the buffered records
+        self.records = collections.deque(maxlen=capacity)
+        ## `list` callables called with each new record (from the logging thread)
+        self.listeners = []
+
+    def emit(self, record):
+        self.records.append(record)
+        for listener in self.listeners:
+            try:
+                listener(record)
+            except Exception:
+                self.handleError(record)
+
+    ## @returns `list` a snapshot of the buffered records
+    # @param level `int` minimum level of the records to return
+    def snapshot(self, level=logging.NOTSET) -> list:
+        self.acquire()
+        try:
+            return [rec for rec in self.records if rec.levelno >= level]
+        finally:
+            self.release()
+
+## Attaches the log handlers to the global logger (once).
+# Called automatically by log(), so importing this module has no logging side effects.
+#
+# The logger itself has a single `QueueHandler`: records are passed through a queue to
+# a background thread (`QueueListener`) which feeds the actual handlers:
+# - console output (in debug mode only)
+# - rotating log file (size-capped, see get_logmaxsize() and get_logbackups())
+# - in-memory ring buffer (see get_log_buffer())
+#
+# Debug messages are discarded before formatting unless the debug mode is on.
+def setup_logging():
+    global _logging_ready, _log_listener, _log_buffer
+    if _logging_ready:
+        return
+    _logging_ready = True
+    debug = get_debug()
+    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+
+    handlers = []
+    if debug:
+        ch_debug = logging.StreamHandler()
+        ch_debug.setLevel(logging.DEBUG)
+        ch_debug.setFormatter(formatter)
+        handlers.append(ch_debug)
+
+    logfile = get_logfile()
+    if logfile:
+        ch_logfile = logging.handlers.RotatingFileHandler(os.path.abspath(logfile), maxBytes=get_logmaxsize(), 
+                                                          backupCount=get_logbackups(), encoding=CODING, delay=True)
+        ch_logfile.setLevel(logging.DEBUG)
+        ch_logfile.setFormatter(formatter)
+        handlers.append(ch_logfile)
+
+    _log_buffer = RingBufferHandler()
+    _log_buffer.setFormatter(formatter)
+    handlers.append(_log_buffer)
+
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    _log_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    atexit.register(stop_logging)
+
+## Stops the background logging thread writing all the queued records
+# (called automatically at exit).
+def stop_logging():
+    global _log_listener
+    if _log_listener:
+        _log_listener.stop()
+        _log_listener = None
+
+## Waits until all the queued log records are written (e.g. before reading the log file).
+def flush_logging():
+    if _log_listener:
+        _log_listener.stop()
+        _log_listener.start()
+
+## @returns `utils::RingBufferHandler` the in-memory buffer of the recent log records
+def get_log_buffer():
+    if not _logging_ready: setup_logging()
+    return _log_buffer
 
 # --------------------------------------------------------------- #
 
@@ -54,22 +200,17 @@ def make_abspath(filename, root=''):
 # - `debug`: debug message
 # - `critical`: critical message 
 # - `exception`: exception message
-# @param args `positional args` passed to the logger
+# @param args `positional args` passed to the logger: use them to format the message
+# (`%`-style) rather than preformatted strings, so that skipped messages cost nothing
 # @param kwargs `keyword args` passed to the logger
 def log(what, how='info', *args, **kwargs):
-    logger = logging.getLogger()
-    if how == 'info':
-        logger.info(what, *args, **kwargs)
-    elif how == 'warn':
-        logger.warning(what, *args, **kwargs)
-    elif how == 'error':
-        logger.error(what, *args, **kwargs)
-    elif how == 'debug':
-        logger.debug(what, *args, **kwargs)
-    elif how == 'critical':
-        logger.critical(what, *args, **kwargs)
-    elif how == 'exception':
-        logger.exception(what, *args, **kwargs)
+    if not _logging_ready: setup_logging()
+    level = LOGLEVELS.get(how, None)
+    if level is None or not logger.isEnabledFor(level):
+        return
+    if how == 'exception':
+        kwargs.setdefault('exc_info', True)
+    logger.log(level, what, *args, **kwargs)
 
 # --------------------------------------------------------------- #    
 
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+## @package proxen.watcher
+# @brief Watches the Unix profile files for external changes (e.g. an admin editing
+# `/etc/environment`) and reports the changed variables.
+#
+# The watched files are all those in sysproxy::UNIX_PROFILE_FILES_USR and
+# sysproxy::UNIX_PROFILE_FILES_SYS, including the missing ones, so that a file created
+# later (e.g. the `~/.bashrc` written by the first apply) is noticed. Changes are
+# detected by `inotify` on Linux (through `ctypes`, watching the files' directories so
+# that editors replacing a file are noticed too) or else by polling the files' `stat`.
+#
+# Events are debounced (see DEBOUNCE_MS, at most MAX_DEBOUNCE_MS for a file that keeps
+# changing); then only the changed files are parsed again,
+# and the listener gets a list of sysproxy::Envchange objects: one per variable whose
+# effective value (user files over system files, later exports over earlier ones) has
+# changed: 'create' with the new value or 'unset'.
+import os, time, select, struct, threading, ctypes, ctypes.util
+
+import utils
+import sysproxy
+
+# --------------------------------------------------------------- #
+
+## `int` debounce interval (ms): changes are reported once the files are quiet for this long
+DEBOUNCE_MS = 300
+## `int` max debounce wait (ms): changes are reported at most this long after the first one,
+# even if the files keep changing
+MAX_DEBOUNCE_MS = 3000
+## `float` polling interval (seconds) when `inotify` is not available
+POLL_INTERVAL = 2.0
+## `int` inotify event masks (see `man inotify`)
+IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x2, 0x8, 0x40, 0x80, 0x100, 0x200
+## `int` inotify mask of the watched directory events
+IN_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+## `struct.Struct` inotify event header: wd, mask, cookie, len
+_EVENT_HEADER = struct.Struct('iIII')
+
+# --------------------------------------------------------------- #
+
+## @brief Change detector based on Linux `inotify` (through `ctypes`).
+class InotifyBackend:
+
+    ## @param paths `iterable` full paths to the watched files (existing or not;
+    # files in missing directories are not watched)
+    # @exception `OSError` `inotify` is not available
+    def __init__(self, paths):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        ## `int` the inotify file descriptor
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | getattr(os, 'O_CLOEXEC', 0))
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        ## `dict` watch descriptors: wd -> directory
+        self.dirs = {}
+        ## `dict` watched file names by directory
+        self.names = {}
+        for path in paths:
+            if os.path.isdir(os.path.dirname(path)):
+                self.names.setdefault(os.path.dirname(path), set()).add(os.path.basename(path))
+        for dirname in self.names:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(dirname), IN_WATCH_MASK)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for "{dirname}"')
+            self.dirs[wd] = dirname
+        ## `tuple` pipe interrupting a wait (see InotifyBackend::interrupt())
+        self.wake = os.pipe()
+
+    ## Waits for changes.
+    # @param timeout `float` max time to wait (seconds)
+    # @returns `set` full paths of the changed files (empty on timeout)
+    def wait(self, timeout) -> set:
+        changed = set()
+        ready = select.select([self.fd, self.wake[0]], [], [], timeout)[0]
+        if not self.fd in ready:
+            return changed
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        pos = 0
+        while pos + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, pos)
+            pos += _EVENT_HEADER.size
+            name = data[pos:pos + length].rstrip(b'\0').decode(errors='replace')
+            pos += length
+            dirname = self.dirs.get(wd)
+            if dirname and name in self.names.get(dirname, ()):
+                changed.add(os.path.join(dirname, name))
+        return changed
+
+    ## Interrupts a wait (from another thread).
+    def interrupt(self):
+        os.write(self.wake[1], b'\0')
+
+    ## Releases the inotify descriptor.
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            for fd in self.wake:
+                os.close(fd)
+            self.fd = -1
+
+## @brief Change detector polling the files' `stat`.
+class PollingBackend:
+
+    ## @param paths `iterable` full paths to the watched files (existing or not)
+    # @param interval `float` polling interval (seconds)
+    def __init__(self, paths, interval=POLL_INTERVAL):
+        ## `float` polling interval (seconds)
+        self.interval = interval
+        ## `dict` last seen `stat` signatures by path
+        self.sigs = {path: file_signature(path) for path in paths}
+        ## `threading.Event` set to interrupt a wait
+        self.wakeup = threading.Event()
+
+    ## Waits for changes (see InotifyBackend::wait()).
+    def wait(self, timeout) -> set:
+        self.wakeup.wait(min(timeout, self.interval))
+        changed = set()
+        for path, sig in self.sigs.items():
+            new_sig = file_signature(path)
+            if new_sig != sig:
+                self.sigs[path] = new_sig
+                changed.add(path)
+        return changed
+
+    ## Interrupts a wait (from another thread).
+    def interrupt(self):
+        self.wakeup.set()
+
+    def close(self):
+        pass
+
+## @returns `tuple` the `stat` signature of a file (`None` if it does not exist)
+def file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+## @returns `dict` `{name: value}` exported in a file (later exports override earlier ones;
+# empty if the file cannot be read); see sysproxy::parse_profile()
+def read_exports(path) -> dict:
+    try:
+        with open(path, 'r', encoding=utils.CODING, errors='replace') as f_:
+            return {name: value for _, name, value in sysproxy.parse_profile(f_.read(), path)}
+    except OSError:
+        return {}
+
+# --------------------------------------------------------------- #
+
+## @brief Background thread watching the profile files (see the module description).
+class Watcher:
+
+    ## @param on_change `callable` called (in the watcher thread) with a list of
+    # sysproxy::Envchange objects and a list of the changed files
+    # @param sysenv `sysproxy::Sysenv` defines the watched files (default = the current user's files)
+    # @param debounce_ms `int` debounce interval (ms)
+    # @param polling `bool` if `True`, poll even if `inotify` is available
+    def __init__(self, on_change, sysenv=None, debounce_ms=DEBOUNCE_MS, polling=False):
+        sysenv = sysenv or sysproxy.Sysenv(False)
+        ## `callable` the change listener
+        self.on_change = on_change
+        ## `int` debounce interval (ms)
+        self.debounce_ms = debounce_ms
+        ## `list` watched system files (existing or not, in the reading order)
+        self.system_files = list(dict.fromkeys(sysenv.system_files()))
+        ## `list` watched user files (existing or not, in the reading order)
+        self.user_files = list(dict.fromkeys(sysenv.user_files()))
+        ## `dict` last parsed exports by file
+        self.exports = {path: read_exports(path) for path in self.system_files + self.user_files}
+        ## `dict` effective values of the exported variables (see Watcher::effective())
+        self.values = self.effective()
+        ## `str` the change detector in use: 'inotify' or 'polling'
+        self.backend_name = 'polling'
+        self._backend = None
+        if not polling and sysproxy.OS == 'Linux':
+            try:
+                self._backend = InotifyBackend(self.exports)
+                self.backend_name = 'inotify'
+            except OSError as err:
+                utils.log('inotify is not available (%s), polling the profile files', 'info', err)
+        if self._backend is None:
+            self._backend = PollingBackend(self.exports)
+        self._stop = threading.Event()
+        self._thread = None
+
+    ## @returns `dict` effective values of the exported variables: system files, then
+    # user files, each in the reading order (later exports override earlier ones)
+    def effective(self) -> dict:
+        res = {}
+        for path in self.system_files + self.user_files:
+            res.update(self.exports.get(path, {}))
+        return res
+
+    ## Starts the watcher thread.
+    def start(self):
+        if self._thread: return
+        self._thread = threading.Thread(target=self._run, name='proxen-watcher', daemon=True)
+        self._thread.start()
+        utils.log('Watching %d profile file(s) (%s)', 'debug', len(self.exports), self.backend_name)
+
+    ## Stops the watcher thread.
+    def stop(self):
+        self._stop.set()
+        self._backend.interrupt()
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
+        self._backend.close()
+
+    ## Parses the changed files again and reports the changed variables.
+    # @param paths `set` the changed files
+    # @returns `list` sysproxy::Envchange objects for the changed variables
+    def process(self, paths) -> list:
+        for path in paths:
+            self.exports[path] = read_exports(path)
+        values = self.effective()
+        changes = []
+        for name in self.values.keys() | values.keys():
+            old, new = self.values.get(name), values.get(name)
+            if old == new: continue
+            changes.append(sysproxy.Envchange('unset', name) if new is None else sysproxy.Envchange('create', name, new))
+        self.values = values
+        return sorted(changes, key=lambda c: c.envname)
+
+    def _run(self):
+        pending = set()
+        deadline = None
+        # the latest time to report the pending changes (see MAX_DEBOUNCE_MS)
+        latest = None
+        while not self._stop.is_set():
+            timeout = POLL_INTERVAL if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                changed = self._backend.wait(timeout)
+            except OSError as err:
+                utils.log('Profile watcher failed: %s', 'error', err)
+                return
+            if changed:
+                now = time.monotonic()
+                if not pending:
+                    latest = now + MAX_DEBOUNCE_MS / 1000
+                pending |= changed
+                deadline = min(now + self.debounce_ms / 1000, latest)
+            if pending and time.monotonic() >= deadline:
+                paths, pending, deadline = pending, set(), None
+                changes = self.process(paths)
+                if changes:
+                    utils.log('External env changes in %s: %s', 'info', ', '.join(sorted(paths)), ', '.join(c.envname for c in changes))
+                    try:
+                        self.on_change(changes, sorted(paths))
+                    except Exception as err:
+                        utils.log('Profile watcher listener failed: %s', 'exception', err)